@@ -5,6 +5,10 @@ llc = "llc"
 tmp = "/tmp"
 pipeline_str = "sroa,simplifycfg,adce"
 minimized_pipeline_file = "a.p"
+frontend_cache_dir = ""
+object_cache_dir = ""
+object_cache_size = 1 << 30
+clang_version = ""
 import re
 import sys
 import os
@@ -14,6 +18,11 @@ import sys
 import os
 import subprocess
 import random
+import time
+import json
+import fcntl
+import hashlib
+import tempfile
 
 def parse_string_as_tree(s):
 
@@ -137,8 +146,177 @@ def pipeline_minimize(input_ll_str, passes_str):
             minimized_pass_tree.append(pass_atom_tree[i])
     return compose_atom_tree(minimized_pass_tree)
 
+# frontend cache: the output of the frontend only depends on the flags, the working directory, the clang version
+# and the contents of the source and of the headers it includes (its include closure, listed by the depfile)
+# <key>.manifest lists the include closures seen for the key of the flags, with the hashes of their files;
+# a closure whose files all still have these hashes names the cached <result>.bc and <result>.d
+# with -MMD from the build system, system headers are not in the closure; they change with the clang version
+frontend_cache_dir = os.environ.get("PIPEXPLORE_FRONTEND_CACHE", frontend_cache_dir)
+max_manifest_entries = 32
+
+file_hashes = {}
+def file_hash(path):
+    if path not in file_hashes:
+        h = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            file_hashes[path] = h.hexdigest()
+        except OSError:
+            file_hashes[path] = None
+    return file_hashes[path]
+
+def read_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+# concurrent compilers see either the old or the new file, never a partial one
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+# the prerequisites of a make rule "target: dep dep \\\n dep", spaces in paths are escaped
+def parse_depfile(text):
+    tokens = re.split(r"(?<!\\)\s+", text.replace("\\\n", " "))
+    tokens = [token.replace("\\ ", " ") for token in tokens if token]
+    # skip the target, and the phony targets of -MP
+    first = next((i for i, token in enumerate(tokens) if token.endswith(":")), len(tokens))
+    return [token for token in tokens[first + 1:] if not token.endswith(":")]
+
+def read_manifest(manifest_path):
+    manifest = read_file(manifest_path)
+    try:
+        return json.loads(manifest) if manifest is not None else []
+    except ValueError:
+        return []
+
+def frontend(args):
+    cmd = [clang, '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm', '-c', '-o', '-'] + args
+    if frontend_cache_dir == "":
+        return subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    os.makedirs(frontend_cache_dir, exist_ok=True)
+    key = hashlib.sha256("\0".join([clang_version, os.getcwd()] + args).encode("utf-8")).hexdigest()
+    manifest_path = os.path.join(frontend_cache_dir, key + ".manifest")
+    user_depfile = args[args.index('-MF') + 1] if '-MF' in args[:-1] else None
+
+    entries = read_manifest(manifest_path)
+    for entry in entries:
+        if all(file_hash(path) == digest for path, digest in entry["deps"].items()):
+            bitcode = read_file(os.path.join(frontend_cache_dir, entry["result"] + ".bc"))
+            depfile_text = read_file(os.path.join(frontend_cache_dir, entry["result"] + ".d"))
+            if bitcode is not None and depfile_text is not None:
+                # the build system still gets the depfile it asked for
+                if user_depfile is not None:
+                    with open(user_depfile, "wb") as f:
+                        f.write(depfile_text)
+                return bitcode
+
+    depfile = user_depfile
+    if depfile is None:
+        fd, depfile = tempfile.mkstemp(dir=frontend_cache_dir, prefix=".tmp", suffix=".d")
+        os.close(fd)
+        cmd += ['-MD', '-MF', depfile]
+    start = time.time()
+    try:
+        bitcode = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+        depfile_text = read_file(depfile)
+    finally:
+        if user_depfile is None:
+            os.remove(depfile)
+    if depfile_text is None:
+        return bitcode
+
+    deps = {}
+    for path in parse_depfile(depfile_text.decode("utf-8")):
+        try:
+            # a file modified while it was compiled may not have the hash of what was compiled
+            if os.stat(path).st_mtime >= start:
+                return bitcode
+        except OSError:
+            return bitcode
+        deps[path] = file_hash(path)
+    result = hashlib.sha256((key + json.dumps(sorted(deps.items()))).encode("utf-8")).hexdigest()
+    write_atomic(os.path.join(frontend_cache_dir, result + ".bc"), bitcode)
+    write_atomic(os.path.join(frontend_cache_dir, result + ".d"), depfile_text)
+    # the newest closure first; concurrent updates may drop an entry, which only costs a miss
+    entries = [entry for entry in read_manifest(manifest_path) if entry["result"] != result]
+    entries.insert(0, {"deps": deps, "result": result})
+    write_atomic(manifest_path, json.dumps(entries[:max_manifest_entries]).encode("utf-8"))
+    return bitcode
+
+# object cache: the object only depends on the frontend output, the normalized pipeline, the codegen flags
+# and the clang version; stats.json counts hits, misses and the size of the cache, updated under stats.lock,
+# and once the size exceeds object_cache_size the least recently used objects are evicted
+object_cache_dir = os.environ.get("PIPEXPLORE_OBJECT_CACHE", object_cache_dir)
+object_cache_size = int(os.environ.get("PIPEXPLORE_OBJECT_CACHE_SIZE", object_cache_size))
+
+def read_stats():
+    try:
+        with open(os.path.join(object_cache_dir, "stats.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"hits": 0, "misses": 0, "size": 0}
+
+def update_stats(hits=0, misses=0, added=0):
+    with open(os.path.join(object_cache_dir, "stats.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stats = read_stats()
+        stats["hits"] += hits
+        stats["misses"] += misses
+        stats["size"] += added
+        if stats["size"] > object_cache_size:
+            stats["size"] = evict(object_cache_size * 9 // 10)
+        write_atomic(os.path.join(object_cache_dir, "stats.json"), json.dumps(stats).encode("utf-8"))
+
+# remove the least recently used objects (hits refresh the modification time) until the cache fits
+# return: the size of the cache
+def evict(limit):
+    objects = []
+    for name in os.listdir(object_cache_dir):
+        if name.endswith(".o"):
+            try:
+                st = os.stat(os.path.join(object_cache_dir, name))
+            except OSError:
+                continue
+            objects.append((st.st_mtime, st.st_size, name))
+    objects.sort()
+    size = sum(object_size for _, object_size, _ in objects)
+    for _, object_size, name in objects:
+        if size <= limit:
+            break
+        try:
+            os.remove(os.path.join(object_cache_dir, name))
+            size -= object_size
+        except OSError:
+            pass
+    return size
+
+def object_cache_path(step1_result, opt_level):
+    h = hashlib.sha256()
+    for part in [clang_version, compose_atom_tree(parse_string_as_tree(pipeline_str)), '-O' + opt_level]:
+        h.update(part.encode("utf-8") + b"\0")
+    h.update(step1_result)
+    return os.path.join(object_cache_dir, h.hexdigest() + ".o")
+
 args = sys.argv[1:]
 
+if args == ['--show-stats']:
+    stats = read_stats() if object_cache_dir != "" else {"hits": 0, "misses": 0, "size": 0}
+    print(f"object cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} bytes in {object_cache_dir or '(disabled)'}")
+    exit(0)
+
 # processing flags
 # if -o specified ... record and remove
 output_file = None
@@ -168,11 +346,29 @@ def generate_random_str():
     return ''.join(random.choices(keys, k=32))
 
 # step 1. precompile with old and new flags
-step1_result_file = os.path.join(tmp, generate_random_str() + ".ll")
-cmd = [clang, '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm','-S', '-o', step1_result_file] + args
-subprocess.run(cmd, check=True)
+step1_result = frontend(args)
+
+# the object may be cached, unless the pipeline must be minimized
+object_path = None
+if object_cache_dir != "" and minimized_pipeline_file == "":
+    os.makedirs(object_cache_dir, exist_ok=True)
+    object_path = object_cache_path(step1_result, opt_level)
+    cached_object = read_file(object_path)
+    if cached_object is not None:
+        with open(output_file, "wb") as f:
+            f.write(cached_object)
+        # the object was read, but another compiler may evict it meanwhile: the hit only loses its bookkeeping
+        try:
+            os.utime(object_path)
+            update_stats(hits=1)
+        except OSError:
+            pass
+        exit(0)
 
 # step 2. optimize with pipeline
+step1_result_file = os.path.join(tmp, generate_random_str() + ".bc")
+with open(step1_result_file, "wb") as f:
+    f.write(step1_result)
 step2_result_file = os.path.join(tmp, generate_random_str() + ".ll")
 cmd = [opt, step1_result_file, '-passes=' + pipeline_str, '-S', '-o', step2_result_file]
 subprocess.run(cmd, check=True)
@@ -188,6 +384,12 @@ if minimized_pipeline_file != "":
 cmd = [clang, step2_result_file, '-c', '-o', output_file, '-O' + opt_level]
 subprocess.run(cmd, check=True)
 
+if object_path is not None:
+    compiled_object = read_file(output_file)
+    if compiled_object is not None:
+        write_atomic(object_path, compiled_object)
+        update_stats(misses=1, added=len(compiled_object))
+
 # step 4. remove temporary files, allowing failure
 try:
     os.remove(step1_result_file)
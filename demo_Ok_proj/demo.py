@@ -2,7 +2,6 @@
 import re
 import os
 import argparse
-import shutil
 import tempfile
 import subprocess
 from dataclasses import dataclass
@@ -10,7 +9,13 @@ from pathlib import Path
 import csv
 
 import pipexplore.interface as interface
+import pipexplore.llvm as llvm
 from pipexplore.runner import Runner
+from pipexplore.cache import FitnessCache
+from pipexplore.batch_map import reserve_cores, measurement_cores, pinned
+from pipexplore.scheduler import TwoTierScheduler
+from pipexplore.racing import Racer
+from pipexplore.cascade import Cascade
 
 
 @dataclass
@@ -29,69 +34,94 @@ class OkProfile(interface.Profile):
         return True
 
 
-class ParallelOkExperiment(interface.IndependentExperiment):
+# run the executable under perf stat
+# argument: executable path, number of repetitions
+# return: profile
+def perf_stat(executable, round=10) -> OkProfile:
+    assert executable is not None and Path(executable).exists(), "Executable file not found"
+    # perf stat runs on the reserved cores, if any, away from concurrent builds
+    with tempfile.NamedTemporaryFile() as log_file, pinned(measurement_cores()):
+        subprocess.run([
+            "perf", "stat", "-r",
+            str(round), "-x,", "-e", "cycles,instructions,task-clock", "-o", log_file.name,
+            executable
+        ],
+                       check=True,
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+        # Extract col 1 and col 3 from the CSV output as values and keys, create the OkProfile object
+        reader = csv.reader(open(log_file.name))
+        metrics = dict()
+
+        # Skip the first 2 rows (header and empty line)
+        next(reader)  # Skip first row
+        next(reader)  # Skip second row
+
+        for row in reader:
+            key, value = row[2], row[0]
+            if key in ('cycles:u', 'instructions:u'):
+                metrics[key[:-2]] = int(value)
+            elif key == 'task-clock:u':
+                metrics['task_clock'] = float(value)
+    return OkProfile(**metrics)
+
+
+class ParallelOkExperiment(interface.CMakeBuildPoolExperiment):
 
     def __init__(self, project_dir: Path):
-        super().__init__()
-        self.project_dir = project_dir
-        self.project_target_executable = None
-
-    def __del__(self):
-        if self.project_target_executable is not None:
-            to_be_deleted = Path(self.project_target_executable)
-            if to_be_deleted.exists() and to_be_deleted.parent == Path(tempfile.gettempdir()):
-                os.remove(to_be_deleted)
-
-    def compile(self, cxx_path: str):
-        # build in temporary directory
-        with tempfile.TemporaryDirectory() as build_dir:
-            subprocess.run(
-                f"cmake {self.project_dir.absolute().as_posix()} -DTRANSFORMER_PATH={cxx_path} && cmake --build .",
-                cwd=build_dir,
-                shell=True,
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL)
-            # Generate a unique path for the executable
-            unique_id = next(tempfile._get_candidate_names())
-            self.project_target_executable = f"{tempfile.gettempdir()}/{unique_id}"
-            shutil.move(Path(build_dir) / "main", self.project_target_executable)
+        # only opt.o is built by the transformer, main.c, no_opt.c and hidden_numbers.c are built once per build tree
+        super().__init__(project_dir, target="main", invalidated_outputs=["opt.o"])
+
+    def pre_optimization_ir(self) -> str:
+        # opt.c is compiled with -O2 by the custom command in CMakeLists.txt
+        return llvm.compile_file_noopt(self.project_dir / "opt.c", ["-O2"])
+
+    def run(self, round=10) -> OkProfile:
+        return perf_stat(self.executable, round)
+
+
+class InjectedOkExperiment(interface.ObjectInjectionExperiment):
+    """
+    Optimize opt.c and link it with the objects of a previous build, without CMake.
+    """
+    def __init__(self, project_dir: Path, objects):
+        super().__init__(project_dir / "opt.c", flags=["-O2"], objects=objects)
 
     def run(self, round=10) -> OkProfile:
-        assert self.project_target_executable is not None and Path(
-            self.project_target_executable).exists(), "Executable file not found"
-        with tempfile.NamedTemporaryFile() as log_file:
-            subprocess.run([
-                "perf", "stat", "-r",
-                str(round), "-x,", "-e", "cycles,instructions,task-clock", "-o", log_file.name,
-                self.project_target_executable
-            ],
-                           check=True,
-                           stdout=subprocess.DEVNULL,
-                           stderr=subprocess.DEVNULL)
-
-            # Extract col 1 and col 3 from the CSV output as values and keys, create the OkProfile object
-            reader = csv.reader(open(log_file.name))
-            metrics = dict()
-
-            # Skip the first 2 rows (header and empty line)
-            next(reader)  # Skip first row
-            next(reader)  # Skip second row
-
-            for row in reader:
-                key, value = row[2], row[0]
-                if key in ('cycles:u', 'instructions:u'):
-                    metrics[key[:-2]] = int(value)
-                elif key == 'task-clock:u':
-                    metrics['task_clock'] = float(value)
-        return OkProfile(**metrics)
+        return perf_stat(self.executable, round)
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--project-dir", type=Path, required=True)  # CMake project directory
 parser.add_argument("--output", type=Path, required=True)  # path to the final optimized compiler executable
+parser.add_argument("--cache-dir", type=Path, default=None)  # directory of the fitness cache, shared between runs
+parser.add_argument("--measure-cores", type=str, default="")  # comma separated cores reserved for perf stat, e.g. 2,3
+parser.add_argument("--steady-state", action=argparse.BooleanOptionalAction, default=None)  # refill every worker as soon as it finishes instead of by generation (default with --measure-cores)
+parser.add_argument("--racing", action="store_true")  # repeat perf stat adaptively instead of always 10 times
+parser.add_argument("--cascade", action="store_true")  # reject pipelines opt refuses, and reuse identical IR, before building
+parser.add_argument("--cost-tolerance", type=float, default=None)  # with --cascade, also reject IR this much costlier than the elites
+parser.add_argument("--surrogate", type=float, default=None)  # profile only this fraction of the children, ranked by a surrogate model (needs numpy)
+parser.add_argument("--objects", type=str, default="")  # comma separated objects of a previous build: link opt.c with them, without CMake
+parser.add_argument("--islands", type=int, default=1)  # number of populations evolving in separate processes
 args = parser.parse_args()
 
 if __name__ == "__main__":
-    experiment = ParallelOkExperiment(args.project_dir)
-    Runner(experiment, args.output).run()
+    if args.measure_cores:
+        reserve_cores(int(core) for core in args.measure_cores.split(","))
+    if args.objects:
+        experiment = InjectedOkExperiment(args.project_dir, args.objects.split(","))
+    else:
+        experiment = ParallelOkExperiment(args.project_dir)
+    fitness_cache = FitnessCache(args.cache_dir) if args.cache_dir else None
+    # with reserved cores, builds and perf stat runs go to separate pools, one measurement at a time
+    scheduler = TwoTierScheduler() if args.measure_cores else None
+    surrogate = None
+    if args.surrogate is not None:
+        from pipexplore.surrogate import Surrogate
+        surrogate = Surrogate(keep_fraction=args.surrogate)
+    Runner(experiment, args.output, fitness_cache=fitness_cache, scheduler=scheduler,
+           steady_state=args.steady_state, islands=args.islands,
+           racer=Racer() if args.racing else None,
+           cascade=Cascade(cost_tolerance=args.cost_tolerance) if args.cascade else None,
+           surrogate=surrogate).run()
@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import threading
+
+
+# the order of the GA: fitness decreasing, then length increasing
+# argument: profiled individual
+# return: key, larger is better
+def rank_key(individual):
+    return individual.profile.fitness(), - len(individual)
+
+
+class EliteArchive:
+    """
+    The best `capacity` distinct pipelines seen so far, replacing an ever-growing history.
+    Entries sit in a min-heap on rank_key, computed once per insertion, so the worst entry is evicted in
+    O(log capacity); a pipeline inserted again replaces its entry only if it ranks better, unless it is the
+    archived individual itself, re-measured (e.g. a survivor profiled again by evolve), whose new profile replaces the old.
+    With pareto=True, the archive also keeps the front of pipelines not dominated in (fitness, length).
+    """
+    def __init__(self, capacity: int, pareto: bool = False):
+        self.capacity = max(1, capacity)
+        self.heap = []     # [key, -sequence number, individual, live], the worst (and among equals the newest) first
+        self.entries = {}  # individual -> live heap entry, individuals compare by pipeline
+        self.sequence = itertools.count()
+        self.pareto = pareto
+        self.pareto_front = []  # [(fitness, length, individual), ...]
+        self.inserted = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    # argument: profiled individual
+    # return: True if the individual is in the archive afterwards
+    def insert(self, individual) -> bool:
+        key = rank_key(individual)
+        with self.lock:
+            self.inserted += 1
+            entry = self.entries.get(individual)
+            remeasured = entry is not None and entry[2] is individual and key != entry[0]
+            if self.pareto:
+                if remeasured:
+                    self.pareto_front = [point for point in self.pareto_front if point[2] is not individual]
+                self.update_front(key[0], len(individual), individual)
+            if entry is not None:
+                if key == entry[0] or (key < entry[0] and not remeasured):
+                    return entry[2] is individual
+                # lazily removed, skipped when it reaches the top of the heap
+                entry[3] = False
+                del self.entries[individual]
+            elif len(self.entries) >= self.capacity:
+                self.drop_stale()
+                if key <= self.heap[0][0]:
+                    return False
+                _, _, worst, _ = heapq.heappop(self.heap)
+                del self.entries[worst]
+                self.evicted += 1
+            entry = [key, - next(self.sequence), individual, True]
+            self.entries[individual] = entry
+            heapq.heappush(self.heap, entry)
+            if len(self.heap) > 2 * self.capacity:
+                # too many removed entries, rebuild
+                self.heap = [entry for entry in self.heap if entry[3]]
+                heapq.heapify(self.heap)
+            return True
+
+    # drop an archived individual, e.g. a survivor whose measurement failed when profiled again
+    # argument: individual, only its own entry is dropped, not the one of an equal pipeline
+    # return: True if it was in the archive
+    def remove(self, individual) -> bool:
+        with self.lock:
+            entry = self.entries.get(individual)
+            if entry is None or entry[2] is not individual:
+                return False
+            entry[3] = False
+            del self.entries[individual]
+            if self.pareto:
+                self.pareto_front = [point for point in self.pareto_front if point[2] is not individual]
+            return True
+
+    def extend(self, individuals) -> None:
+        for individual in individuals:
+            self.insert(individual)
+
+    # pop removed entries from the top of the heap
+    def drop_stale(self) -> None:
+        while self.heap and not self.heap[0][3]:
+            heapq.heappop(self.heap)
+
+    def update_front(self, fitness: float, length: int, individual) -> None:
+        for front_fitness, front_length, _ in self.pareto_front:
+            if front_fitness >= fitness and front_length <= length:
+                return
+        self.pareto_front = [(front_fitness, front_length, front_individual)
+                             for front_fitness, front_length, front_individual in self.pareto_front
+                             if not (fitness >= front_fitness and length <= front_length)]
+        self.pareto_front.append((fitness, length, individual))
+
+    # argument: number of entries, all of them if None
+    # return: the best individuals, best first
+    def top(self, count: int = None):
+        with self.lock:
+            entries = list(self.entries.values())
+        count = len(entries) if count is None else count
+        # earlier insertions first among equal keys
+        return [entry[2] for entry in heapq.nsmallest(count, entries, key=lambda entry: (-entry[0][0], -entry[0][1], -entry[1]))]
+
+    # the fitness of the count-th best entry
+    # return: fitness, None if the archive holds fewer entries
+    def nth_fitness(self, count: int):
+        with self.lock:
+            if len(self.entries) < count:
+                return None
+            return heapq.nlargest(count, (entry[0][0] for entry in self.entries.values()))[-1]
+
+    # return: the Pareto front in (fitness, length), best fitness first; empty unless pareto=True
+    def front(self):
+        with self.lock:
+            return [individual for _, _, individual in sorted(self.pareto_front, key=lambda x: (-x[0], x[1]))]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        with self.lock:
+            text = (f"elite archive: {len(self.entries)} of {self.capacity} kept, "
+                    f"{self.inserted} inserted, {self.evicted} evicted")
+            if self.pareto:
+                text += f", {len(self.pareto_front)} on the Pareto front"
+            return text
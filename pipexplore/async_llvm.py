@@ -0,0 +1,157 @@
+# asyncio variants of the toolchain calls in pipexplore.llvm
+# every tool runs as an asyncio subprocess, so many jobs can be in flight without one thread per job
+# cheap jobs (opt on a module) and expensive jobs (clang frontend, codegen, link) have separate budgets
+import os
+import asyncio
+import subprocess
+import weakref
+
+import pipexplore.llvm as llvm
+
+cheap_limit = 4 * (os.cpu_count() or 1)
+expensive_limit = os.cpu_count() or 1
+
+# semaphores are bound to the event loop that first uses them, so keep one pair per loop
+semaphores = weakref.WeakKeyDictionary()
+
+# set the global concurrency budget, applies to event loops started afterwards
+# argument: max number of cheap jobs, max number of expensive jobs
+def set_concurrency(cheap=None, expensive=None):
+    global cheap_limit, expensive_limit
+    if cheap is not None:
+        cheap_limit = cheap
+    if expensive is not None:
+        expensive_limit = expensive
+    semaphores.clear()
+
+def get_semaphore(expensive):
+    loop = asyncio.get_running_loop()
+    if loop not in semaphores:
+        semaphores[loop] = (asyncio.Semaphore(cheap_limit), asyncio.Semaphore(expensive_limit))
+    return semaphores[loop][1 if expensive else 0]
+
+# run a tool
+# argument: command, stdin bytes, whether the job counts against the expensive budget
+# return: completed process, stdout and stderr as bytes
+async def run_tool(command, input_bytes=None, expensive=False):
+    async with get_semaphore(expensive):
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=subprocess.PIPE if input_bytes is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        stdout, stderr = await process.communicate(input_bytes)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+async def opt_pipe(module, args):
+    return await run_tool([llvm.opt, "-"] + args + ["-o", "-"], llvm.module_bytes(module))
+
+# pipeline the module, see llvm.pipeline_opt
+# argument: module (ll string or bitcode bytes), passes string
+# return: optimized ll string
+async def pipeline_opt(input_ll_str, passes_str):
+    result = await opt_pipe(input_ll_str, ["-passes=" + passes_str, "-S"])
+    err = result.stderr.decode("utf-8")
+    if err != "":
+        print(err)
+    return result.stdout.decode("utf-8")
+
+# pipeline the module, keeping it as bitcode, see llvm.pipeline_opt_bc
+# argument: module (ll string or bitcode bytes), passes string
+# return: optimized bitcode bytes
+async def pipeline_opt_bc(module, passes_str):
+    result = await opt_pipe(module, ["-passes=" + passes_str])
+    err = result.stderr.decode("utf-8")
+    if err != "":
+        print(err)
+    return result.stdout
+
+# pipeline many modules at once
+# argument: [(module, passes string), ...]
+# return: [optimized ll string, ...]
+async def pipeline_opt_many(jobs):
+    return await asyncio.gather(*[pipeline_opt(module, passes_str) for module, passes_str in jobs])
+
+# the stripped optimized IR of many pipelines of one module, see cache.IRFingerprintIndex.optimized_ir
+# argument: ll string, [passes string, ...]
+# return: [stripped IR string, None if opt produced nothing, ...]
+async def optimized_ir_many(input_ll_str, passes_strs):
+    async def optimized_ir(passes_str):
+        optimized = await pipeline_opt(input_ll_str, passes_str)
+        return await strip(optimized) if optimized != "" else None
+    return await asyncio.gather(*[optimized_ir(passes_str) for passes_str in passes_strs])
+
+# strip the debug information and other metadata, see llvm.strip
+# argument: module (ll string or bitcode bytes)
+# return: stripped ll string
+async def strip(input_ll_str):
+    result = await opt_pipe(input_ll_str, ["-strip-debug", "-passes=strip", "-S"])
+    return llvm.strip_text(result.stdout.decode())
+
+# compile the c string, see llvm.compile_llvm_noopt
+# argument: c source string
+# return: compiled ll string before optimization, empty if failed
+async def compile_llvm_noopt(src_str):
+    cmd = [llvm.clang, '-g', '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm', '-S', '-x', 'c', '-', '-o', '-']
+    result = await run_tool(cmd, src_str.encode("utf-8"), expensive=True)
+    if result.returncode != 0:
+        return ""
+    return result.stdout.decode("utf-8")
+
+# get the pipeline string, see llvm.get_pipeline_str
+# argument: opt level
+# return: pipeline string
+async def get_pipeline_str(opt_level="O3"):
+    result = await run_tool([llvm.opt, "-" + opt_level, "--print-pipeline-passes"], b"")
+    return result.stdout.decode("utf-8")
+
+# compile a file the same way as a generated compiler: frontend, opt with the pipeline, codegen
+# argument: clang arguments naming the source (without -o), passes string, object file path, codegen opt level
+# return: True if compile success, False otherwise
+async def compile_with_pipeline(args, passes_str, output_file, opt_level="3"):
+    cmd = [llvm.clang, '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm', '-c', '-o', '-'] + list(args)
+    frontend = await run_tool(cmd, expensive=True)
+    if frontend.returncode != 0:
+        return False
+    optimized = await opt_pipe(frontend.stdout, ["-passes=" + passes_str])
+    if optimized.returncode != 0:
+        return False
+    cmd = [llvm.clang, '-x', 'ir', '-', '-c', '-o', str(output_file), '-O' + opt_level]
+    codegen = await run_tool(cmd, optimized.stdout, expensive=True)
+    return codegen.returncode == 0
+
+# link object files
+# argument: object file paths, executable path, extra linker flags
+# return: True if link success, False otherwise
+async def link(objects, output_file, flags=[]):
+    cmd = [llvm.clang] + [str(obj) for obj in objects] + ['-o', str(output_file)] + list(flags)
+    result = await run_tool(cmd, expensive=True)
+    return result.returncode == 0
+
+# minimize the pipeline, see llvm.pipeline_minimize
+# argument: ll string, passes string, whether to skip atoms with opt's change report (opt runs start a process each here)
+# return: minimized pipeline string
+async def pipeline_minimize(input_ll_str, passes_str, use_change_report=True):
+    pass_atom_tree = llvm.atomize_tree(llvm.parse_string_as_tree(passes_str))
+    changes = None
+    if use_change_report and llvm.change_report_marker not in pass_atom_tree:
+        result = await opt_pipe(input_ll_str, llvm.change_report_args(pass_atom_tree))
+        changes = llvm.parse_change_report(result.stderr, pass_atom_tree) if result.returncode == 0 else None
+    if changes is None:
+        changes = [True] * len(pass_atom_tree)
+
+    # the atoms the report cannot tell about, see llvm.pipeline_minimize, are run one by one
+    current_input = input_ll_str
+    minimized_pass_tree = []
+    check_next = True
+    for atom, changed in zip(pass_atom_tree, changes):
+        if not (changed or check_next):
+            continue
+        next_input = await pipeline_opt(current_input, atom)
+        if llvm.text_ll_equivalent(next_input, current_input):
+            check_next = check_next and not minimized_pass_tree
+        else:
+            minimized_pass_tree.append(atom)
+            check_next = True
+        current_input = next_input
+    return llvm.compose_atom_tree(minimized_pass_tree)
@@ -1,19 +1,98 @@
 # batch map with CPU core binding, avoiding CPU0
 # argument: atom list, batch size, atom function, but in parallel with CPU affinity
 # return: [atom_func(atom) for atom in atom_list]
-# 处理一个批次并绑定到特定核心
+# every worker (thread or process) is pinned to its own core, and the processes it starts inherit the pinning
+# cores reserved for measurements are never used by batch_map workers
 import os
+import queue
 import psutil
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-def batch_map(atom_list, batch_size, atom_func):
+can_pin = hasattr(os, "sched_setaffinity")
+# the cores of the process, read once: worker threads narrow their own affinity later
+process_cores = set(os.sched_getaffinity(0)) if can_pin else set()
+
+# cores reserved for timing-sensitive work, e.g. perf stat
+reserved_cores = set()
+
+# reserve cores for measurements
+# argument: iterable of core ids
+def reserve_cores(cores):
+    global reserved_cores
+    reserved_cores = set(cores)
+
+# the cores measurements should run on
+# return: set of core ids, None if no core is reserved
+def measurement_cores():
+    if not can_pin or not reserved_cores:
+        return None
+    cores = reserved_cores & process_cores
+    return cores or None
+
+# the cores batch_map workers may run on: the allowed ones, without the reserved ones and without CPU0
+# return: sorted list of core ids, empty if pinning is unsupported
+def worker_cores():
+    if not can_pin:
+        return []
+    cores = process_cores - reserved_cores
+    # CPU0 serves most interrupts, avoid it unless it is all we have
+    if len(cores) > 1:
+        cores.discard(0)
+    return sorted(cores)
+
+# pin the calling thread (and the processes it starts later) to the cores
+# argument: iterable of core ids, None to leave the affinity unchanged
+def pin(cores):
+    if can_pin and cores:
+        os.sched_setaffinity(0, set(cores))
+
+# run the block pinned to the cores, then restore the affinity
+# argument: iterable of core ids, None to leave the affinity unchanged
+@contextmanager
+def pinned(cores):
+    if not can_pin or not cores:
+        yield
+        return
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, set(cores))
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+# worker initializer, every worker takes one core from the queue
+def pin_worker(core_queue):
+    try:
+        pin([core_queue.get_nowait()])
+    except queue.Empty:
+        pass
+
+def batch_map(atom_list, batch_size, atom_func, use_processes=False, max_workers=None):
 
     # 获取物理核心数(C数)，而非逻辑处理器数(T数)
-    physical_cores = psutil.cpu_count(logical=False)
+    physical_cores = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    cores = worker_cores()
+    workers = max_workers or physical_cores
+    if cores:
+        workers = min(workers, len(cores))
+
+    if use_processes:
+        # the function and the atoms must pickle; batch_size atoms are sent to a worker at a time
+        context = multiprocessing.get_context("fork")
+        core_queue = context.Queue()
+        for core in cores[:workers]:
+            core_queue.put(core)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=pin_worker, initargs=(core_queue,)) as executor:
+            results = list(executor.map(atom_func, atom_list, chunksize=max(1, batch_size)))
+    else:
+        core_queue = queue.Queue()
+        for core in cores[:workers]:
+            core_queue.put(core)
+        with ThreadPoolExecutor(max_workers=workers, initializer=pin_worker, initargs=(core_queue,)) as executor:
+            # ThreadPoolExecutor.map自动将任务分配给可用线程
+            results = list(executor.map(atom_func, atom_list))
 
-    with ThreadPoolExecutor(max_workers=physical_cores) as executor:
-        # ThreadPoolExecutor.map自动将任务分配给可用线程
-        results = list(executor.map(atom_func, atom_list, chunksize=batch_size))
-    
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,309 @@
+import os
+import asyncio
+import hashlib
+import pickle
+import tempfile
+import threading
+from pathlib import Path
+
+import pipexplore.llvm as llvm
+import pipexplore.async_llvm as async_llvm
+from pipexplore.prefix_store import PrefixIRStore
+
+
+# hash several strings into one key
+# argument: list of strings
+# return: hex digest
+def digest(parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class FitnessCache:
+    """
+    Content-addressed, on-disk cache of experiment results.
+    An entry is keyed by (normalized pipeline, experiment identity, toolchain version), and holds
+    either the measured profile or the fact that the pipeline failed to compile or run.
+    Only failures stored with persistent=True (opt rejecting the pipeline) are written to disk, the others
+    may be transient (a timeout, a full disk, a busy machine) and are only remembered by this object.
+    Entries are written atomically, so several workers or several runs may share one directory.
+    """
+    def __init__(self, cache_dir: Path, max_bytes: int = 1 << 30, max_entries: int = 100000):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # keys of the failures of this run that are not on disk
+        self.failed = set()
+        # check the cache size every so many stores, instead of scanning the directory every time
+        self.eviction_interval = max(1, min(64, max_entries // 16))
+        self.stores_since_eviction = 0
+
+    # compute the key of an entry
+    # argument: pipeline string, experiment
+    # return: hex digest
+    def key(self, pipeline_str: str, experiment) -> str:
+        return digest(["pipeline", llvm.normalize_pipeline_str(pipeline_str), experiment.identity(), llvm.get_toolchain_version()])
+
+    # compute the key of an entry from the fingerprint of the optimized IR
+    # argument: IR fingerprint, experiment
+    # return: hex digest
+    def ir_key(self, fingerprint: str, experiment) -> str:
+        return digest(["ir", fingerprint, experiment.identity(), llvm.get_toolchain_version()])
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / (key + ".pkl")
+
+    # look up an entry
+    # argument: key
+    # return: (found, profile), profile is None if the pipeline is known to fail
+    def get(self, key: str):
+        with self.lock:
+            if key in self.failed:
+                self.hits += 1
+                return True, None
+        path = self.entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            # bump the modification time, eviction is least-recently-used
+            os.utime(path)
+        except FileNotFoundError:
+            entry = None
+        except Exception:
+            # a corrupted or incompatible entry is dropped
+            entry = None
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+        return True, entry["profile"]
+
+    # store an entry
+    # argument: key, profile (None if the pipeline failed),
+    #           persistent: write a failure to disk, only for failures that cannot change between runs
+    def put(self, key: str, profile, persistent: bool = False) -> None:
+        if profile is None and not persistent:
+            with self.lock:
+                self.failed.add(key)
+            return
+        path = self.entry_path(key)
+        path.parent.mkdir(exist_ok=True)
+        # write to a private file first and rename it, so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump({"profile": profile}, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self.lock:
+            self.stores += 1
+            self.stores_since_eviction += 1
+            if self.stores_since_eviction < self.eviction_interval:
+                return
+            self.stores_since_eviction = 0
+        self.evict()
+
+    # drop the least recently used entries until the cache fits its bounds
+    def evict(self) -> None:
+        entries = []
+        total_bytes = 0
+        for path in self.cache_dir.glob("*/*.pkl"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total_bytes += st.st_size
+        if total_bytes <= self.max_bytes and len(entries) <= self.max_entries:
+            return
+        # shrink below the bounds with some slack, so we do not evict on every store
+        target_bytes = self.max_bytes * 0.9
+        target_entries = self.max_entries * 0.9
+        entries.sort()
+        count = len(entries)
+        for _, size, path in entries:
+            if total_bytes <= target_bytes and count <= target_entries:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            count -= 1
+            with self.lock:
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+    def __str__(self):
+        s = self.stats()
+        lookups = s["hits"] + s["misses"]
+        rate = s["hits"] / lookups * 100 if lookups else 0.0
+        return f"fitness cache: {s['hits']} hits, {s['misses']} misses ({rate:.1f}% hit rate), {s['evictions']} evictions"
+
+
+# argument: stripped IR string
+# return: hex digest
+def fingerprint_ir(stripped_ir: str) -> str:
+    return hashlib.sha256(stripped_ir.encode("utf-8")).hexdigest()
+
+
+class IRFingerprintIndex:
+    """
+    Profiles indexed by the fingerprint of the optimized IR of the experiment's target file.
+    Different pipelines often give identical IR, and then the build and the run cannot differ,
+    so only the first pipeline of each fingerprint is compiled and run.
+    If several threads evaluate the same fingerprint at once, the later ones wait for the first.
+    With a prefix store, opt only runs the atoms after the longest prefix already evaluated.
+    Without one, prefetch computes the optimized IR of a whole generation with many opt jobs in flight.
+    With regroup_builds=True, candidates are built with their verified regrouped pipeline (see regrouped),
+    which costs one or two more opt runs per build, and only pays off for builds much slower than opt.
+    """
+    def __init__(self, input_ll_str: str, experiment, fitness_cache: FitnessCache = None, prefix_store: PrefixIRStore = None,
+                 regroup_builds: bool = False):
+        self.input_ll_str = input_ll_str
+        self.experiment = experiment
+        self.fitness_cache = fitness_cache
+        self.prefix_store = prefix_store
+        self.regroup_builds = regroup_builds
+        self.profiles = {}  # fingerprint -> profile, None if failed
+        self.pending = {}   # fingerprint -> threading.Event, set once measured
+        self.hits = 0
+        self.misses = 0
+        self.regroups = {}  # passes string -> verified regrouped passes string
+        self.prefetched = {}  # passes string -> stripped IR of the last prefetch, None if failed
+        self.lock = threading.Lock()
+
+    # the stripped optimized IR of a pipeline
+    # argument: passes string
+    # return: IR string, None if opt produced nothing
+    def optimized_ir(self, passes_str: str):
+        with self.lock:
+            if passes_str in self.prefetched:
+                return self.prefetched[passes_str]
+        if self.prefix_store is not None:
+            optimized = self.prefix_store.pipeline_opt(self.input_ll_str, passes_str)
+        else:
+            optimized = llvm.pipeline_opt(self.input_ll_str, passes_str)
+        if optimized == "":
+            return None
+        return llvm.strip(optimized)
+
+    # compute the stripped optimized IR of many pipelines at once, as asyncio subprocesses within the cheap budget
+    # of async_llvm, and keep it for optimized_ir until the next prefetch
+    # a prefix store runs its pipelines one by one, and an event loop already running cannot be waited for,
+    # then nothing is prefetched
+    # argument: passes strings
+    def prefetch(self, passes_strs) -> None:
+        passes_strs = list(dict.fromkeys(passes_strs))
+        try:
+            asyncio.get_running_loop()
+            running = True
+        except RuntimeError:
+            running = False
+        if self.prefix_store is not None or running:
+            passes_strs = []
+        stripped = asyncio.run(async_llvm.optimized_ir_many(self.input_ll_str, passes_strs)) if passes_strs else []
+        with self.lock:
+            self.prefetched = dict(zip(passes_strs, stripped))
+
+    # the pipeline in nested pass-manager form, if it gives the same IR (see llvm.regroup_verified)
+    # argument: passes string, its stripped optimized IR if already known (see optimized_ir)
+    # return: passes string to give opt
+    def regrouped(self, passes_str: str, expected: str = None) -> str:
+        with self.lock:
+            regrouped = self.regroups.get(passes_str)
+        if regrouped is None:
+            if expected is None:
+                expected = self.optimized_ir(passes_str)
+            regrouped = passes_str if expected is None else llvm.regroup_verified(self.input_ll_str, passes_str, expected)
+            with self.lock:
+                self.regroups[passes_str] = regrouped
+        return regrouped
+
+    # fingerprint the optimized IR of a pipeline
+    # argument: passes string
+    # return: hex digest, None if opt produced nothing
+    def fingerprint(self, passes_str: str):
+        stripped = self.optimized_ir(passes_str)
+        return fingerprint_ir(stripped) if stripped is not None else None
+
+    # whether a fingerprint was measured, or is being measured
+    def known(self, fingerprint: str) -> bool:
+        with self.lock:
+            if fingerprint in self.profiles or fingerprint in self.pending:
+                return True
+        if self.fitness_cache is not None:
+            return self.fitness_cache.entry_path(self.fitness_cache.ir_key(fingerprint, self.experiment)).exists()
+        return False
+
+    # claim a fingerprint for measurement
+    # argument: fingerprint
+    # return: (found, profile); if not found, the caller must measure and then call release()
+    def claim(self, fingerprint: str):
+        while True:
+            with self.lock:
+                if fingerprint in self.profiles:
+                    self.hits += 1
+                    return True, self.profiles[fingerprint]
+                event = self.pending.get(fingerprint)
+                if event is None:
+                    self.pending[fingerprint] = threading.Event()
+                    break
+            event.wait()
+
+        if self.fitness_cache is not None:
+            found, profile = self.fitness_cache.get(self.fitness_cache.ir_key(fingerprint, self.experiment))
+            if found:
+                self.release(fingerprint, profile, store=False)
+                with self.lock:
+                    self.hits += 1
+                return True, profile
+        with self.lock:
+            self.misses += 1
+        return False, None
+
+    # record the measurement of a claimed fingerprint
+    # argument: fingerprint, profile (None if failed)
+    def release(self, fingerprint: str, profile, store: bool = True) -> None:
+        if store and self.fitness_cache is not None:
+            self.fitness_cache.put(self.fitness_cache.ir_key(fingerprint, self.experiment), profile)
+        with self.lock:
+            self.profiles[fingerprint] = profile
+            event = self.pending.pop(fingerprint)
+        event.set()
+
+    # give up a claimed fingerprint without a measurement, e.g. after an unexpected error:
+    # nothing is recorded, and the next thread claiming it measures it
+    # argument: fingerprint
+    def abandon(self, fingerprint: str) -> None:
+        with self.lock:
+            event = self.pending.pop(fingerprint)
+        event.set()
+
+    def __str__(self):
+        with self.lock:
+            regrouped = sum(1 for passes_str, regrouped in self.regroups.items() if regrouped != passes_str)
+            return (f"IR fingerprints: {len(self.profiles)} distinct, {self.hits} reused, {self.misses} measured, "
+                    f"{regrouped} of {len(self.regroups)} pipelines regrouped")
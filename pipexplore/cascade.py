@@ -0,0 +1,112 @@
+import heapq
+import threading
+
+import pipexplore.llvm as llvm
+from pipexplore.cache import IRFingerprintIndex, fingerprint_ir
+
+# static cost models: stripped IR string -> cost (lower is better), None if unknown
+cost_models = {
+    "instcount": llvm.instruction_count,
+    "mca": llvm.mca_throughput,
+}
+
+
+class Cascade:
+    """
+    Cheap tiers a candidate must pass, in order, before it is built and run:
+      parse:   opt accepts the pipeline (cached by pipeline), and runs it on the experiment's IR
+      novelty: the optimized IR was not measured yet; if it was, its profile is reused without a build
+               (see IRFingerprintIndex)
+      cost:    the static cost of the optimized IR, see cost_models, is at most cost_tolerance (relative)
+               above the highest cost among the elites (cached by IR fingerprint)
+    The novelty and cost tiers need the IR the experiment gives in pre_optimization_ir().
+    The cost tier assumes that a much higher static cost than every elite means a worse fitness,
+    it is disabled unless cost_tolerance is given.
+    A rejected candidate fails like a candidate that does not compile, but is not stored in the fitness cache,
+    since the verdict of the cost tier changes with the elites.
+    """
+    def __init__(self, cost_model: str = "instcount", cost_tolerance: float = None, elite_fraction: float = 0.25):
+        self.cost_function = cost_models[cost_model]
+        self.cost_tolerance = cost_tolerance
+        self.elite_fraction = elite_fraction
+        self.accepted = {}   # passes string -> whether opt accepts it
+        self.costs = {}      # fingerprint -> static cost
+        self.pipeline_costs = {}  # passes string -> static cost, until the pipeline is measured
+        self.measured = []   # [(fitness, static cost), ...]
+        # tier -> [passed, rejected]; candidates with known IR count as rejected by the novelty tier
+        self.counters = {"parse": [0, 0], "novelty": [0, 0], "cost": [0, 0]}
+        self.lock = threading.Lock()
+
+    def count(self, tier: str, passed: bool) -> None:
+        with self.lock:
+            self.counters[tier][0 if passed else 1] += 1
+
+    # the highest static cost among the elites of the measured candidates
+    # return: cost, None if nothing was measured yet
+    def reference_cost(self):
+        with self.lock:
+            if not self.measured:
+                return None
+            elite_size = max(1, int(len(self.measured) * self.elite_fraction))
+            return max(cost for _, cost in heapq.nlargest(elite_size, self.measured, key=lambda x: x[0]))
+
+    # run the cheap tiers on an individual
+    # argument: individual, index of the experiment's IR (None if the experiment gives no IR)
+    # return: False if a tier rejected the individual; else True, and individual.fingerprint is set if known
+    def screen(self, individual, ir_index: IRFingerprintIndex = None) -> bool:
+        passes_str = individual.to_string()
+
+        # 1. opt accepts the pipeline, and can run it on the experiment's IR
+        with self.lock:
+            accepted = self.accepted.get(passes_str)
+        if accepted is None:
+            accepted = llvm.pipeline_accepted(passes_str)
+            with self.lock:
+                self.accepted[passes_str] = accepted
+        stripped = None
+        if accepted and ir_index is not None:
+            stripped = ir_index.optimized_ir(passes_str)
+            # a pipeline crashing opt on the IR cannot build either
+            accepted = stripped is not None
+        self.count("parse", accepted)
+        if not accepted or ir_index is None:
+            return accepted
+
+        # 2. the optimized IR is new
+        fingerprint = fingerprint_ir(stripped)
+        new = not ir_index.known(fingerprint)
+        self.count("novelty", new)
+        if not new or self.cost_tolerance is None:
+            individual.fingerprint = fingerprint
+            return True
+
+        # 3. the static cost is close to the elites
+        with self.lock:
+            cost = self.costs.get(fingerprint)
+        if cost is None:
+            cost = self.cost_function(stripped)
+            with self.lock:
+                self.costs[fingerprint] = cost
+        reference = self.reference_cost()
+        passed = cost is None or reference is None or cost <= reference * (1 + self.cost_tolerance)
+        self.count("cost", passed)
+        if passed:
+            individual.fingerprint = fingerprint
+            if cost is not None:
+                with self.lock:
+                    self.pipeline_costs[passes_str] = cost
+        return passed
+
+    # record the fitness of a measured individual, to find the cost of the elites
+    def record(self, individual) -> None:
+        with self.lock:
+            cost = self.pipeline_costs.pop(individual.to_string(), None)
+            if cost is not None:
+                self.measured.append((individual.profile.fitness(), cost))
+
+    def __str__(self):
+        with self.lock:
+            parse, novelty, cost = self.counters["parse"], self.counters["novelty"], self.counters["cost"]
+            return (f"cascade: parse {parse[0]} passed {parse[1]} rejected, "
+                    f"novelty {novelty[0]} new {novelty[1]} reused, "
+                    f"cost {cost[0]} passed {cost[1]} rejected")
@@ -0,0 +1,355 @@
+# farm out profiling to worker processes on other machines (or the same one)
+# the coordinator sends the experiment to every worker once, then pipeline strings as jobs;
+# a worker runs Individual.run_profile on its own copy of the experiment and sends back the profile
+# a job is lost, rather than failed, if no worker could finish it: it was on workers that went away max_attempts times,
+# the coordinator shut down first, or the worker raised an unexpected error; a lost job says nothing about its pipeline
+# messages are pickled tuples over multiprocessing.connection, authenticated with a shared key:
+#   worker -> coordinator: ("hello", capacity, host name), ("heartbeat",), ("result", job id, success, profile),
+#                          success is None if the job was lost
+#   coordinator -> worker: ("experiment", experiment), ("job", job id, passes string), ("stop",)
+# the experiment class must be importable by the workers (not defined in a __main__ script), and profiles must pickle
+#
+# start a worker with: python -m pipexplore.distributed worker --address host:port [--capacity N] [clang=/path/to/clang]
+import os
+import sys
+import copy
+import time
+import queue
+import socket
+import argparse
+import threading
+import itertools
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+import pipexplore.interface as interface
+from pipexplore.batch_map import worker_cores, pin_worker
+
+heartbeat_interval = 5.0
+
+
+# the key shared by the coordinator and its workers: there is no default, anyone who can reach the port
+# and knows the key can send pickles to the other side
+# argument: explicit key, or None to read PIPEXPLORE_AUTHKEY
+# return: key
+def get_authkey(authkey=None) -> bytes:
+    if authkey is None:
+        authkey = os.environ.get("PIPEXPLORE_AUTHKEY")
+    if not authkey:
+        raise ValueError("no authentication key: set PIPEXPLORE_AUTHKEY, or pass authkey=, "
+                         "to the same secret on the coordinator and the workers")
+    return authkey.encode("utf-8") if isinstance(authkey, str) else authkey
+
+
+# parse "host:port"
+# return: (host, port)
+def parse_address(address_str):
+    host, port = address_str.rsplit(":", 1)
+    return host, int(port)
+
+
+class Job:
+    """
+    A pipeline to profile, and the number of workers it was lost on.
+    """
+    def __init__(self, job_id: int, passes_str: str):
+        self.job_id = job_id
+        self.passes_str = passes_str
+        self.future = Future()
+        self.attempts = 0
+
+
+class RemoteWorker:
+    """
+    The coordinator's view of a connected worker: its connection, capacity and jobs in flight.
+    """
+    def __init__(self, conn, capacity: int, name: str):
+        self.conn = conn
+        self.capacity = capacity
+        self.name = name
+        self.jobs = {}  # job id -> Job
+        self.last_seen = time.monotonic()
+        self.alive = True
+        # messages are sent outside the coordinator's lock, by any of its threads
+        self.send_lock = threading.Lock()
+
+    def send(self, message) -> None:
+        with self.send_lock:
+            self.conn.send(message)
+
+
+class Coordinator:
+    """
+    Distribute pipelines to remote workers, at most `capacity` jobs per worker at a time.
+    Workers send heartbeats; a worker silent for heartbeat_timeout seconds, or whose connection breaks,
+    is dropped, and its jobs go back to the queue, until a job was lost max_attempts times.
+    Jobs wait in the queue while no worker is connected.
+    The coordinator and its workers share a secret key, authkey= or PIPEXPLORE_AUTHKEY, required on both sides.
+    """
+    def __init__(self,
+                 experiment: interface.Experiment,
+                 address=("localhost", 6100),
+                 authkey: bytes = None,
+                 heartbeat_timeout: float = 30.0,
+                 max_attempts: int = 3):
+        self.experiment = experiment
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.listener = Listener(address, authkey=get_authkey(authkey))
+        self.address = self.listener.address
+        self.workers = []
+        self.pending = deque()
+        self.job_ids = itertools.count()
+        self.lock = threading.Condition()
+        self.closed = False
+        self.done = 0
+        self.retried = 0
+        self.lost = 0
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        threading.Thread(target=self.monitor_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except (OSError, AuthenticationError):
+                # closed listener, or a client with the wrong key
+                continue
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    # read the messages of a worker until its connection breaks
+    def serve(self, conn):
+        try:
+            kind, capacity, name = conn.recv()
+            if kind != "hello":
+                raise EOFError
+            conn.send(("experiment", self.experiment))
+        except (EOFError, OSError, ValueError):
+            conn.close()
+            return
+        worker = RemoteWorker(conn, max(1, capacity), name)
+        with self.lock:
+            self.workers.append(worker)
+            self.lock.notify_all()
+        self.dispatch()
+
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                self.drop(worker)
+                conn.close()
+                return
+            with self.lock:
+                worker.last_seen = time.monotonic()
+                job = worker.jobs.pop(message[1], None) if message[0] == "result" else None
+                if job is not None and message[2] is None:
+                    self.lost += 1
+                elif job is not None:
+                    self.done += 1
+            if job is not None:
+                job.future.set_result((message[2], message[3]))
+                self.dispatch()
+
+    # drop the workers that missed their heartbeats
+    def monitor_loop(self):
+        while not self.closed:
+            time.sleep(heartbeat_interval)
+            now = time.monotonic()
+            with self.lock:
+                silent = [worker for worker in self.workers if now - worker.last_seen > self.heartbeat_timeout]
+            for worker in silent:
+                self.drop(worker)
+
+    # forget a worker, its jobs go back to the front of the queue
+    # a worker still listening is told to stop, the connection is closed by its reader thread
+    def drop(self, worker: RemoteWorker):
+        lost = []
+        with self.lock:
+            if not worker.alive:
+                return
+            worker.alive = False
+            self.workers.remove(worker)
+            for job in worker.jobs.values():
+                job.attempts += 1
+                if job.attempts >= self.max_attempts:
+                    lost.append(job)
+                else:
+                    self.retried += 1
+                    self.pending.appendleft(job)
+            self.lost += len(lost)
+            worker.jobs = {}
+        try:
+            worker.send(("stop",))
+        except OSError:
+            pass
+        for job in lost:
+            job.future.set_result((None, None))
+        self.dispatch()
+
+    # send queued jobs to the workers with free capacity
+    # the jobs are assigned under the lock and sent outside it, a slow connection must not block the other workers
+    def dispatch(self):
+        assigned = []
+        with self.lock:
+            for worker in self.workers:
+                while self.pending and len(worker.jobs) < worker.capacity:
+                    job = self.pending.popleft()
+                    worker.jobs[job.job_id] = job
+                    assigned.append((worker, job))
+        broken = []
+        for worker, job in assigned:
+            if worker in broken:
+                continue
+            try:
+                worker.send(("job", job.job_id, job.passes_str))
+            except OSError:
+                broken.append(worker)
+        for worker in broken:
+            with self.lock:
+                # unless the worker was dropped meanwhile, which requeued them, its unsent jobs go back first
+                unsent = [job for w, job in assigned if w is worker and worker.jobs.pop(job.job_id, None) is not None]
+                self.pending.extendleft(reversed(unsent))
+            self.drop(worker)
+
+    # profile a pipeline on some worker
+    # argument: passes string
+    # return: future of (success, profile), success is None if the job was lost (see above), which must not be cached
+    def submit(self, passes_str: str) -> Future:
+        job = Job(next(self.job_ids), passes_str)
+        with self.lock:
+            self.pending.append(job)
+        self.dispatch()
+        return job.future
+
+    # profile the individual on some worker, like Individual.run_profile
+    # return: True if the individual has a valid profile
+    def run_profile(self, individual) -> bool:
+        success, individual.profile = self.submit(individual.to_string()).result()
+        return bool(success)
+
+    # argument: [passes string, ...]
+    # return: [(success, profile), ...] in order, success is None if the job was lost
+    def map(self, passes_strs):
+        futures = [self.submit(passes_str) for passes_str in passes_strs]
+        return [future.result() for future in futures]
+
+    # return: the number of jobs the connected workers run at once
+    def capacity(self) -> int:
+        with self.lock:
+            return sum(worker.capacity for worker in self.workers)
+
+    # block until enough workers are connected
+    # return: True if they are, False on timeout
+    def wait_for_workers(self, count: int = 1, timeout: float = None) -> bool:
+        with self.lock:
+            return self.lock.wait_for(lambda: len(self.workers) >= count, timeout)
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            workers, self.workers = self.workers, []
+            pending, self.pending = list(self.pending), deque()
+        self.listener.close()
+        for worker in workers:
+            worker.alive = False
+            try:
+                worker.send(("stop",))
+            except OSError:
+                pass
+            pending.extend(worker.jobs.values())
+        with self.lock:
+            self.lost += sum(1 for job in pending if not job.future.done())
+        for job in pending:
+            if not job.future.done():
+                job.future.set_result((None, None))
+
+    def __str__(self):
+        capacity = self.capacity()
+        with self.lock:
+            return (f"coordinator: {len(self.workers)} workers (capacity {capacity}), "
+                    f"{self.done} jobs done, {self.retried} retried, {self.lost} lost")
+
+
+# connect to the coordinator and profile its jobs until it stops or goes away
+# argument: coordinator (host, port), shared key (default: PIPEXPLORE_AUTHKEY), number of parallel jobs (default: one per worker core),
+#           seconds between connection attempts, seconds to keep trying (None: forever)
+def worker_main(address, authkey: bytes = None, capacity: int = None,
+                retry_interval: float = 1.0, connect_timeout: float = None):
+    # imported here, xGA reads the O3 pipeline from opt when imported
+    from pipexplore.xGA import Individual
+
+    authkey = get_authkey(authkey)
+    cores = worker_cores()
+    capacity = capacity or len(cores) or os.cpu_count()
+    deadline = None if connect_timeout is None else time.monotonic() + connect_timeout
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if deadline is not None and time.monotonic() > deadline:
+                raise
+            time.sleep(retry_interval)
+
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except OSError:
+                pass
+
+    def heartbeat():
+        while not stopped.wait(heartbeat_interval):
+            send(("heartbeat",))
+
+    def run_job(job_id, passes_str):
+        individual = Individual(passes_str.split(",") if passes_str else [])
+        try:
+            success = individual.run_profile(copy.deepcopy(experiment))
+        except Exception as e:
+            # not a property of the pipeline, the job is lost
+            print(f"job {job_id} failed: {e}", file=sys.stderr)
+            success = None
+        send(("result", job_id, success, individual.profile if success else None))
+
+    stopped = threading.Event()
+    core_queue = queue.Queue()
+    for core in cores[:capacity]:
+        core_queue.put(core)
+    pool = ThreadPoolExecutor(max_workers=capacity, initializer=pin_worker, initargs=(core_queue,))
+    try:
+        send(("hello", capacity, socket.gethostname()))
+        _, experiment = conn.recv()
+        threading.Thread(target=heartbeat, daemon=True).start()
+        while True:
+            message = conn.recv()
+            if message[0] == "job":
+                pool.submit(run_job, message[1], message[2])
+            elif message[0] == "stop":
+                break
+    except (EOFError, OSError):
+        pass
+    finally:
+        stopped.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("role", choices=["worker"])
+    parser.add_argument("--address", type=str, required=True)  # coordinator host:port
+    parser.add_argument("--capacity", type=int, default=None)  # parallel jobs, default one per core
+    parser.add_argument("--connect-timeout", type=float, default=None)  # give up connecting after that many seconds
+    # the key is read from PIPEXPLORE_AUTHKEY, not from the command line
+    args, _ = parser.parse_known_args()  # clang=/path/to/clang is read by pipexplore.llvm
+    try:
+        get_authkey()
+    except ValueError as e:
+        sys.exit(str(e))
+    worker_main(parse_address(args.address), capacity=args.capacity, connect_timeout=args.connect_timeout)
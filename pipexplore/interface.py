@@ -1,5 +1,13 @@
+import os
+import queue
+import atexit
+import shutil
+import tempfile
+import threading
+import subprocess
 from dataclasses import dataclass
 from pathlib import Path
+from typing import List
 
 class CannotCompileError(Exception):
     '''
@@ -29,9 +37,16 @@ class Profile:
     def constraint(self) -> bool:
         return True
 
+    """
+    Optional: the fitness of every repetition behind fitness(), used to race noisy measurements, see pipexplore/racing.py.
+    """
+    def samples(self) -> List[float]:
+        return [self.fitness()]
+
 class Experiment:
     """
-    In our usage of experiment, every instance will call 'compile()' only once and then 'run()' only once.
+    In our usage of experiment, every instance will call 'compile()' only once and then 'run()' only once
+    (several times when racing, if 'run()' accepts the 'round' keyword).
     And once 'compile()' of an object is called, we would never copy this object later.
     So feel free if you want to save some information in this object. (^_^)
     """
@@ -44,9 +59,26 @@ class Experiment:
     def run(self, **kwargs) -> Profile:
         '''
         Run the executable and obtain profiling data.
+        Optional: accept a `round` keyword, the number of repetitions, to support racing (see pipexplore/racing.py),
+        then run() may be called several times on the same compiled experiment.
         '''
         raise NotImplementedError("This should be implemented by the user.")
 
+    def identity(self) -> str:
+        '''
+        Optional: identify the experiment for cached results.
+        Two experiments with the same identity must give the same profile for the same pipeline,
+        so override this if the experiment depends on its arguments, e.g. the project directory.
+        '''
+        return f"{type(self).__module__}.{type(self).__qualname__}"
+
+    def pre_optimization_ir(self) -> str:
+        '''
+        Optional: the textual IR of the optimized file before optimization, e.g. from llvm.compile_file_noopt().
+        If given, pipelines producing the same optimized IR share a single compilation and run.
+        '''
+        return ""
+
 class IndependentExperiment(Experiment):
     """
     Optional:Independent experiment class.
@@ -65,4 +97,231 @@ class IndependentExperiment(Experiment):
         Run the executable and obtain profiling data.
         This method must be thread-safe and can be executed concurrently.
         '''
-        raise NotImplementedError("This should be implemented by the user.")
\ No newline at end of file
+        raise NotImplementedError("This should be implemented by the user.")
+
+
+class BuildTreePool:
+    '''
+    Persistent, pre-configured build trees of a CMake project, one per concurrent build.
+    Every tree is configured once with -DTRANSFORMER_PATH=<tree>/transformer. Building with a compiler copies it
+    to that stable path and removes the outputs made by it and the target, so the build only reruns the
+    transformer's custom command and the link, all other translation units stay built.
+    Copies of the pool (copy.deepcopy) are the pool itself; a pickled pool arrives empty and makes its own trees.
+    A forked process (e.g. an island) also starts empty, with its trees in a subdirectory of the parent's pool,
+    instead of sharing the parent's free trees and tree numbers.
+    '''
+    fork_lock = threading.Lock()
+
+    def __init__(self, project_dir: Path, invalidated_outputs=("opt.o",), cmake_args=(), pool_dir: Path = None):
+        self.project_dir = Path(project_dir).absolute()
+        self.invalidated_outputs = list(invalidated_outputs)
+        self.cmake_args = list(cmake_args)
+        self.requested_pool_dir = pool_dir
+        self.pool_dir = None
+        self.free = queue.LifoQueue()  # the most recently used tree is the warmest
+        self.trees = 0
+        self.builds = 0
+        self.lock = threading.Lock()
+        self.owner = os.getpid()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return {"project_dir": self.project_dir, "invalidated_outputs": self.invalidated_outputs,
+                "cmake_args": self.cmake_args, "pool_dir": self.requested_pool_dir}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    # start an empty pool in a forked process, the parent keeps its trees
+    def check_owner(self) -> None:
+        if self.owner == os.getpid():
+            return
+        with BuildTreePool.fork_lock:
+            if self.owner == os.getpid():
+                return
+            parent_pool_dir = self.pool_dir
+            self.free = queue.LifoQueue()
+            self.trees = 0
+            self.builds = 0
+            self.lock = threading.Lock()
+            self.pool_dir = None
+            if parent_pool_dir is not None:
+                # removed with the parent's pool
+                self.pool_dir = parent_pool_dir / f"pid{os.getpid()}"
+                (self.pool_dir / "bin").mkdir(parents=True)
+            self.owner = os.getpid()
+
+    # take a free tree, configuring a new one if none is free
+    def acquire(self) -> Path:
+        self.check_owner()
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.pool_dir is None:
+                if self.requested_pool_dir is not None:
+                    Path(self.requested_pool_dir).mkdir(parents=True, exist_ok=True)
+                self.pool_dir = Path(tempfile.mkdtemp(dir=self.requested_pool_dir, prefix="build_pool_"))
+                atexit.register(shutil.rmtree, self.pool_dir, True)
+                (self.pool_dir / "bin").mkdir()
+            tree = self.pool_dir / f"tree{self.trees}"
+            self.trees += 1
+        tree.mkdir()
+        result = subprocess.run(["cmake", self.project_dir.as_posix(), f"-DTRANSFORMER_PATH={tree / 'transformer'}"] + self.cmake_args,
+                                cwd=tree, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            shutil.rmtree(tree, ignore_errors=True)
+            raise RuntimeError(f"cannot configure {self.project_dir}: {result.stderr.decode()}")
+        return tree
+
+    def release(self, tree: Path) -> None:
+        self.free.put(tree)
+
+    # build the target with a compiler
+    # argument: compiler path, target name
+    # return: path of the built executable, moved out of the tree
+    def build(self, cxx_path, target: str) -> Path:
+        tree = self.acquire()
+        try:
+            # a private copy next to the stable path, renamed over it, so make sees a new file
+            staging = tree / "transformer.tmp"
+            shutil.copyfile(cxx_path, staging)
+            os.chmod(staging, 0o755)
+            os.replace(staging, tree / "transformer")
+            for output in self.invalidated_outputs + [target]:
+                try:
+                    os.remove(tree / output)
+                except FileNotFoundError:
+                    pass
+            result = subprocess.run(["cmake", "--build", ".", "--target", target],
+                                    cwd=tree, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode != 0:
+                raise CannotCompileError(f"cannot build {target} in {tree}")
+            fd, executable = tempfile.mkstemp(dir=self.pool_dir / "bin", prefix=target + "_")
+            os.close(fd)
+            os.replace(tree / target, executable)
+        finally:
+            self.release(tree)
+        with self.lock:
+            self.builds += 1
+        return Path(executable)
+
+    def __str__(self):
+        with self.lock:
+            return f"build pool: {self.trees} trees, {self.builds} builds"
+
+
+class CMakeBuildPoolExperiment(IndependentExperiment):
+    '''
+    An independent experiment building a CMake project in a pool of pre-configured build trees, see BuildTreePool.
+    compile() leaves the path of the built executable in self.executable, which is removed with the experiment.
+    The project must read the transformer from TRANSFORMER_PATH and list the outputs it makes in invalidated_outputs.
+    Subclasses implement run(); deep copies, i.e. all candidates, share the pool.
+    '''
+    def __init__(self, project_dir: Path, target: str = "main", invalidated_outputs=("opt.o",),
+                 cmake_args=(), pool_dir: Path = None):
+        self.project_dir = Path(project_dir)
+        self.target = target
+        self.build_pool = BuildTreePool(project_dir, invalidated_outputs, cmake_args, pool_dir)
+        self.executable = None
+
+    def __del__(self):
+        if self.executable is not None:
+            try:
+                os.remove(self.executable)
+            except OSError:
+                pass
+
+    def identity(self) -> str:
+        return f"{super().identity()}:{self.project_dir.absolute().as_posix()}"
+
+    def compile(self, cxx_path: Path):
+        self.executable = self.build_pool.build(cxx_path, self.target)
+
+
+# pipexplore.llvm, imported on first use: it looks for the toolchain (clang=...) when imported,
+# which only ObjectInjectionExperiment needs among the experiments of this module
+# return: the pipexplore.llvm module
+def llvm_module():
+    import pipexplore.llvm
+    return pipexplore.llvm
+
+
+class ObjectInjectionExperiment(IndependentExperiment):
+    '''
+    An independent experiment tuning one source file linked with prebuilt objects, without a build system.
+    The frontend IR of the source is computed once; each candidate then only runs opt on it, the codegen
+    and the link (see compile_pipeline), without a generated compiler. The path of the executable is left in
+    self.executable, which is removed with the experiment.
+    Subclasses implement run().
+    '''
+    def __init__(self, source: Path, flags=(), objects=(), link_flags=(), codegen_opt_level: str = "3"):
+        self.source = Path(source)
+        self.flags = list(flags)
+        self.objects = [Path(obj) for obj in objects]
+        self.link_flags = list(link_flags)
+        self.codegen_opt_level = codegen_opt_level
+        self.frontend_ir = None
+        self.executable = None
+        # the same frontend step as a generated compiler, kept as bitcode
+        self.frontend = llvm_module().compile_file_noopt(self.source, self.flags, as_bitcode=True)
+        if not self.frontend:
+            raise CannotCompileError(f"cannot compile {self.source}")
+
+    def __del__(self):
+        if self.executable is not None:
+            try:
+                os.remove(self.executable)
+            except OSError:
+                pass
+
+    def identity(self) -> str:
+        parts = [self.source.absolute().as_posix()] + self.flags + [obj.absolute().as_posix() for obj in self.objects] + self.link_flags
+        return f"{super().identity()}:{' '.join(parts)}:-O{self.codegen_opt_level}"
+
+    def pre_optimization_ir(self) -> str:
+        if self.frontend_ir is None:
+            self.frontend_ir = llvm_module().to_text(self.frontend)
+        return self.frontend_ir
+
+    # link the object of the source with the prebuilt objects into self.executable
+    def link(self, object_file) -> None:
+        executable = llvm_module().workspace_path()
+        cmd = [llvm_module().clang, str(object_file)] + [str(obj) for obj in self.objects] + ['-o', executable] + self.link_flags
+        if subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+            raise CannotCompileError(f"cannot link {self.source}")
+        self.executable = executable
+
+    def compile_pipeline(self, pipeline_str: str):
+        '''
+        Optimize the frontend IR with the pipeline, generate the object and link it.
+        '''
+        optimized = llvm_module().pipeline_opt_bc(self.frontend, pipeline_str)
+        if not optimized:
+            raise CannotCompileError(f"opt failed on {self.source}")
+        object_file = llvm_module().workspace_path(".o")
+        try:
+            cmd = [llvm_module().clang, '-x', 'ir', '-', '-c', '-o', object_file, '-O' + self.codegen_opt_level]
+            if subprocess.run(cmd, input=optimized, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+                raise CannotCompileError(f"codegen failed on {self.source}")
+            self.link(object_file)
+        finally:
+            if os.path.exists(object_file):
+                os.remove(object_file)
+
+    def compile(self, cxx_path: Path):
+        '''
+        Compile the source with a generated compiler instead, e.g. to check the final compiler.
+        '''
+        object_file = llvm_module().workspace_path(".o")
+        try:
+            cmd = [str(cxx_path), '-c', str(self.source), '-o', object_file, '-O', self.codegen_opt_level] + self.flags
+            if subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+                raise CannotCompileError(f"cannot compile {self.source}")
+            self.link(object_file)
+        finally:
+            if os.path.exists(object_file):
+                os.remove(object_file)
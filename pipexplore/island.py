@@ -0,0 +1,194 @@
+import queue
+import random
+import multiprocessing
+from typing import List
+
+import pipexplore.llvm as llvm
+import pipexplore.batch_map as batch_map
+import pipexplore.interface as interface
+from pipexplore.cache import FitnessCache
+from pipexplore.runlog import individual_fields
+from pipexplore.xGA import Individual, Population
+
+
+class IslandRunLog:
+    """
+    The run log of an island process: its evaluated individuals are sent with the other events of the island,
+    and written by the parent, see IslandModel.run(on_individual=...).
+    """
+    def __init__(self, index: int, events):
+        self.index = index
+        self.events = events
+
+    def individual(self, generation: int, individual, success: bool) -> None:
+        self.events.put(("individual", self.index, individual_fields(generation, individual, success)))
+
+
+# the body of an island process: evolve a population, exchanging elites with the neighbours of the ring
+# migrants travel as (passes, profile) pairs, so profiles must pickle, as for the fitness cache
+def island_main(index: int, model: 'IslandModel', cores, inbox, outbox, events):
+    random.seed(model.seeds[index])
+    # migrants are best effort: do not block the exit on a neighbour that stopped reading
+    outbox.cancel_join_thread()
+    if cores:
+        # the island only uses its share of the worker cores, the reserved ones stay for measurements
+        batch_map.process_cores = set(cores) | (batch_map.reserved_cores & batch_map.process_cores)
+        batch_map.pin(cores)
+
+    population = Population(model.population_size, model.experiment, model.fitness_cache,
+                            mutation_weights=model.mutation_weights[index], racer=model.racer, cascade=model.cascade,
+                            surrogate=model.surrogate, archive_size=model.archive_size, selection=model.selection,
+                            run_log=IslandRunLog(index, events) if model.log_individuals else None,
+                            regroup_builds=model.regroup_builds)
+    population.initialize()
+    for generation in range(1, model.generations + 1):
+        if not population.individuals:
+            break
+        population.evolve(model.mutation_rates[index])
+
+        if generation % model.migration_interval == 0:
+            elites = sorted(population.individuals, key=lambda x: (x.profile.fitness(), - len(x)), reverse=True)
+            outbox.put([(ind.passes, ind.profile) for ind in elites[:model.migrants]])
+            while True:
+                try:
+                    migrants = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                for passes, profile in migrants:
+                    migrant = Individual(list(passes))
+                    migrant.profile = profile
+                    population.insert(migrant)
+
+        best = population.get_best_individual() if population.get_best_individual_cnt() > 0 else None
+        events.put(("generation", index, generation, best.profile.fitness() if best is not None else None))
+
+    events.put(("done", index, [(ind.passes, ind.profile) for ind in population.individuals]))
+
+
+# the default mutation weights of the islands: the first island keeps the uniform weights of Population,
+# every other island favours one of the cheap local mutations, so that the islands explore differently
+# argument: number of islands
+# return: [{mutation name: weight} or None, ...]
+def default_mutation_weights(islands: int) -> List[dict]:
+    favoured = ["replace", "delete", "insert", "swap", "duplicate", "reverse"]
+    return [None] + [{favoured[i % len(favoured)]: 4} for i in range(islands - 1)]
+
+
+class IslandModel:
+    """
+    Island-model GA: several populations evolve in separate processes, each with its own seed,
+    mutation rate and mutation weights, and the best `migrants` individuals of every island move to
+    the next island of a ring every `migration_interval` generations.
+    Islands share the worker cores (and the fitness cache, if any), the experiment is inherited by fork.
+    Every island gets a copy of the racer, cascade, surrogate and selection strategy, so their statistics stay in
+    the islands. Settings holding threads or connections, a TwoTierScheduler or a distributed Coordinator, cannot
+    be forked and are not supported.
+    A forked process only has the thread that forked it, so start() the islands before the parent starts threads,
+    e.g. a RunLog writer; the opt service of pipexplore.llvm is stopped before forking.
+    """
+    def __init__(self,
+                 experiment: interface.Experiment,
+                 islands: int = 4,
+                 population_size: int = 100,
+                 generations: int = 100,
+                 migration_interval: int = 5,
+                 migrants: int = 2,
+                 seed: int = None,
+                 mutation_rates: List[float] = None,
+                 mutation_weights: List[dict] = None,
+                 fitness_cache: FitnessCache = None,
+                 log_individuals: bool = False,
+                 racer=None,
+                 cascade=None,
+                 surrogate=None,
+                 archive_size: int = None,
+                 selection=None,
+                 regroup_builds: bool = False):
+        self.experiment = experiment
+        self.islands = islands
+        self.population_size = population_size
+        self.generations = generations
+        self.migration_interval = max(1, migration_interval)
+        self.migrants = migrants
+        rng = random.Random(seed)
+        self.seeds = [rng.getrandbits(32) for _ in range(islands)]
+        # by default, spread the mutation rates around the 0.2 of Population.evolve
+        self.mutation_rates = mutation_rates or [0.1 + 0.2 * i / max(1, islands - 1) for i in range(islands)]
+        self.mutation_weights = mutation_weights or default_mutation_weights(islands)
+        self.fitness_cache = fitness_cache
+        # send the evaluated individuals of the islands to run(on_individual=...)
+        self.log_individuals = log_individuals
+        # the settings of the islands' populations, see Population
+        self.racer = racer
+        self.cascade = cascade
+        self.surrogate = surrogate
+        self.archive_size = archive_size
+        self.selection = selection
+        self.regroup_builds = regroup_builds
+        self.processes = []
+        self.events = None
+
+    # fork the island processes, if not done yet
+    def start(self) -> None:
+        if self.processes:
+            return
+        context = multiprocessing.get_context("fork")
+        # the islands inherit the frontend and object caches of the run
+        llvm.get_frontend_cache_dir()
+        llvm.get_object_cache_dir()
+        # and no thread of the opt service
+        llvm.suspend_opt_service()
+        mailboxes = [context.Queue() for _ in range(self.islands)]
+        self.events = context.Queue()
+        cores = batch_map.worker_cores()
+        shares = [cores[i::self.islands] for i in range(self.islands)] if len(cores) >= self.islands else [cores] * self.islands
+
+        for i in range(self.islands):
+            # island i receives from island i - 1 and sends to island i + 1
+            process = context.Process(target=island_main,
+                                      args=(i, self, shares[i], mailboxes[i], mailboxes[(i + 1) % self.islands], self.events))
+            process.start()
+            self.processes.append(process)
+
+    # wait for the island processes, terminating those still running after timeout seconds each
+    def stop(self, timeout: float = 10) -> None:
+        for process in self.processes:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    # run all islands until every one of them finished its generations, starting them if not done yet
+    # argument: optional callbacks (island, generation, best fitness or None), and with log_individuals
+    #           (island, fields of the individual event, see runlog.individual_fields)
+    # return: the final individuals of all islands, best first
+    def run(self, on_generation=None, on_individual=None) -> List[Individual]:
+        self.start()
+        individuals = []
+        running = set(range(self.islands))
+        try:
+            while running:
+                try:
+                    event = self.events.get(timeout=1)
+                except queue.Empty:
+                    # an island that exited cleanly has queued its results, one that crashed contributes nothing
+                    running = {i for i in running if self.processes[i].is_alive() or self.processes[i].exitcode == 0}
+                    continue
+                if event[0] == "generation":
+                    if on_generation is not None:
+                        on_generation(*event[1:])
+                elif event[0] == "individual":
+                    if on_individual is not None:
+                        on_individual(*event[1:])
+                else:
+                    _, index, results = event
+                    running.discard(index)
+                    for passes, profile in results:
+                        individual = Individual(list(passes))
+                        individual.profile = profile
+                        individuals.append(individual)
+        finally:
+            self.stop()
+
+        individuals.sort(key=lambda x: (x.profile.fitness(), - len(x)), reverse=True)
+        return individuals
@@ -3,12 +3,102 @@ import subprocess
 import re
 import sys
 import random
+import json
+import atexit
+import shutil
+import hashlib
+import struct
+import tempfile
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 tmp = "/tmp"
+# the cores of the process, read at import before any thread pins itself (see batch_map)
+can_pin = hasattr(os, "sched_setaffinity")
+process_cores = set(os.sched_getaffinity(0)) if can_pin else set()
 def generate_random_str():
     keys = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
     return ''.join(random.choices(keys, k=32))
 
+# whether files in a directory can be executed, /dev/shm is often mounted noexec
+# argument: directory path
+# return: True if a script written there runs
+def can_execute_in(path):
+    try:
+        fd, script = tempfile.mkstemp(dir=path, prefix="pipexplore_exec_")
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(script, 0o755)
+        return subprocess.run([script]).returncode == 0
+    except OSError:
+        return False
+    finally:
+        os.remove(script)
+
+# a private directory for the files we cannot avoid, on tmpfs if available, removed at exit
+# it holds the generated compilers, so tmpfs is only used if it allows executing them
+workspace_dir = None
+workspace_owner = None
+workspace_base = None
+def workspace():
+    global workspace_dir, workspace_owner, workspace_base
+    if workspace_dir is None or workspace_owner != os.getpid():
+        if workspace_base is None:
+            workspace_base = "/dev/shm" if os.path.isdir("/dev/shm") and can_execute_in("/dev/shm") else tmp
+        workspace_dir = tempfile.mkdtemp(prefix="pipexplore_", dir=workspace_base)
+        workspace_owner = os.getpid()
+        atexit.register(remove_workspace, workspace_dir, workspace_owner)
+    return workspace_dir
+
+def remove_workspace(path, owner):
+    # forked workers share the directory of their parent, only the creator removes it
+    if os.getpid() == owner:
+        shutil.rmtree(path, ignore_errors=True)
+
+# a fresh file name in the workspace
+# argument: suffix
+# return: file path
+def workspace_path(suffix=""):
+    return os.path.join(workspace(), generate_random_str() + suffix)
+
+# the caches shared by the generated compilers of this run, see from_pipeline_make_a_compiler_to_path
+# the environment variable names a persistent one, otherwise a fresh directory is created and removed at exit;
+# processes forked later (islands, batch workers) inherit it, so create it before forking
+run_cache_dirs = {}
+def run_cache_dir(variable, prefix):
+    if variable not in run_cache_dirs:
+        path = os.environ.get(variable, "")
+        if path == "":
+            path = tempfile.mkdtemp(prefix=prefix, dir=tmp)
+            atexit.register(remove_workspace, path, os.getpid())
+        run_cache_dirs[variable] = path
+    return run_cache_dirs[variable]
+
+def get_frontend_cache_dir():
+    return run_cache_dir("PIPEXPLORE_FRONTEND_CACHE", "pipexplore_frontend_")
+
+def get_object_cache_dir():
+    return run_cache_dir("PIPEXPLORE_OBJECT_CACHE", "pipexplore_objects_")
+
+# hit statistics of an object cache, as kept by the generated compilers
+# argument: object cache directory
+# return: {"hits": ..., "misses": ..., "size": bytes}
+def object_cache_stats(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "stats.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"hits": 0, "misses": 0, "size": 0}
+
+def object_cache_report(cache_dir):
+    stats = object_cache_stats(cache_dir)
+    return (f"object cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['size'] / (1 << 20):.1f} MiB in {cache_dir}")
+
 
 # init this module: find clang and opt
 # Try to find clang from command line args first
@@ -55,6 +145,8 @@ except (FileNotFoundError, subprocess.SubprocessError):
     print("Error: Could not find working opt or llc installation in LLVM directory")
     print("Please verify your LLVM installation includes opt and llc")
     sys.exit(1)
+# llvm-mca is optional, only used for static cost estimates
+llvm_mca = os.path.join(llvm_dir, "llvm-mca")
 
 # strip the debug information and other metadata
 # argument: ll file path
@@ -62,7 +154,13 @@ except (FileNotFoundError, subprocess.SubprocessError):
 def strip_f(input_ll):
     command = [opt, input_ll, "-strip-debug", "-passes=strip", "-S"]
     stdout = subprocess.run(command, capture_output=True).stdout
-    lines = stdout.decode().split('\n')
+    return strip_text(stdout.decode())
+
+# drop the metadata, comments and attributes from the output of opt's strip pass
+# argument: ll string
+# return: stripped ll string
+def strip_text(ll_str):
+    lines = ll_str.split('\n')
 
     lines = [line for line in lines if not line.startswith(";")]
     lines = [line.split(";")[0] for line in lines]
@@ -99,6 +197,289 @@ def strip_f(input_ll):
 
     return '\n'.join(lines)
 
+# whether the module is bitcode rather than textual ll
+# argument: module bytes or string
+# return: True if bitcode
+def is_bitcode(module):
+    return isinstance(module, bytes) and (module.startswith(b"BC\xc0\xde") or module.startswith(b"\xde\xc0\x17\x0b"))
+
+# module as bytes to feed a tool on stdin
+# argument: ll string, ll bytes or bitcode bytes
+# return: bytes
+def module_bytes(module):
+    return module.encode("utf-8") if isinstance(module, str) else module
+
+# run opt on a module piped through stdin, through the opt service if enabled
+# argument: module (ll string or bitcode bytes), opt arguments
+# return: completed process, stdout as bytes
+def opt_pipe(module, args):
+    service = get_opt_service()
+    if service is not None:
+        return service.run(module, args)
+    command = [opt, "-"] + args + ["-o", "-"]
+    return subprocess.run(command, input=module_bytes(module), capture_output=True)
+
+# the persistent opt driver, see pipexplore/opt_driver.cpp, built against the LLVM of opt on first use and kept in tmp
+# for later runs; PIPEXPLORE_OPT_DRIVER names a prebuilt driver, or disables it if empty
+opt_driver_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opt_driver.cpp")
+opt_driver = None
+opt_driver_lock = threading.Lock()
+
+# argument: llvm-config arguments
+# return: output, None if llvm-config is missing or failed
+def llvm_config(args):
+    for tool in [os.path.join(llvm_dir, "llvm-config"), "llvm-config"]:
+        try:
+            result = subprocess.run([tool] + args, capture_output=True, text=True)
+        except OSError:
+            continue
+        if result.returncode == 0:
+            return result.stdout.strip()
+    return None
+
+# build the opt driver unless already built
+# return: driver path, "" if it cannot be built (no llvm-config of opt's version, no headers or no C++ compiler)
+def get_opt_driver():
+    global opt_driver
+    with opt_driver_lock:
+        if opt_driver is None:
+            opt_driver = os.environ.get("PIPEXPLORE_OPT_DRIVER")
+            if opt_driver is None:
+                opt_driver = build_opt_driver()
+        return opt_driver
+
+def build_opt_driver():
+    version = llvm_config(["--version"])
+    opt_version = subprocess.run([opt, "--version"], capture_output=True, text=True).stdout
+    if version is None or f"LLVM version {version}" not in opt_version:
+        return ""
+    cxxflags, ldflags, libs = llvm_config(["--cxxflags"]), llvm_config(["--ldflags"]), llvm_config(["--libs"])
+    if cxxflags is None or ldflags is None or libs is None:
+        return ""
+    with open(opt_driver_source, "rb") as f:
+        source = f.read()
+    cxx = os.environ.get("CXX", "c++")
+    key = hashlib.sha256(b"\0".join([source, opt_version.encode("utf-8"), cxxflags.encode("utf-8"),
+                                      ldflags.encode("utf-8"), libs.encode("utf-8"), cxx.encode("utf-8")])).hexdigest()
+    path = os.path.join(tmp, f"pipexplore_opt_driver_{key[:16]}")
+    if os.access(path, os.X_OK):
+        return path
+    # built under a private name and renamed, several processes may build it at once
+    build_path = f"{path}.{os.getpid()}.tmp"
+    command = [cxx, "-O2"] + cxxflags.split() + [opt_driver_source, "-o", build_path] + ldflags.split() + libs.split()
+    try:
+        if subprocess.run(command, capture_output=True).returncode != 0:
+            return ""
+        os.replace(build_path, path)
+    except OSError:
+        return ""
+    finally:
+        if os.path.exists(build_path):
+            os.remove(build_path)
+    return path
+
+class PersistentOpt:
+    """
+    An opt driver process (see pipexplore/opt_driver.cpp) running job after job, so libLLVM is loaded and its
+    passes registered once per worker instead of once per job. It gives the same output as opt for the arguments
+    it supports; the caller runs opt itself for the other arguments, and for the jobs the driver died on.
+    """
+    supported_args = ["-S", "-strip-debug", "-disable-output", "-preserve-bc-uselistorder", "-preserve-ll-uselistorder"]
+
+    def __init__(self, driver):
+        self.process = subprocess.Popen([driver], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        # started by whichever thread needed a worker, it would inherit that thread's pinning
+        if can_pin:
+            try:
+                os.sched_setaffinity(self.process.pid, process_cores)
+            except OSError:
+                pass
+
+    @staticmethod
+    def supports(args):
+        return all(arg.startswith("-passes=") or arg in PersistentOpt.supported_args for arg in args)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def read_bytes(self, size):
+        data = self.process.stdout.read(size)
+        if len(data) != size:
+            raise EOFError
+        return data
+
+    # run a job
+    # argument: module bytes, opt arguments
+    # return: completed process, None if the driver died
+    def run(self, input_bytes, args):
+        message = [struct.pack("<I", len(args))]
+        for arg in args:
+            arg = arg.encode("utf-8")
+            message += [struct.pack("<I", len(arg)), arg]
+        message += [struct.pack("<Q", len(input_bytes)), input_bytes]
+        try:
+            self.process.stdin.write(b"".join(message))
+            self.process.stdin.flush()
+            returncode, = struct.unpack("<i", self.read_bytes(4))
+            stdout = self.read_bytes(struct.unpack("<Q", self.read_bytes(8))[0])
+            stderr = self.read_bytes(struct.unpack("<Q", self.read_bytes(8))[0])
+        except (OSError, EOFError, ValueError):
+            self.close()
+            return None
+        return subprocess.CompletedProcess(self.process.args + args, returncode, stdout, stderr)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+class OptService:
+    """
+    A pool of persistent opt workers with the same interface as pipeline_opt, see PersistentOpt.
+    Jobs may be streamed with submit() and run on at most `workers` processes at once.
+    backend: "persistent", or "subprocess" to start opt per job; "persistent" falls back to it if the driver
+    cannot be built.
+    """
+    def __init__(self, workers=None, backend="persistent"):
+        self.workers = workers or os.cpu_count()
+        self.owner = os.getpid()
+        self.driver = get_opt_driver() if backend == "persistent" else ""
+        self.backend = "persistent" if self.driver else "subprocess"
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        # idle workers, started on demand, at most one per executor thread
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def run_job(self, input_bytes, args):
+        if self.backend == "persistent" and PersistentOpt.supports(args):
+            with self.lock:
+                closed = self.closed
+            if not closed:
+                try:
+                    worker = self.idle.get_nowait()
+                except queue.Empty:
+                    worker = PersistentOpt(self.driver)
+                result = worker.run(input_bytes, args)
+                if result is not None:
+                    self.idle.put(worker)
+                    return result
+                # the driver died, e.g. on a failed assertion: opt itself gives the job its error and output
+        command = [opt, "-"] + args + ["-o", "-"]
+        return subprocess.run(command, input=input_bytes, capture_output=True)
+
+    # run opt on a module asynchronously
+    # argument: module (ll string or bitcode bytes), opt arguments
+    # return: future of the completed process
+    def submit(self, module, args):
+        return self.executor.submit(self.run_job, module_bytes(module), args)
+
+    # run opt on a module
+    # argument: module (ll string or bitcode bytes), opt arguments
+    # return: completed process
+    def run(self, module, args):
+        return self.submit(module, args).result()
+
+    # pipeline the ll string, see pipeline_opt
+    def pipeline_opt(self, input_ll_str, passes_str):
+        result = self.run(input_ll_str, ["-passes=" + passes_str, "-S"])
+        err = result.stderr.decode("utf-8")
+        if err != "":
+            print(err)
+        return result.stdout.decode("utf-8")
+
+    # pipeline many ll strings, streaming them to the workers
+    # argument: [(ll string, passes string), ...]
+    # return: [optimized ll string, ...]
+    def pipeline_opt_map(self, jobs):
+        futures = [self.submit(input_ll_str, ["-passes=" + passes_str, "-S"]) for input_ll_str, passes_str in jobs]
+        return [future.result().stdout.decode("utf-8") for future in futures]
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.executor.shutdown(wait=True)
+        while not self.idle.empty():
+            self.idle.get().close()
+
+# the opt service used by every helper of this module
+# set use_opt_service = False, or call set_opt_service(None), to start opt per call
+use_opt_service = True
+opt_service = None
+opt_service_pid = os.getpid()
+def get_opt_service():
+    global opt_service
+    # forked workers must not share the processes of their parent, and may exit without cleaning up
+    # their own, so they start opt per call
+    if not use_opt_service or os.getpid() != opt_service_pid:
+        return None
+    if opt_service is None:
+        set_opt_service(OptService())
+    return opt_service
+
+def set_opt_service(service):
+    global opt_service, use_opt_service, opt_service_pid
+    if opt_service is not None and opt_service.owner == os.getpid() and opt_service is not service:
+        opt_service.close()
+    opt_service = service
+    opt_service_pid = os.getpid()
+    use_opt_service = service is not None
+
+# stop the workers of the opt service, e.g. before forking: a forked process would lack the threads of its executor,
+# and might inherit its locks held; the service is replaced by an idle one with the same settings, which starts
+# its threads and workers on the next call
+def suspend_opt_service():
+    global opt_service
+    if opt_service is not None and opt_service.owner == os.getpid():
+        opt_service.close()
+        opt_service = OptService(opt_service.workers, opt_service.backend)
+
+# stop the workers of the current opt service at exit, registered once
+def close_opt_service():
+    if opt_service is not None and opt_service.owner == os.getpid():
+        opt_service.close()
+atexit.register(close_opt_service)
+
+# whether opt calls start a process each, rather than running on persistent workers
+def opt_runs_are_processes():
+    service = get_opt_service()
+    return service is None or service.backend != "persistent"
+
+# pipeline the module, keeping it as bitcode
+# argument: module (ll string or bitcode bytes), passes string
+# return: optimized bitcode bytes, empty if opt failed
+def pipeline_opt_bc(module, passes_str):
+    result = opt_pipe(module, ["-passes=" + passes_str])
+    err = result.stderr.decode("utf-8")
+    if err != "":
+        print(err)
+    return result.stdout
+
+# print the module as ll
+# argument: module (ll string or bitcode bytes)
+# return: ll string
+def to_text(module):
+    if not is_bitcode(module):
+        return module if isinstance(module, str) else module.decode("utf-8")
+    return opt_pipe(module, ["-S"]).stdout.decode("utf-8")
+
+# assemble the module as bitcode
+# argument: module (ll string or bitcode bytes)
+# return: bitcode bytes
+def to_bitcode(module):
+    if is_bitcode(module):
+        return module
+    return opt_pipe(module, []).stdout
+
 # pipeline the ll file
 # argument: ll file path, passes string
 # return: optimized ll string
@@ -213,23 +594,75 @@ def get_pipeline_str(opt_level="O3"):
 def compose_atom_tree(tree):
     return ','.join(atomize_tree(tree))
 
+# normalize the pipeline string, so that equivalent spellings compare equal
+# argument: passes string
+# return: atomized pipeline string
+def normalize_pipeline_str(passes_str):
+    return compose_atom_tree(parse_string_as_tree(passes_str))
+
+# split an atom into its outermost adaptor and the pipeline it wraps
+# argument: atom, e.g. function<eager-inv>(loop-mssa(licm))
+# return: (adaptor, inner passes string), or (None, atom) for a pass without adaptor
+def split_adaptor(atom):
+    open_pos = atom.find("(")
+    if open_pos <= 0 or not atom.endswith(")"):
+        return None, atom
+    return atom[:open_pos], atom[open_pos + 1:-1]
+
+# merge adjacent atoms under the same adaptor back into one nested group, recursively, so that opt
+# traverses the module once per group instead of once per pass, and keeps loop passes in one loop pass manager
+# e.g. function(a),function(loop(b)),function(loop(c)) -> function(a,loop(b,c))
+# the order in which passes see the functions (or loops, or SCCs) changes, see regroup_verified
+# argument: atoms, whether to merge cgscc groups too (this also interleaves the inliner with other passes)
+# return: [pass or group, ...]
+def regroup_atoms(atoms, merge_cgscc=True):
+    groups = []  # [(adaptor, [inner atom, ...]) or (None, atom), ...]
+    for atom in atoms:
+        adaptor, inner = split_adaptor(atom)
+        if adaptor is not None and (merge_cgscc or not adaptor.startswith("cgscc")) \
+                and groups and groups[-1][0] == adaptor:
+            groups[-1][1].append(inner)
+        elif adaptor is not None:
+            groups.append((adaptor, [inner]))
+        else:
+            groups.append((None, atom))
+    return [inner if adaptor is None else adaptor + "(" + ",".join(regroup_atoms(inner, merge_cgscc)) + ")"
+            for adaptor, inner in groups]
+
+# argument: passes string, whether to merge cgscc groups
+# return: regrouped passes string
+def regroup_pipeline_str(passes_str, merge_cgscc=True):
+    return ",".join(regroup_atoms(atomize_tree(parse_string_as_tree(passes_str)), merge_cgscc))
+
+# get the version of the toolchain, used to invalidate cached results
+# return: version string of clang and opt
+toolchain_version = None
+def get_toolchain_version():
+    global toolchain_version
+    if toolchain_version is None:
+        versions = []
+        for tool in [clang, opt]:
+            try:
+                versions.append(subprocess.run([tool, "--version"], capture_output=True, text=True).stdout.strip())
+            except Exception:
+                versions.append("")
+        toolchain_version = "\n".join(versions)
+    return toolchain_version
+
 # read the c string
 # argument: c source string
 # return: c source string
 def llvm_cstr_read(src_str):
-    ret = ""
-    tmpfile = os.path.join(tmp, f"{generate_random_str()}.c")
-    with open(tmpfile, "w") as f:
-        f.write(src_str)
-    try:
-        ret = llvm_cfile_read(tmpfile)
-    except Exception as e:
-        ret = ""
+    command = [clang, "-E", "-x", "c", "-"]
     try:
-        os.remove(tmpfile)
+        result = subprocess.run(command, input=src_str.encode("utf-8"), capture_output=True).stdout.decode("utf-8")
     except Exception as e:
-        pass
-    return ret
+        return ""
+    # dropping the precompiled lines:
+    result = [line for line in result.split('\n') if not line.startswith("#")]
+    # dropping the empty lines:
+    result = [line for line in result if line.strip()]
+    return '\n'.join(result)
 
 # compile the c string
 # argument: c source string
@@ -237,84 +670,130 @@ def llvm_cstr_read(src_str):
 def try_compile_llvm(src_str):
     ret = False
     try:
-        input_file = os.path.join(tmp, f"{generate_random_str()}.c")
-        with open(input_file, "w") as f:
-            f.write(src_str)
-
-        output_file = os.path.join(tmp, f"{generate_random_str()}.ll")
-
-        cmd = [clang, '-S', '-emit-llvm', input_file, '-o', output_file]
+        cmd = [clang, '-c', '-emit-llvm', '-x', 'c', '-', '-o', '-']
 
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        result = subprocess.run(cmd, input=src_str.encode("utf-8"), capture_output=True, timeout=10)
 
-        if result.returncode == 0:
-            if os.path.getsize(output_file) > 0:
-                ret = True
+        if result.returncode == 0 and len(result.stdout) > 0:
+            ret = True
     except Exception as e:
         print(e)
-
-    try:
-        os.remove(input_file)
-        os.remove(output_file)
-    except Exception:
-        pass
     return ret
 
 # compile the c string
 # argument: c source string
 # return: compiled ll string before optimization
 def compile_llvm_noopt(src_str):
-    try:
-        input_file = os.path.join(tmp, f"{generate_random_str()}.c")
-        with open(input_file, "w") as f:
-            f.write(src_str)
+    return compile_llvm_noopt_bytes(src_str, ['-S']).decode("utf-8")
 
-        output_file = os.path.join(tmp, f"{generate_random_str()}.ll")
-
-        # this is the command to compile the c string to ll string before the optimization stage, i.e. without any optimization
-        cmd = [clang, '-g', '-O3', '-mllvm', '-disable-llvm-optzns', '-S', '-emit-llvm', input_file, '-o', output_file]
+# compile the c string
+# argument: c source string
+# return: compiled bitcode bytes before optimization, empty if failed
+def compile_llvm_noopt_bc(src_str):
+    return compile_llvm_noopt_bytes(src_str, ['-c'])
 
-        subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+def compile_llvm_noopt_bytes(src_str, output_args):
+    # this is the command to compile the c string to ll before the optimization stage, i.e. without any optimization
+    cmd = [clang, '-g', '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm'] + output_args + ['-x', 'c', '-', '-o', '-']
+    try:
+        result = subprocess.run(cmd, input=src_str.encode("utf-8"), capture_output=True, timeout=10)
     except Exception:
-        pass
-
-    compiled_str = ""
+        return b""
+    if result.returncode != 0:
+        return b""
+    return result.stdout
+
+# compile the c file the same way as the frontend step of a generated compiler
+# argument: c file path, extra clang arguments, whether to return bitcode
+# return: compiled ll string (or bitcode bytes) before optimization
+def compile_file_noopt(file, args=[], as_bitcode=False):
+    cmd = [clang, '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm', '-c' if as_bitcode else '-S', '-o', '-', str(file)] + list(args)
     try:
-        os.remove(input_file)
-        with open(output_file, "r") as f:
-            compiled_str = f.read()
-        os.remove(output_file)
+        result = subprocess.run(cmd, capture_output=True)
     except Exception:
-        pass
-    return compiled_str
+        result = None
+    if result is None or result.returncode != 0:
+        return b"" if as_bitcode else ""
+    return result.stdout if as_bitcode else result.stdout.decode("utf-8")
 
 # pipeline the ll string
 # argument: ll string, passes string
 # return: optimized ll string
 def pipeline_opt(input_ll_str, passes_str):
-    tmpfile = os.path.join(tmp, f"{generate_random_str()}.ll")
-    with open(tmpfile, "w") as f:
-        f.write(input_ll_str)
-    ret = pipeline_opt_f(tmpfile, passes_str)
-    try:
-        os.remove(tmpfile)
-    except Exception:
-        pass
-    return ret
+    result = opt_pipe(input_ll_str, ["-passes=" + passes_str, "-S"])
+    err = result.stderr.decode("utf-8")
+    if err != "":
+        print(err)
+    return result.stdout.decode("utf-8")
 
 # strip the debug information and other metadata
-# argument: ll string
+# argument: ll string (or bitcode bytes)
 # return: stripped ll string
 def strip(input_ll_str):
-    tmpfile = os.path.join(tmp, f"{generate_random_str()}.ll")
-    with open(tmpfile, "w") as f:
-        f.write(input_ll_str)
-    ret = strip_f(tmpfile)
+    stdout = opt_pipe(input_ll_str, ["-strip-debug", "-passes=strip", "-S"]).stdout
+    return strip_text(stdout.decode())
+
+# whether opt accepts the pipeline, without running it on anything
+# argument: passes string
+# return: True if the pipeline parses
+def pipeline_accepted(passes_str):
+    return opt_pipe("", ["-passes=" + passes_str, "-disable-output"]).returncode == 0
+
+# count the instructions of the ll string, a static cost estimate
+# argument: ll string
+# return: number of instructions in function bodies
+def instruction_count(ll_str):
+    count = 0
+    in_function = False
+    for line in ll_str.splitlines():
+        if line.startswith("define "):
+            in_function = True
+        elif line.startswith("}"):
+            in_function = False
+        elif in_function:
+            line = line.strip()
+            # skip empty lines, comments and labels
+            if line and not line.startswith(";") and not re.match(r'^[\w.$"-]+:', line):
+                count += 1
+    return count
+
+# estimate the throughput of the ll string with llc and llvm-mca, a static cost estimate
+# the whole assembly is analyzed as one block, so this is only a rough proxy for the run time
+# argument: ll string, extra llvm-mca arguments (e.g. -mcpu=...)
+# return: block reciprocal throughput in cycles, None if failed
+def mca_throughput(ll_str, args=[]):
+    asm = subprocess.run([llc, "-O3", "-o", "-"], input=ll_str.encode("utf-8"), capture_output=True)
+    if asm.returncode != 0:
+        return None
     try:
-        os.remove(tmpfile)
-    except Exception:
-        pass
-    return ret
+        result = subprocess.run([llvm_mca] + list(args), input=asm.stdout, capture_output=True)
+    except FileNotFoundError:
+        return None
+    match = re.search(r"Block RThroughput:\s*([0-9.]+)", result.stdout.decode("utf-8"))
+    return float(match.group(1)) if match else None
+
+# regroup a pipeline (see regroup_pipeline_str) if the regrouped one gives the same stripped IR on the input;
+# merging cgscc groups is tried first (unless merge_cgscc is False), then merging the other groups only
+# this is only verified on that input, other inputs may still give different IR
+# argument: input ll string, passes string, stripped output of the pipeline on the input (computed if None),
+#           whether cgscc groups may be merged
+# return: the regrouped passes string if verified, else the passes string
+def regroup_verified(input_ll_str, passes_str, expected=None, merge_cgscc=True):
+    if expected is None:
+        optimized = pipeline_opt(input_ll_str, passes_str)
+        if optimized == "":
+            return passes_str
+        expected = strip(optimized)
+    tried = {passes_str}
+    for merge in ([True, False] if merge_cgscc else [False]):
+        regrouped = regroup_pipeline_str(passes_str, merge)
+        if regrouped in tried:
+            continue
+        tried.add(regrouped)
+        optimized = pipeline_opt(input_ll_str, regrouped)
+        if optimized != "" and strip(optimized) == expected:
+            return regrouped
+    return passes_str
 
 # whether the two pipelines are equivalent modulo the input
 # argument: input ll string, pass string 1, pass string 2
@@ -353,42 +832,135 @@ def text_ll_equivalent(ll_str_1, ll_str_2):
 
     return "\n".join(filtered_lines1) == "\n".join(filtered_lines2)
 
-# minimize the pipeline
-# argument: ll string, passes string
-# return: minimized pipeline string
-def pipeline_minimize(input_ll_str, passes_str):
+# the marker separating atoms in opt's change report, a module pass that never changes anything
+change_report_marker = "no-op-module"
+
+# which atoms change the ll file, from a single opt run with opt's change report
+# argument: ll file path, atom list
+# return: [True if the atom changed the IR, ...], None if the report is ambiguous
+def pipeline_changes_f(input_ll, atoms):
+    with open(input_ll, "rb") as f:
+        return pipeline_changes(f.read(), atoms)
+
+# which atoms change the module, from a single opt run with opt's change report
+# argument: module (ll string or bitcode bytes), atom list
+# return: [True if the atom changed the IR, ...], None if the report is ambiguous
+def pipeline_changes(module, atoms):
+    if change_report_marker in atoms:
+        return None
+    result = opt_pipe(module, change_report_args(atoms))
+    if result.returncode != 0:
+        return None
+    return parse_change_report(result.stderr, atoms)
+
+# opt arguments to report which atoms change the module
+# argument: atom list
+# return: opt arguments
+def change_report_args(atoms):
+    # marker, atom 0, marker, atom 1, ..., marker
+    passes_str = ','.join([change_report_marker] + [atom + ',' + change_report_marker for atom in atoms])
+    return ["-passes=" + passes_str, "-print-changed", "-disable-output"]
+
+# parse opt's change report
+# argument: stderr bytes of opt run with change_report_args(atoms), atom list
+# return: [True if the atom changed the IR, ...], None if the report is ambiguous
+def parse_change_report(report, atoms):
+    # the report goes to stderr, one header per pass run, e.g.
+    # *** IR Dump After SROAPass on main ***
+    # *** IR Dump After SROAPass on main omitted because no change ***
+    # *** IR Pass PassManager<llvm::Function> on main ignored ***
+    changes = []
+    changed = None  # None before the first marker, then whether the current atom changed anything
+    for line in report.decode("utf-8", errors="replace").split('\n'):
+        if not line.startswith("*** IR "):
+            continue
+        if line == "*** IR Dump At Start ***" or line.endswith(" ignored ***"):
+            continue
+        if line.startswith("*** IR Dump After NoOpModulePass on [module]"):
+            if changed is not None:
+                changes.append(changed)
+            changed = False
+            continue
+        if changed is None:
+            # e.g. the verifier run before the pipeline
+            continue
+        if line.endswith(" omitted because no change ***"):
+            continue
+        if (line.startswith("*** IR Dump After ") or line.startswith("*** IR Deleted After ")) and line.endswith(" ***") \
+                and "filtered out" not in line and "invalidated" not in line:
+            changed = True
+            continue
+        # unknown report line, e.g. a filtered out pass, we cannot tell
+        return None
+    if len(changes) != len(atoms):
+        return None
+    return changes
+
+# minimize the pipeline: keep the atoms that change the ll printed by the atoms before them, each run on its own
+# opt's change report of a single run tells which atoms change the module kept in memory; the others are dropped by
+# the loop as well, except where printing and re-parsing the ll between atoms makes a difference: the atoms before
+# the first one that changes the ll (e.g. attributes of intrinsic declarations), and the atom after each one that
+# changes it (its use-list order, in the "; preds" comments), so these are run on their own too
+# argument: ll string, passes string, optional prefix_store.PrefixIRStore to reuse intermediate IR,
+#           whether to skip atoms with opt's change report (default: when opt calls start a process each,
+#           a persistent opt worker runs the atoms it saves in about the time of the report)
+# return: minimized pipeline string, the same with and without the change report
+def pipeline_minimize(input_ll_str, passes_str, store=None, use_change_report=None):
+    if store is not None:
+        return store.pipeline_minimize(input_ll_str, passes_str)
 
     pass_tree = parse_string_as_tree(passes_str)
     pass_atom_tree = atomize_tree(pass_tree)
+    if use_change_report is None:
+        use_change_report = opt_runs_are_processes()
+    changes = pipeline_changes(input_ll_str, pass_atom_tree) if use_change_report else None
+    if changes is None:
+        # no report, or an ambiguous one: run every atom
+        changes = [True] * len(pass_atom_tree)
     # check if each pass can be removed
     # consider the order of the passes
     current_input = input_ll_str
     minimized_pass_tree = []
-    removed = 0
-    for i in range(len(pass_atom_tree)):
-        next_input = pipeline_opt(current_input, pass_atom_tree[i])
+    check_next = True
+    for atom, changed in zip(pass_atom_tree, changes):
+        if not (changed or check_next):
+            continue
+        next_input = pipeline_opt(current_input, atom)
         if text_ll_equivalent(next_input, current_input):
-            current_input = next_input
-            removed += 1
+            check_next = check_next and not minimized_pass_tree
         else:
-            current_input = next_input
-            minimized_pass_tree.append(pass_atom_tree[i])
+            minimized_pass_tree.append(atom)
+            check_next = True
+        current_input = next_input
     return compose_atom_tree(minimized_pass_tree)
 
 # a generator that yields a compiler from a pipeline string
-def from_pipeline_make_a_compiler_to_path(pipeline_str, compiler_full_path, minimized_pipeline_file):
+# the compiler caches the output of the clang frontend in frontend_cache_dir, and the objects it makes in
+# object_cache_dir, up to object_cache_size bytes ("" disables a cache); PIPEXPLORE_FRONTEND_CACHE,
+# PIPEXPLORE_OBJECT_CACHE and PIPEXPLORE_OBJECT_CACHE_SIZE override them when the compiler runs
+# `compiler --show-stats` prints the statistics of its object cache
+def from_pipeline_make_a_compiler_to_path(pipeline_str, compiler_full_path, minimized_pipeline_file,
+                                          frontend_cache_dir="", object_cache_dir="", object_cache_size=1 << 30):
+    clang_version = hashlib.sha256(get_toolchain_version().encode("utf-8")).hexdigest()
     text = f'''#!/usr/bin/python3
 clang = "{clang}"
 opt = "{opt}"
 llc = "{llc}"
-tmp = "{tmp}"
 pipeline_str = "{pipeline_str}"
-minimized_pipeline_file = "{minimized_pipeline_file}"''' + r"""
+minimized_pipeline_file = "{minimized_pipeline_file}"
+frontend_cache_dir = "{frontend_cache_dir}"
+object_cache_dir = "{object_cache_dir}"
+object_cache_size = {object_cache_size}
+clang_version = "{clang_version}"''' + r"""
 import sys
 import os
 import subprocess
-import random
 import re
+import time
+import json
+import fcntl
+import hashlib
+import tempfile
 def parse_string_as_tree(s):
 
     s = s.replace(" ", "")
@@ -453,15 +1025,13 @@ def pipeline_opt_f(input_ll, passes_str):
     return result.stdout.decode("utf-8")
 
 def pipeline_opt(input_ll_str, passes_str):
-    tmpfile = os.path.join(tmp, f"{generate_random_str()}.ll")
-    with open(tmpfile, "w") as f:
-        f.write(input_ll_str)
-    ret = pipeline_opt_f(tmpfile, passes_str)
-    try:
-        os.remove(tmpfile)
-    except Exception:
-        pass
-    return ret
+    command = [opt, "-", "-passes=" + passes_str, "-S", "-o", "-"]
+    result = subprocess.run(command, input=input_ll_str.encode("utf-8"), capture_output=True)
+
+    err = result.stderr.decode("utf-8")
+    if err != "":
+        print(err)
+    return result.stdout.decode("utf-8")
 
 def text_ll_equivalent(ll_str_1, ll_str_2):
     # remove the following metadata:
@@ -511,8 +1081,177 @@ def pipeline_minimize(input_ll_str, passes_str):
             minimized_pass_tree.append(pass_atom_tree[i])
     return compose_atom_tree(minimized_pass_tree)
 
+# frontend cache: the output of the frontend only depends on the flags, the working directory, the clang version
+# and the contents of the source and of the headers it includes (its include closure, listed by the depfile)
+# <key>.manifest lists the include closures seen for the key of the flags, with the hashes of their files;
+# a closure whose files all still have these hashes names the cached <result>.bc and <result>.d
+# with -MMD from the build system, system headers are not in the closure; they change with the clang version
+frontend_cache_dir = os.environ.get("PIPEXPLORE_FRONTEND_CACHE", frontend_cache_dir)
+max_manifest_entries = 32
+
+file_hashes = {}
+def file_hash(path):
+    if path not in file_hashes:
+        h = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            file_hashes[path] = h.hexdigest()
+        except OSError:
+            file_hashes[path] = None
+    return file_hashes[path]
+
+def read_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+# concurrent compilers see either the old or the new file, never a partial one
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+# the prerequisites of a make rule "target: dep dep \\\n dep", spaces in paths are escaped
+def parse_depfile(text):
+    tokens = re.split(r"(?<!\\)\s+", text.replace("\\\n", " "))
+    tokens = [token.replace("\\ ", " ") for token in tokens if token]
+    # skip the target, and the phony targets of -MP
+    first = next((i for i, token in enumerate(tokens) if token.endswith(":")), len(tokens))
+    return [token for token in tokens[first + 1:] if not token.endswith(":")]
+
+def read_manifest(manifest_path):
+    manifest = read_file(manifest_path)
+    try:
+        return json.loads(manifest) if manifest is not None else []
+    except ValueError:
+        return []
+
+def frontend(args):
+    cmd = [clang, '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm', '-c', '-o', '-'] + args
+    if frontend_cache_dir == "":
+        return subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    os.makedirs(frontend_cache_dir, exist_ok=True)
+    key = hashlib.sha256("\0".join([clang_version, os.getcwd()] + args).encode("utf-8")).hexdigest()
+    manifest_path = os.path.join(frontend_cache_dir, key + ".manifest")
+    user_depfile = args[args.index('-MF') + 1] if '-MF' in args[:-1] else None
+
+    entries = read_manifest(manifest_path)
+    for entry in entries:
+        if all(file_hash(path) == digest for path, digest in entry["deps"].items()):
+            bitcode = read_file(os.path.join(frontend_cache_dir, entry["result"] + ".bc"))
+            depfile_text = read_file(os.path.join(frontend_cache_dir, entry["result"] + ".d"))
+            if bitcode is not None and depfile_text is not None:
+                # the build system still gets the depfile it asked for
+                if user_depfile is not None:
+                    with open(user_depfile, "wb") as f:
+                        f.write(depfile_text)
+                return bitcode
+
+    depfile = user_depfile
+    if depfile is None:
+        fd, depfile = tempfile.mkstemp(dir=frontend_cache_dir, prefix=".tmp", suffix=".d")
+        os.close(fd)
+        cmd += ['-MD', '-MF', depfile]
+    start = time.time()
+    try:
+        bitcode = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+        depfile_text = read_file(depfile)
+    finally:
+        if user_depfile is None:
+            os.remove(depfile)
+    if depfile_text is None:
+        return bitcode
+
+    deps = {}
+    for path in parse_depfile(depfile_text.decode("utf-8")):
+        try:
+            # a file modified while it was compiled may not have the hash of what was compiled
+            if os.stat(path).st_mtime >= start:
+                return bitcode
+        except OSError:
+            return bitcode
+        deps[path] = file_hash(path)
+    result = hashlib.sha256((key + json.dumps(sorted(deps.items()))).encode("utf-8")).hexdigest()
+    write_atomic(os.path.join(frontend_cache_dir, result + ".bc"), bitcode)
+    write_atomic(os.path.join(frontend_cache_dir, result + ".d"), depfile_text)
+    # the newest closure first; concurrent updates may drop an entry, which only costs a miss
+    entries = [entry for entry in read_manifest(manifest_path) if entry["result"] != result]
+    entries.insert(0, {"deps": deps, "result": result})
+    write_atomic(manifest_path, json.dumps(entries[:max_manifest_entries]).encode("utf-8"))
+    return bitcode
+
+# object cache: the object only depends on the frontend output, the normalized pipeline, the codegen flags
+# and the clang version; stats.json counts hits, misses and the size of the cache, updated under stats.lock,
+# and once the size exceeds object_cache_size the least recently used objects are evicted
+object_cache_dir = os.environ.get("PIPEXPLORE_OBJECT_CACHE", object_cache_dir)
+object_cache_size = int(os.environ.get("PIPEXPLORE_OBJECT_CACHE_SIZE", object_cache_size))
+
+def read_stats():
+    try:
+        with open(os.path.join(object_cache_dir, "stats.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"hits": 0, "misses": 0, "size": 0}
+
+def update_stats(hits=0, misses=0, added=0):
+    with open(os.path.join(object_cache_dir, "stats.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stats = read_stats()
+        stats["hits"] += hits
+        stats["misses"] += misses
+        stats["size"] += added
+        if stats["size"] > object_cache_size:
+            stats["size"] = evict(object_cache_size * 9 // 10)
+        write_atomic(os.path.join(object_cache_dir, "stats.json"), json.dumps(stats).encode("utf-8"))
+
+# remove the least recently used objects (hits refresh the modification time) until the cache fits
+# return: the size of the cache
+def evict(limit):
+    objects = []
+    for name in os.listdir(object_cache_dir):
+        if name.endswith(".o"):
+            try:
+                st = os.stat(os.path.join(object_cache_dir, name))
+            except OSError:
+                continue
+            objects.append((st.st_mtime, st.st_size, name))
+    objects.sort()
+    size = sum(object_size for _, object_size, _ in objects)
+    for _, object_size, name in objects:
+        if size <= limit:
+            break
+        try:
+            os.remove(os.path.join(object_cache_dir, name))
+            size -= object_size
+        except OSError:
+            pass
+    return size
+
+def object_cache_path(step1_result, opt_level):
+    h = hashlib.sha256()
+    for part in [clang_version, compose_atom_tree(parse_string_as_tree(pipeline_str)), '-O' + opt_level]:
+        h.update(part.encode("utf-8") + b"\0")
+    h.update(step1_result)
+    return os.path.join(object_cache_dir, h.hexdigest() + ".o")
+
 args = sys.argv[1:]
 
+if args == ['--show-stats']:
+    stats = read_stats() if object_cache_dir != "" else {"hits": 0, "misses": 0, "size": 0}
+    print(f"object cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} bytes in {object_cache_dir or '(disabled)'}")
+    exit(0)
+
 # processing flags
 # if -o specified ... record and remove
 output_file = None
@@ -537,37 +1276,46 @@ if '-O' in args:
 else:
     opt_level = "3"
 
-def generate_random_str():
-    keys = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-    return ''.join(random.choices(keys, k=32))
-
-# step 1. precompile with old and new flags
-step1_result_file = os.path.join(tmp, generate_random_str() + ".ll")
-cmd = [clang, '-O3', '-mllvm', '-disable-llvm-optzns', '-emit-llvm','-S', '-o', step1_result_file] + args
-subprocess.run(cmd, check=True)
+# step 1. precompile with old and new flags, the modules are piped as bitcode
+step1_result = frontend(args)
+
+# the object may be cached, unless the pipeline must be minimized
+object_path = None
+if object_cache_dir != "" and minimized_pipeline_file == "":
+    os.makedirs(object_cache_dir, exist_ok=True)
+    object_path = object_cache_path(step1_result, opt_level)
+    cached_object = read_file(object_path)
+    if cached_object is not None:
+        with open(output_file, "wb") as f:
+            f.write(cached_object)
+        # the object was read, but another compiler may evict it meanwhile: the hit only loses its bookkeeping
+        try:
+            os.utime(object_path)
+            update_stats(hits=1)
+        except OSError:
+            pass
+        exit(0)
 
 # step 2. optimize with pipeline
-step2_result_file = os.path.join(tmp, generate_random_str() + ".ll")
-cmd = [opt, step1_result_file, '-passes=' + pipeline_str, '-S', '-o', step2_result_file]
-subprocess.run(cmd, check=True)
+cmd = [opt, '-', '-passes=' + pipeline_str, '-o', '-']
+step2_result = subprocess.run(cmd, check=True, input=step1_result, stdout=subprocess.PIPE).stdout
 
 if minimized_pipeline_file != "":
-    with open(step2_result_file, "r") as f:
-        input_ll_str = f.read()
+    cmd = [opt, '-', '-S', '-o', '-']
+    input_ll_str = subprocess.run(cmd, check=True, input=step2_result, stdout=subprocess.PIPE).stdout.decode("utf-8")
     minimized_pipeline = pipeline_minimize(input_ll_str, pipeline_str)
     with open(minimized_pipeline_file, "w") as f:
         f.write(minimized_pipeline)
 
 # step 3. compile to object file with specified optimization level
-cmd = [clang, step2_result_file, '-c', '-o', output_file, '-O' + opt_level]
-subprocess.run(cmd, check=True)
-
-# step 4. remove temporary files, allowing failure
-try:
-    os.remove(step1_result_file)
-    os.remove(step2_result_file)
-except Exception as e:
-    pass
+cmd = [clang, '-x', 'ir', '-', '-c', '-o', output_file, '-O' + opt_level]
+subprocess.run(cmd, check=True, input=step2_result)
+
+if object_path is not None:
+    compiled_object = read_file(output_file)
+    if compiled_object is not None:
+        write_atomic(object_path, compiled_object)
+        update_stats(misses=1, added=len(compiled_object))
 """
     with open(compiler_full_path, "w") as f:
         f.write(text)
@@ -577,7 +1325,10 @@ except Exception as e:
 
     return True
 
-def from_pipeline_make_a_compiler(pipeline_str, minimized_pipeline_file=""):
-    compiler_full_path = os.path.join(tmp, f"{generate_random_str()}")
-    from_pipeline_make_a_compiler_to_path(pipeline_str, compiler_full_path, minimized_pipeline_file)
+# the compilers of the GA share the frontend and object caches of the run
+# the object cache is evicted down to object_cache_size bytes by the compilers that find it larger
+def from_pipeline_make_a_compiler(pipeline_str, minimized_pipeline_file="", object_cache_size=1 << 30):
+    compiler_full_path = workspace_path()
+    from_pipeline_make_a_compiler_to_path(pipeline_str, compiler_full_path, minimized_pipeline_file,
+                                          get_frontend_cache_dir(), get_object_cache_dir(), object_cache_size)
     return compiler_full_path
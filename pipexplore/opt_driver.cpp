@@ -0,0 +1,237 @@
+// a persistent opt: loads LLVM once, then runs jobs read from stdin as `opt - <arguments> -o -` would,
+// each in a fresh LLVMContext, see PersistentOpt in pipexplore/llvm.py
+// job:    u32 argument count, per argument u32 length and bytes, u64 module length and bytes (ll or bitcode)
+// result: i32 exit code, u64 output length and bytes, u64 diagnostics length and bytes
+// arguments: -passes=..., -S, -strip-debug, -disable-output, -preserve-bc-uselistorder, -preserve-ll-uselistorder
+// anything else is refused with exit code 2, the caller runs opt instead
+// the setup follows opt's (tools/opt/opt.cpp and NewPMDriver.cpp) for these arguments, so the output is the same
+#include <cstdint>
+#include <cstdio>
+#include <string>
+#include <vector>
+#include <unistd.h>
+
+#include "llvm/ADT/Triple.h"
+#include "llvm/Analysis/AliasAnalysis.h"
+#include "llvm/Analysis/TargetLibraryInfo.h"
+#include "llvm/Bitcode/BitcodeWriterPass.h"
+#include "llvm/CodeGen/CommandFlags.h"
+#include "llvm/IR/DebugInfo.h"
+#include "llvm/IR/IRPrintingPasses.h"
+#include "llvm/IR/LLVMContext.h"
+#include "llvm/IR/Module.h"
+#include "llvm/IR/PassManager.h"
+#include "llvm/IR/Verifier.h"
+#include "llvm/IRReader/IRReader.h"
+#include "llvm/MC/TargetRegistry.h"
+#include "llvm/Passes/PassBuilder.h"
+#include "llvm/Passes/StandardInstrumentations.h"
+#include "llvm/Support/Error.h"
+#include "llvm/Support/MemoryBuffer.h"
+#include "llvm/Support/SourceMgr.h"
+#include "llvm/Support/TargetSelect.h"
+#include "llvm/Support/raw_ostream.h"
+#include "llvm/Target/TargetMachine.h"
+
+using namespace llvm;
+
+static codegen::RegisterCodeGenFlags CodeGenFlags;
+
+// the protocol's own descriptors, stdout and stderr are redirected to the diagnostics of the job
+static int JobIn = 0;
+static int JobOut = -1;
+
+static bool readAll(void *Data, size_t Size) {
+  char *P = static_cast<char *>(Data);
+  while (Size) {
+    ssize_t N = read(JobIn, P, Size);
+    if (N <= 0)
+      return false;
+    P += N;
+    Size -= N;
+  }
+  return true;
+}
+
+static bool writeAll(const void *Data, size_t Size) {
+  const char *P = static_cast<const char *>(Data);
+  while (Size) {
+    ssize_t N = write(JobOut, P, Size);
+    if (N <= 0)
+      return false;
+    P += N;
+    Size -= N;
+  }
+  return true;
+}
+
+static bool readString(std::string &S, uint64_t Size) {
+  S.resize(Size);
+  return Size == 0 || readAll(&S[0], Size);
+}
+
+static CodeGenOpt::Level getCodeGenOptLevel() {
+  // opt without -O flags
+  return CodeGenOpt::None;
+}
+
+static int runJob(const std::vector<std::string> &Args, const std::string &Input, std::string &Output) {
+  std::string PassPipeline;
+  bool OutputAssembly = false, StripDebug = false, NoOutput = false;
+  // opt preserves the use-list order in bitcode by default, not in ll
+  bool PreserveBitcodeUseListOrder = true, PreserveAssemblyUseListOrder = false;
+  for (const std::string &Arg : Args) {
+    if (Arg.rfind("-passes=", 0) == 0)
+      PassPipeline = Arg.substr(8);
+    else if (Arg == "-S")
+      OutputAssembly = true;
+    else if (Arg == "-strip-debug")
+      StripDebug = true;
+    else if (Arg == "-disable-output")
+      NoOutput = true;
+    else if (Arg == "-preserve-bc-uselistorder")
+      PreserveBitcodeUseListOrder = true;
+    else if (Arg == "-preserve-ll-uselistorder")
+      PreserveAssemblyUseListOrder = true;
+    else {
+      errs() << "opt driver: unsupported argument '" << Arg << "'\n";
+      return 2;
+    }
+  }
+
+  LLVMContext Context;
+  SMDiagnostic Err;
+  std::unique_ptr<MemoryBuffer> Buffer = MemoryBuffer::getMemBuffer(Input, "<stdin>", false);
+  std::unique_ptr<Module> M = parseIR(Buffer->getMemBufferRef(), Err, Context);
+  if (!M) {
+    Err.print("opt", errs());
+    return 1;
+  }
+  if (StripDebug)
+    StripDebugInfo(*M);
+  if (verifyModule(*M, &errs())) {
+    errs() << "opt: -: error: input module is broken!\n";
+    return 1;
+  }
+
+  Triple ModuleTriple(M->getTargetTriple());
+  std::string CPUStr, FeaturesStr;
+  std::unique_ptr<TargetMachine> TM;
+  const TargetOptions Options = codegen::InitTargetOptionsFromCodeGenFlags(ModuleTriple);
+  if (ModuleTriple.getArch()) {
+    CPUStr = codegen::getCPUStr();
+    FeaturesStr = codegen::getFeaturesStr();
+    std::string Error;
+    const Target *TheTarget = TargetRegistry::lookupTarget(codegen::getMArch(), ModuleTriple, Error);
+    if (TheTarget)
+      TM.reset(TheTarget->createTargetMachine(ModuleTriple.getTriple(), CPUStr, FeaturesStr, Options,
+                                              codegen::getExplicitRelocModel(), codegen::getExplicitCodeModel(),
+                                              getCodeGenOptLevel()));
+  } else if (ModuleTriple.getArchName() != "unknown" && ModuleTriple.getArchName() != "") {
+    errs() << "opt: unrecognized architecture '" << ModuleTriple.getArchName() << "' provided.\n";
+    return 1;
+  }
+  codegen::setFunctionAttributes(CPUStr, FeaturesStr, *M);
+  TargetLibraryInfoImpl TLII(ModuleTriple);
+
+  LoopAnalysisManager LAM;
+  FunctionAnalysisManager FAM;
+  CGSCCAnalysisManager CGAM;
+  ModuleAnalysisManager MAM;
+
+  PassInstrumentationCallbacks PIC;
+  StandardInstrumentations SI(false, false);
+  SI.registerCallbacks(PIC, &FAM);
+
+  PipelineTuningOptions PTO;
+  PTO.LoopUnrolling = true;
+  PassBuilder PB(TM.get(), PTO, None, &PIC);
+
+  AAManager AA;
+  if (auto E = PB.parseAAPipeline(AA, "default")) {
+    errs() << "opt: " << toString(std::move(E)) << "\n";
+    return 1;
+  }
+  FAM.registerPass([&] { return std::move(AA); });
+  FAM.registerPass([&] { return TargetLibraryAnalysis(TLII); });
+  PB.registerModuleAnalyses(MAM);
+  PB.registerCGSCCAnalyses(CGAM);
+  PB.registerFunctionAnalyses(FAM);
+  PB.registerLoopAnalyses(LAM);
+  PB.crossRegisterProxies(LAM, FAM, CGAM, MAM);
+
+  ModulePassManager MPM;
+  MPM.addPass(VerifierPass());
+  if (!PassPipeline.empty()) {
+    if (auto E = PB.parsePassPipeline(MPM, PassPipeline)) {
+      errs() << "opt: " << toString(std::move(E)) << "\n";
+      return 1;
+    }
+  }
+  MPM.addPass(VerifierPass());
+
+  raw_string_ostream OS(Output);
+  if (NoOutput)
+    ;
+  else if (OutputAssembly)
+    MPM.addPass(PrintModulePass(OS, "", PreserveAssemblyUseListOrder));
+  else
+    MPM.addPass(BitcodeWriterPass(OS, PreserveBitcodeUseListOrder, false, false));
+  MPM.run(*M, MAM);
+  OS.flush();
+  return 0;
+}
+
+int main() {
+  InitializeAllTargets();
+  InitializeAllTargetMCs();
+  InitializeAllAsmPrinters();
+  InitializeAllAsmParsers();
+
+  // keep the protocol's stdout, and collect everything printed during a job in a file
+  JobOut = dup(1);
+  FILE *Diagnostics = tmpfile();
+  if (JobOut < 0 || !Diagnostics)
+    return 1;
+  int DiagnosticsFd = fileno(Diagnostics);
+  dup2(DiagnosticsFd, 1);
+  dup2(DiagnosticsFd, 2);
+
+  while (true) {
+    uint32_t Count;
+    if (!readAll(&Count, sizeof(Count)))
+      return 0;
+    std::vector<std::string> Args(Count);
+    for (std::string &Arg : Args) {
+      uint32_t Size;
+      if (!readAll(&Size, sizeof(Size)) || !readString(Arg, Size))
+        return 1;
+    }
+    uint64_t InputSize;
+    std::string Input;
+    if (!readAll(&InputSize, sizeof(InputSize)) || !readString(Input, InputSize))
+      return 1;
+
+    if (ftruncate(DiagnosticsFd, 0) != 0 || lseek(DiagnosticsFd, 0, SEEK_SET) != 0)
+      return 1;
+    std::string Output;
+    int32_t Code = runJob(Args, Input, Output);
+    if (Code != 0)
+      Output.clear();
+    outs().flush();
+    errs().flush();
+
+    std::string Messages;
+    off_t End = lseek(DiagnosticsFd, 0, SEEK_END);
+    if (End > 0) {
+      Messages.resize(End);
+      if (pread(DiagnosticsFd, &Messages[0], End, 0) != End)
+        return 1;
+    }
+    uint64_t OutputSize = Output.size(), MessagesSize = Messages.size();
+    if (!writeAll(&Code, sizeof(Code)) || !writeAll(&OutputSize, sizeof(OutputSize)) ||
+        !writeAll(Output.data(), OutputSize) || !writeAll(&MessagesSize, sizeof(MessagesSize)) ||
+        !writeAll(Messages.data(), MessagesSize))
+      return 1;
+  }
+}
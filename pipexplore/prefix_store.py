@@ -0,0 +1,241 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pipexplore.llvm as llvm
+
+
+class PrefixNode:
+    """
+    A node of the prefix trie: the pipeline prefix from the root to this node,
+    and optionally a snapshot of the IR after running that prefix.
+    """
+    def __init__(self, atom: str = None, parent: 'PrefixNode' = None):
+        self.atom = atom
+        self.parent = parent
+        self.children = {}
+        self.snapshot = None   # IR kept in memory, bitcode bytes or ll string
+        self.disk_path = None  # IR file spilled to disk, .bc or .ll
+        self.disk_size = 0
+
+
+class PrefixIRStore:
+    """
+    IR snapshots organized as a trie over atomized pass prefixes, one trie per input module.
+    Evaluating a pipeline only runs opt on the atoms after its longest cached prefix, and stores
+    a snapshot every checkpoint_interval atoms for later pipelines sharing that prefix.
+    Snapshots are bitcode written with -preserve-bc-uselistorder: a textual ll round trip renumbers
+    the use lists, and passes visiting uses in order then give a different IR than a single opt run.
+    A pipeline run in pieces can still differ from a single run if a pass depends on analyses cached by
+    an earlier pass of the same process, so the first verify_first pipelines, and then every
+    verify_every-th, are also run at once and their stripped IR (see llvm.strip) compared;
+    after a mismatch, every pipeline is run at once.
+    pipeline_minimize restarts opt after every atom on textual ll, as llvm.pipeline_minimize does,
+    and uses a separate trie.
+    Snapshots are evicted least-recently-used: to disk_dir if given, and then dropped.
+    """
+    def __init__(self,
+                 max_bytes: int = 256 << 20,
+                 disk_dir: Path = None,
+                 max_disk_bytes: int = 1 << 30,
+                 checkpoint_interval: int = 8,
+                 verify_first: int = 8,
+                 verify_every: int = 32):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.checkpoint_interval = max(1, checkpoint_interval)
+        if disk_dir is not None:
+            Path(disk_dir).mkdir(parents=True, exist_ok=True)
+            # a private directory, so several stores may share disk_dir
+            disk_dir = Path(tempfile.mkdtemp(dir=disk_dir, prefix="prefix_store_"))
+        self.disk_dir = disk_dir
+        self.roots = {}              # (input hash, checkpoint interval) -> root node
+        self.memory = OrderedDict()  # node -> None, in least-recently-used order
+        self.disk = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0                # atoms skipped thanks to a cached prefix
+        self.runs = 0                # atoms run by opt
+        self.verify_first = verify_first
+        self.verify_every = max(1, verify_every)
+        self.pipelines = 0           # pipelines run through pipeline_opt
+        self.verified = 0            # of which also run at once
+        self.mismatches = 0          # of which gave a different IR
+        self.consistent = True       # whether pipelines are still run in pieces
+        self.lock = threading.Lock()
+
+    def root(self, input_ll_str: str, interval: int) -> PrefixNode:
+        key = (hashlib.sha256(input_ll_str.encode("utf-8")).hexdigest(), interval)
+        with self.lock:
+            node = self.roots.get(key)
+            if node is None:
+                node = PrefixNode()
+                # the input is held by the caller anyway, it is never evicted
+                node.snapshot = input_ll_str
+                self.roots[key] = node
+            return node
+
+    # read the snapshot of a node
+    # return: bitcode bytes or ll string, None if the node has no snapshot
+    def read(self, node: PrefixNode):
+        with self.lock:
+            if node.snapshot is not None:
+                if node in self.memory:
+                    self.memory.move_to_end(node)
+                return node.snapshot
+            disk_path = node.disk_path
+            if disk_path is None:
+                return None
+            self.disk.move_to_end(node)
+        try:
+            with open(disk_path, "rb" if disk_path.endswith(".bc") else "r") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    # walk down the trie along the atoms, then read only the deepest snapshot,
+    # backing off to shallower ones if it was evicted or its file cannot be read meanwhile
+    # return: (deepest node with a snapshot, its depth, its IR)
+    def longest_prefix(self, root: PrefixNode, atoms):
+        candidates = []  # (depth, node) with a snapshot, shallowest first
+        node = root
+        with self.lock:
+            for depth, atom in enumerate(atoms, 1):
+                node = node.children.get(atom)
+                if node is None:
+                    break
+                if node.snapshot is not None or node.disk_path is not None:
+                    candidates.append((depth, node))
+        for depth, node in reversed(candidates):
+            ir = self.read(node)
+            if ir is not None:
+                return node, depth, ir
+        return root, 0, root.snapshot
+
+    # store the snapshot after running atoms from a node
+    # return: the child node
+    def insert(self, node: PrefixNode, atoms, ir) -> PrefixNode:
+        with self.lock:
+            for atom in atoms:
+                child = node.children.get(atom)
+                if child is None:
+                    child = PrefixNode(atom, node)
+                    node.children[atom] = child
+                node = child
+            if node.snapshot is None:
+                node.snapshot = ir
+                self.memory[node] = None
+                self.memory_bytes += len(ir)
+                self.evict()
+            return node
+
+    # evict snapshots until the store fits its bounds, the lock must be held
+    def evict(self) -> None:
+        while self.memory_bytes > self.max_bytes and self.memory:
+            node, _ = self.memory.popitem(last=False)
+            ir = node.snapshot
+            node.snapshot = None
+            self.memory_bytes -= len(ir)
+            if self.disk_dir is not None and node.disk_path is None:
+                binary = isinstance(ir, bytes)
+                node.disk_path = os.path.join(self.disk_dir, llvm.generate_random_str() + (".bc" if binary else ".ll"))
+                with open(node.disk_path, "wb" if binary else "w") as f:
+                    f.write(ir)
+                node.disk_size = len(ir)
+                self.disk[node] = None
+                self.disk_bytes += node.disk_size
+            else:
+                self.prune(node)
+        while self.disk_bytes > self.max_disk_bytes and self.disk:
+            node, _ = self.disk.popitem(last=False)
+            try:
+                os.remove(node.disk_path)
+            except OSError:
+                pass
+            node.disk_path = None
+            self.disk_bytes -= node.disk_size
+            self.prune(node)
+
+    # remove the nodes holding neither a snapshot nor a descendant, the lock must be held
+    def prune(self, node: PrefixNode) -> None:
+        while node.parent is not None and not node.children and node.snapshot is None and node.disk_path is None:
+            node.parent.children.pop(node.atom, None)
+            node = node.parent
+
+    # pipeline the ll string, reusing the longest cached prefix
+    # argument: ll string, passes string
+    # return: optimized ll string, stripped it is the one of a single opt run (only value names may differ)
+    def pipeline_opt(self, input_ll_str: str, passes_str: str) -> str:
+        with self.lock:
+            consistent = self.consistent
+            self.pipelines += 1
+            check = self.pipelines <= self.verify_first or self.pipelines % self.verify_every == 0
+        if not consistent:
+            return llvm.pipeline_opt(input_ll_str, passes_str)
+        optimized = self.pipeline_opt_chunked(input_ll_str, passes_str)
+        if check:
+            single = llvm.pipeline_opt(input_ll_str, passes_str)
+            with self.lock:
+                self.verified += 1
+                if (single == "") != (optimized == "") or llvm.strip(single) != llvm.strip(optimized):
+                    self.mismatches += 1
+                    self.consistent = False
+            return single
+        return optimized
+
+    # pipeline the ll string in pieces of checkpoint_interval atoms, reusing the longest cached prefix
+    # argument: ll string, passes string
+    # return: optimized ll string, empty if opt failed
+    def pipeline_opt_chunked(self, input_ll_str: str, passes_str: str) -> str:
+        atoms = llvm.atomize_tree(llvm.parse_string_as_tree(passes_str))
+        root = self.root(input_ll_str, self.checkpoint_interval)
+        node, depth, ir = self.longest_prefix(root, atoms)
+        with self.lock:
+            self.hits += depth
+        while depth < len(atoms):
+            chunk = atoms[depth:depth + self.checkpoint_interval]
+            result = llvm.opt_pipe(ir, ["-passes=" + ','.join(chunk), "-preserve-bc-uselistorder"])
+            if result.returncode != 0 or result.stdout == b"":
+                # opt rejected the pipeline or failed, nothing worth caching
+                return ""
+            ir = result.stdout
+            with self.lock:
+                self.runs += len(chunk)
+            node = self.insert(node, chunk, ir)
+            depth += len(chunk)
+        return llvm.to_text(ir)
+
+    # minimize the pipeline, see llvm.pipeline_minimize
+    # argument: ll string, passes string
+    # return: minimized pipeline string
+    def pipeline_minimize(self, input_ll_str: str, passes_str: str) -> str:
+        pass_atom_tree = llvm.atomize_tree(llvm.parse_string_as_tree(passes_str))
+        node = self.root(input_ll_str, 1)
+        current_input = input_ll_str
+        minimized_pass_tree = []
+        for atom in pass_atom_tree:
+            with self.lock:
+                child = node.children.get(atom)
+            next_input = self.read(child) if child is not None else None
+            if next_input is None:
+                next_input = llvm.pipeline_opt(current_input, atom)
+                with self.lock:
+                    self.runs += 1
+                node = self.insert(node, [atom], next_input)
+            else:
+                with self.lock:
+                    self.hits += 1
+                node = child
+            if not llvm.text_ll_equivalent(next_input, current_input):
+                minimized_pass_tree.append(atom)
+            current_input = next_input
+        return llvm.compose_atom_tree(minimized_pass_tree)
+
+    def __str__(self):
+        with self.lock:
+            return (f"prefix store: {self.hits} atoms reused, {self.runs} atoms run, "
+                    f"{len(self.memory)} snapshots in memory ({self.memory_bytes >> 20} MiB), {len(self.disk)} on disk, "
+                    f"{self.mismatches} of {self.verified} verified pipelines differed from a single run")
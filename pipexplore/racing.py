@@ -0,0 +1,108 @@
+import math
+import inspect
+import threading
+from dataclasses import dataclass, field
+from typing import List
+
+import pipexplore.interface as interface
+
+# two-sided 95% quantiles of Student's t distribution, by degrees of freedom
+t95_table = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+             2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+             2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def t95(df):
+    return t95_table[df - 1] if df <= len(t95_table) else 1.96
+
+# mean and half width of the 95% confidence interval of the mean
+# argument: at least 2 samples
+# return: (mean, half width)
+def confidence_interval(samples):
+    n = len(samples)
+    mean = sum(samples) / n
+    variance = sum((x - mean) ** 2 for x in samples) / (n - 1)
+    return mean, t95(n - 1) * math.sqrt(variance / n)
+
+
+@dataclass
+class RacedProfile(interface.Profile):
+    """
+    The profiles of all the rounds a candidate was raced for.
+    The fitness is the mean of their samples, other attributes are those of the last profile.
+    """
+    profiles: List[interface.Profile] = field(default_factory=list)
+    sample_list: List[float] = field(default_factory=list)
+
+    def fitness(self) -> float:
+        return sum(self.sample_list) / len(self.sample_list)
+
+    def constraint(self) -> bool:
+        return all(profile.constraint() for profile in self.profiles)
+
+    def samples(self) -> List[float]:
+        return self.sample_list
+
+    def __getattr__(self, name):
+        # only called for missing attributes; the fields are missing while unpickling
+        if name.startswith("__") or name in ("profiles", "sample_list"):
+            raise AttributeError(name)
+        return getattr(self.profiles[-1], name)
+
+
+class Racer:
+    """
+    Measure a compiled experiment adaptively, `step` repetitions at a time (run(round=step)).
+    A candidate stops once its 95% confidence interval is entirely below the elite cutoff, since it cannot
+    become an elite, or once the interval is narrower than `precision` (relative) and above the cutoff.
+    Candidates close to the cutoff run up to max_rounds repetitions.
+    Experiments whose run() takes no `round` keyword are run once, as without racing.
+    """
+    def __init__(self, min_rounds: int = 3, max_rounds: int = 10, step: int = 1, precision: float = 0.01):
+        self.min_rounds = max(2 * step, min_rounds)
+        self.max_rounds = max(self.min_rounds, max_rounds)
+        self.step = step
+        self.precision = precision
+        self.raced = 0
+        self.rounds = 0
+        self.rejected = 0  # stopped early below the cutoff
+        self.settled = 0   # stopped early above the cutoff
+        self.lock = threading.Lock()
+
+    # run the experiment until its fitness is known well enough with respect to the cutoff
+    # argument: compiled experiment, fitness of the worst elite (None if unknown yet)
+    # return: profile
+    def run(self, experiment_copy: interface.Experiment, cutoff: float = None) -> interface.Profile:
+        if "round" not in inspect.signature(experiment_copy.run).parameters:
+            return experiment_copy.run()
+        profile = RacedProfile()
+        rounds = 0
+        stop = None
+        while rounds < self.max_rounds:
+            step = min(self.step, self.max_rounds - rounds)
+            round_profile = experiment_copy.run(round=step)
+            profile.profiles.append(round_profile)
+            profile.sample_list.extend(round_profile.samples())
+            rounds += step
+            if rounds < self.min_rounds or len(profile.sample_list) < 2:
+                continue
+            mean, half_width = confidence_interval(profile.sample_list)
+            if cutoff is not None and mean + half_width < cutoff:
+                stop = "rejected"
+                break
+            if half_width <= self.precision * abs(mean) and (cutoff is None or mean - half_width > cutoff):
+                stop = "settled"
+                break
+        with self.lock:
+            self.raced += 1
+            self.rounds += rounds
+            if stop == "rejected":
+                self.rejected += 1
+            elif stop == "settled":
+                self.settled += 1
+        return profile
+
+    def __str__(self):
+        with self.lock:
+            average = self.rounds / self.raced if self.raced else 0
+            return (f"racer: {self.raced} candidates, {average:.1f} rounds on average (max {self.max_rounds}), "
+                    f"{self.rejected} rejected early, {self.settled} settled early")
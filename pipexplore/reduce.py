@@ -0,0 +1,108 @@
+import os
+import copy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pipexplore.llvm as llvm
+import pipexplore.interface as interface
+
+
+class SameStrippedIROracle:
+    """
+    Accept a pipeline if it gives the same stripped IR as the reference pipeline.
+    """
+    def __init__(self, input_ll_str: str, reference_passes_str: str):
+        self.input_ll_str = input_ll_str
+        self.reference = llvm.strip(llvm.pipeline_opt(input_ll_str, reference_passes_str))
+
+    def __call__(self, passes_str: str) -> bool:
+        optimized = llvm.pipeline_opt(self.input_ll_str, passes_str)
+        return optimized != "" and llvm.strip(optimized) == self.reference
+
+
+class SameFitnessOracle:
+    """
+    Accept a pipeline if the experiment satisfies its constraint and the fitness is at most
+    `tolerance` (relative) worse than the reference fitness.
+    Each test compiles and runs a copy of the experiment, so use threads unless the experiment pickles.
+    """
+    def __init__(self, experiment: interface.Experiment, reference_fitness: float, tolerance: float = 0.01):
+        self.experiment = experiment
+        self.reference_fitness = reference_fitness
+        self.tolerance = tolerance
+
+    def __call__(self, passes_str: str) -> bool:
+        # imported here, xGA reads the O3 pipeline from opt when imported
+        from pipexplore.xGA import Individual
+        individual = Individual(passes_str.split(",") if passes_str else [])
+        if not individual.run_profile(copy.deepcopy(self.experiment)):
+            return False
+        if not individual.profile.constraint():
+            return False
+        return individual.profile.fitness() >= self.reference_fitness - self.tolerance * abs(self.reference_fitness)
+
+
+# split the list into n chunks of nearly equal length
+# argument: list, n
+# return: [chunk, ...]
+def split(atoms, n):
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + (len(atoms) - start) // (n - i)
+        chunks.append(atoms[start:end])
+        start = end
+    return chunks
+
+
+# reduce the pipeline with delta debugging (ddmin)
+# argument: passes string, oracle (passes string -> bool, must accept the input pipeline),
+#           number of parallel jobs, whether to test candidates in processes or threads
+# return: reduced pipeline string, 1-minimal with respect to the oracle
+def ddmin(passes_str, oracle, jobs: int = None, use_processes: bool = True):
+    atoms = llvm.atomize_tree(llvm.parse_string_as_tree(passes_str))
+    jobs = jobs or os.cpu_count()
+    pool = ProcessPoolExecutor(max_workers=jobs) if use_processes else ThreadPoolExecutor(max_workers=jobs)
+    tested = {}  # pipeline string -> oracle result
+
+    def test_all(candidates):
+        strings = [','.join(candidate) for candidate in candidates]
+        todo = [s for s in dict.fromkeys(strings) if s not in tested]
+        for s, result in zip(todo, pool.map(oracle, todo)):
+            tested[s] = result
+        return [tested[s] for s in strings]
+
+    with pool:
+        # the empty pipeline is the best possible result, check it first
+        if atoms and test_all([[]])[0]:
+            return ""
+        n = 2
+        while len(atoms) >= 2:
+            n = min(n, len(atoms))
+            chunks = split(atoms, n)
+            complements = [sum(chunks[:i] + chunks[i + 1:], []) for i in range(n)] if n > 2 else []
+            # all subsets and complements of a round are tested at once
+            results = test_all(chunks + complements)
+            subset_results, complement_results = results[:n], results[n:]
+            if True in subset_results:
+                atoms = chunks[subset_results.index(True)]
+                n = 2
+            elif True in complement_results:
+                atoms = complements[complement_results.index(True)]
+                n = max(n - 1, 2)
+            elif n < len(atoms):
+                n = min(2 * n, len(atoms))
+            else:
+                break
+    return ','.join(atoms)
+
+
+# reduce the pipeline to a short one giving the same stripped IR
+# argument: ll string, passes string, number of parallel jobs
+# return: reduced pipeline string
+def pipeline_reduce(input_ll_str, passes_str, jobs: int = None):
+    oracle = SameStrippedIROracle(input_ll_str, passes_str)
+    # dropping the atoms without any effect first is cheap, and leaves ddmin a much shorter list
+    minimized = llvm.pipeline_minimize(input_ll_str, passes_str)
+    if not oracle(minimized):
+        minimized = llvm.compose_atom_tree(llvm.parse_string_as_tree(passes_str))
+    return ddmin(minimized, oracle, jobs)
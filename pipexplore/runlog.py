@@ -0,0 +1,228 @@
+# structured run log: one JSON object per line (JSONL), written by a background thread
+# every event has "event" and "time" (seconds since the log was opened), and:
+#   start:      population_size, generations, mode
+#   pipeline:   id, passes; written once, before the first event referring to the pipeline
+#   individual: generation, pipeline (id), length, success, cache (how the profile was obtained, see below),
+#               eval_time (seconds spent compiling and running, null if unknown), and on success
+#               fitness, constraint and profile (the JSON-friendly fields of the profile);
+#               in island mode also island, and generation counts the generations of that island
+#   generation: generation, best_fitness, population (size)
+#   island:     island, generation, best_fitness
+#   end:        best_fitness_before, best_fitness_after, pipeline (id)
+# cache is one of: "measured" (built and run), "fitness_cache" (same pipeline cached), "ir_index" (same optimized
+# IR measured), "cascade" (rejected by a cheap tier), "remote" (profiled by a distributed worker), "failed",
+# "lost" (no distributed worker could finish it, see pipexplore.distributed)
+#
+# print a summary, or plot the best fitness, with: python -m pipexplore.runlog run.jsonl [--plot fitness.png]
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import Counter
+from dataclasses import fields, is_dataclass
+
+
+# the fields of a profile that can be written as JSON: numbers, strings, booleans and lists of numbers
+# argument: profile
+# return: {name: value}
+def profile_fields(profile):
+    if is_dataclass(profile):
+        values = {field.name: getattr(profile, field.name) for field in fields(profile)}
+    else:
+        values = dict(getattr(profile, "__dict__", {}))
+    result = {}
+    for name, value in values.items():
+        if isinstance(value, (bool, int, float, str)) or value is None:
+            result[name] = value
+        elif isinstance(value, (list, tuple)) and all(isinstance(x, (int, float)) for x in value):
+            result[name] = list(value)
+    return result
+
+
+# the fields of an individual event, with the pipeline as its passes string; they pickle, so that
+# another process (e.g. an island) can send them to the process writing the log, see RunLog.individual_event
+# argument: generation, individual, whether it has a valid profile
+# return: {field: value}
+def individual_fields(generation: int, individual, success: bool) -> dict:
+    record = {"generation": generation, "passes": individual.to_string(), "length": len(individual),
+              "success": bool(success), "cache": individual.cache_status, "eval_time": individual.eval_time}
+    if success and individual.profile is not None:
+        record["fitness"] = individual.profile.fitness()
+        record["constraint"] = individual.profile.constraint()
+        record["profile"] = profile_fields(individual.profile)
+    return record
+
+
+class RunLog:
+    """
+    Write run events as JSONL without blocking the GA: events are queued, and a background thread
+    serializes them into a buffered file, flushed every flush_interval seconds and when the log is closed.
+    Pipelines are written once and referred to by id, so that re-logging a pipeline costs a few bytes.
+    """
+    def __init__(self, path, flush_interval: float = 1.0, buffer_size: int = 1 << 16):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.file = open(path, "w", buffering=buffer_size)
+        self.queue = queue.SimpleQueue()
+        self.start_time = time.monotonic()
+        self.pipeline_ids = {}  # passes string -> id
+        self.lock = threading.Lock()
+        self.closed = False
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def write_loop(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = ()
+            if record is None:
+                break
+            if record:
+                self.file.write(json.dumps(record, default=str) + "\n")
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.file.flush()
+                last_flush = time.monotonic()
+        self.file.close()
+
+    # queue an event
+    # argument: event name, its fields
+    def write(self, event: str, **values) -> None:
+        if self.closed:
+            return
+        record = {"event": event, "time": round(time.monotonic() - self.start_time, 6)}
+        record.update(values)
+        self.queue.put(record)
+
+    # the id of a pipeline, written on first use
+    # argument: passes string
+    # return: id
+    def pipeline(self, passes_str: str) -> int:
+        with self.lock:
+            pipeline_id = self.pipeline_ids.get(passes_str)
+            if pipeline_id is not None:
+                return pipeline_id
+            pipeline_id = len(self.pipeline_ids)
+            self.pipeline_ids[passes_str] = pipeline_id
+            # queued under the lock, so that it precedes every event using the id
+            self.write("pipeline", id=pipeline_id, passes=passes_str)
+        return pipeline_id
+
+    # log an evaluated individual
+    # argument: generation, individual, whether it has a valid profile
+    def individual(self, generation: int, individual, success: bool) -> None:
+        self.individual_event(individual_fields(generation, individual, success))
+
+    # log an individual event made by individual_fields
+    # argument: its fields, extra fields (e.g. island)
+    def individual_event(self, record: dict, **values) -> None:
+        record = dict(record)
+        record["pipeline"] = self.pipeline(record.pop("passes"))
+        record.update(values)
+        self.write("individual", **record)
+
+    # write the queued events and close the file
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# read the events of a run log, with the passes string of the pipeline ids resolved
+# a log cut short by a crash is read up to its last complete line
+# argument: path, event names to return (default: all)
+# return: iterator of events
+def read_events(path, events=None):
+    pipelines = {}
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record["event"] == "pipeline":
+                pipelines[record["id"]] = record["passes"]
+            elif isinstance(record.get("pipeline"), int):
+                record["passes"] = pipelines.get(record["pipeline"])
+            if events is None or record["event"] in events:
+                yield record
+
+
+# the best fitness after each generation
+# argument: path
+# return: ([generation, ...], [best fitness, ...])
+def best_fitness_curve(path):
+    generations, fitnesses = [], []
+    for record in read_events(path, {"generation"}):
+        generations.append(record["generation"])
+        fitnesses.append(record["best_fitness"])
+    return generations, fitnesses
+
+
+# summarize a run log
+# argument: path
+# return: {"evaluations", "cache" (status -> count), "eval_time" (seconds), "best_fitness", "best_passes"}
+def summarize(path):
+    cache = Counter()
+    eval_time = 0.0
+    best = None
+    for record in read_events(path, {"individual"}):
+        cache[record["cache"]] += 1
+        eval_time += record["eval_time"] or 0.0
+        if record.get("constraint") and (best is None or record["fitness"] > best["fitness"]):
+            best = record
+    return {"evaluations": sum(cache.values()), "cache": dict(cache), "eval_time": eval_time,
+            "best_fitness": best["fitness"] if best else None, "best_passes": best["passes"] if best else None}
+
+
+# plot the best fitness per generation of one or more runs; requires matplotlib
+# argument: paths of run logs, image path (default: show the plot)
+def plot_runs(paths, output=None):
+    try:
+        import matplotlib
+        if output is not None:
+            matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise ImportError("plotting a run log requires matplotlib")
+    figure, axes = plt.subplots()
+    for path in paths:
+        generations, fitnesses = best_fitness_curve(path)
+        axes.plot(generations, fitnesses, label=str(path))
+    axes.set_xlabel("generation")
+    axes.set_ylabel("best fitness")
+    axes.legend()
+    if output is not None:
+        figure.savefig(output)
+    else:
+        plt.show()
+    plt.close(figure)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--plot", type=str, default=None)  # image path of the best fitness per generation
+    args = parser.parse_args()
+    for log in args.logs:
+        summary = summarize(log)
+        print(f"{log}: {summary['evaluations']} evaluations, {summary['eval_time']:.1f} s evaluating, "
+              f"best fitness {summary['best_fitness']}")
+        print("  " + ", ".join(f"{status}: {count}" for status, count in sorted(summary["cache"].items(), key=str)))
+    if args.plot is not None:
+        try:
+            plot_runs(args.logs, args.plot)
+        except ImportError as e:
+            sys.exit(str(e))
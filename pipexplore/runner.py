@@ -2,7 +2,13 @@ from pathlib import Path
 
 from pipexplore.interface import Experiment, IndependentExperiment
 import pipexplore.llvm as llvm
+from pipexplore.cache import FitnessCache
+from pipexplore.scheduler import TwoTierScheduler
 from pipexplore.xGA import Population
+from pipexplore.island import IslandModel
+from pipexplore.racing import Racer
+from pipexplore.cascade import Cascade
+from pipexplore.runlog import RunLog
 
 
 class Runner:
@@ -11,45 +17,134 @@ class Runner:
                  output_binary_path: Path,
                  population_size: int = 100,
                  generations: int = 100,
-                 log_path: Path = None):
+                 log_path: Path = None,
+                 fitness_cache: FitnessCache = None,
+                 scheduler: TwoTierScheduler = None,
+                 steady_state: bool = None,
+                 islands: int = 1,
+                 coordinator=None,
+                 racer: Racer = None,
+                 cascade: Cascade = None,
+                 surrogate=None,
+                 archive_size: int = None,
+                 selection=None,
+                 regroup_builds: bool = False):
         self.experiment = experiment
         self.output_binary_path = output_binary_path
         self.population_size = population_size
         self.generations = generations
         self.log_path = log_path
-    
+        self.fitness_cache = fitness_cache
+        self.scheduler = scheduler
+        # steady-state evolution evaluates the same generations * population_size individuals,
+        # but refills every worker slot as soon as it finishes, see Population.evolve_steady_state;
+        # the default with a scheduler, whose builds and measurements only overlap within a generation otherwise
+        self.steady_state = steady_state if steady_state is not None else scheduler is not None
+        # more than one island runs that many populations in separate processes, see IslandModel
+        self.islands = islands
+        if islands > 1 and (scheduler is not None or coordinator is not None):
+            # their threads and connections do not survive the fork of the islands
+            raise ValueError("a scheduler or a coordinator cannot be combined with islands > 1")
+        # optional pipexplore.distributed.Coordinator, profiling on remote workers
+        self.coordinator = coordinator
+        # optional racer, repeating noisy measurements adaptively, see pipexplore/racing.py
+        self.racer = racer
+        # optional cheap tiers in front of the builds, see pipexplore/cascade.py
+        self.cascade = cascade
+        # optional pipexplore.surrogate.Surrogate (needs numpy), ranking children before they are profiled
+        self.surrogate = surrogate
+        # number of distinct best pipelines kept across generations, see pipexplore/archive.py
+        self.archive_size = archive_size
+        # optional selection strategy of the generational GA, see pipexplore/selection.py
+        self.selection = selection
+        # build candidates with their verified regrouped pipeline, see IRFingerprintIndex
+        self.regroup_builds = regroup_builds
+        self.run_log = None
+
+    # print the progress and log the population after a generation
+    def log_generation(self, population: Population, generation: int):
+        # Print progress bar
+        progress = int(generation / self.generations * 50)  # 50 character progress bar
+        print(f"\rGeneration {generation}/{self.generations} [{'=' * progress}{' ' * (50-progress)}] {generation/self.generations*100:.1f}%", end='')
+        # Get the best individual and print its fitness
+        best_ind = population.get_best_individual()
+        best_fitness = best_ind.profile.fitness()
+        print(f" Best fitness: {best_fitness}", end='')
+
+        if self.run_log is not None:
+            self.run_log.write("generation", generation=generation, best_fitness=best_fitness,
+                               population=len(population.individuals))
+
+    # log the progress of an island
+    def log_island_generation(self, island: int, generation: int, best_fitness):
+        print(f"\rIsland {island} generation {generation}/{self.generations} best fitness: {best_fitness}", end='')
+        if self.run_log is not None:
+            self.run_log.write("island", island=island, generation=generation, best_fitness=best_fitness)
+
+    # log an individual evaluated by an island
+    def log_island_individual(self, island: int, record: dict):
+        if self.run_log is not None:
+            self.run_log.individual_event(record, island=island)
+
     def run(self):
+        model = None
+        if self.islands > 1:
+            model = IslandModel(self.experiment, self.islands, self.population_size, self.generations,
+                                fitness_cache=self.fitness_cache, log_individuals=self.log_path is not None,
+                                racer=self.racer, cascade=self.cascade, surrogate=self.surrogate,
+                                archive_size=self.archive_size, selection=self.selection,
+                                regroup_builds=self.regroup_builds)
+            # fork the islands before this process starts threads, the run log writer and the opt service workers
+            model.start()
+        # the structured log of the run, see pipexplore/runlog.py
+        self.run_log = RunLog(self.log_path) if self.log_path else None
+        try:
+            self.run_generations(model)
+        finally:
+            if model is not None:
+                # islands still running, e.g. after an error, are not waited for
+                model.stop(timeout=0)
+            if self.run_log is not None:
+                self.run_log.close()
+
+    # argument: the started islands, None unless islands > 1
+    def run_generations(self, model: IslandModel = None):
+        mode = "islands" if self.islands > 1 else "steady_state" if self.steady_state else "generational"
+        if self.run_log is not None:
+            self.run_log.write("start", population_size=self.population_size, generations=self.generations, mode=mode)
+
         # Calculate and compare fitness between O2 and GA optimized version
-        population = Population(self.population_size, self.experiment)
+        population = Population(self.population_size, self.experiment, self.fitness_cache, scheduler=self.scheduler,
+                                coordinator=self.coordinator, racer=self.racer,
+                                cascade=self.cascade, surrogate=self.surrogate, archive_size=self.archive_size,
+                                selection=self.selection, run_log=self.run_log, regroup_builds=self.regroup_builds)
         population.initialize()
 
         if population.get_best_individual_cnt() == 0:
-            with open(self.log_path, 'w') as f:
-                f.write("No valid pipelines found, exiting")
+            print("No valid pipelines found, exiting")
+            if self.run_log is not None:
+                self.run_log.write("end", best_fitness_before=None, best_fitness_after=None, pipeline=None)
             return
 
         best_ind_before = population.get_best_individual()
         best_fitness_before = best_ind_before.profile.fitness()
 
-        if self.log_path:
-            with open(self.log_path, 'w') as f:
-                f.write(f"Generation {0} fitness: {best_fitness_before}\n")
-
-        for _ in range(self.generations):
-            # Print progress bar
-            progress = int((_ + 1) / self.generations * 50)  # 50 character progress bar
-            print(f"\rGeneration {_ + 1}/{self.generations} [{'=' * progress}{' ' * (50-progress)}] {(_+1)/self.generations*100:.1f}%", end='')
-            # Get the best individual and print its fitness
-            best_ind = population.get_best_individual()
-            best_fitness = best_ind.profile.fitness()
-            print(f" Best fitness: {best_fitness}", end='')
-            population.evolve()
-
-            if self.log_path:
-                with open(self.log_path, 'a') as f:
-                    f.write(f"Generation {_ + 1} best fitness: {best_fitness}\n")
-                    for ind in population.individuals:
-                        f.write(f"\t(fitness: {ind.profile.fitness()}) passes: {ind.to_string()}\n")
+        if self.run_log is not None:
+            self.run_log.write("generation", generation=0, best_fitness=best_fitness_before,
+                               population=len(population.individuals))
+
+        if model is not None:
+            # the baseline stays a candidate, as in the other modes
+            population.individuals.extend(model.run(on_generation=self.log_island_generation,
+                                                    on_individual=self.log_island_individual))
+        elif self.steady_state:
+            population.evolve_steady_state(self.generations * self.population_size,
+                                           on_generation=lambda generation: self.log_generation(population, generation))
+        else:
+            for generation in range(1, self.generations + 1):
+                population.evolve()
+                self.log_generation(population, generation)
+        print()
 
         best_ind_after = population.get_best_individual()
         best_fitness_after = best_ind_after.profile.fitness()
@@ -59,6 +154,33 @@ class Runner:
         else:
             print(f"failed to find a better pipeline")
             ga_pipeline = best_ind_before.to_string()
+        if self.run_log is not None:
+            self.run_log.write("end", best_fitness_before=best_fitness_before, best_fitness_after=best_fitness_after,
+                               pipeline=self.run_log.pipeline(ga_pipeline))
+
+        print(population.archive)
+        if self.fitness_cache is not None:
+            print(self.fitness_cache)
+        if population.ir_index is not None:
+            print(population.ir_index)
+            if population.prefix_store is not None:
+                print(population.prefix_store)
+        if self.scheduler is not None:
+            print(self.scheduler)
+        if self.coordinator is not None:
+            print(self.coordinator)
+        if self.racer is not None:
+            print(self.racer)
+        if self.cascade is not None:
+            print(self.cascade)
+        if self.surrogate is not None:
+            print(self.surrogate)
+        print(llvm.object_cache_report(llvm.get_object_cache_dir()))
 
+        if population.ir_index is not None:
+            # the shipped compiler runs the pipeline in nested form if that gives the same IR on the experiment's
+            # target file; that is the only input it is verified on, so the inliner is never interleaved
+            # with the other passes (merge_cgscc=False), which changes the IR the most
+            ga_pipeline = llvm.regroup_verified(population.ir_index.input_ll_str, ga_pipeline, merge_cgscc=False)
         print(f"GA optimized pipeline is saved in {self.output_binary_path.as_posix()}")
         llvm.from_pipeline_make_a_compiler_to_path(ga_pipeline,  self.output_binary_path, "")
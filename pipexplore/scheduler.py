@@ -0,0 +1,83 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pipexplore.batch_map import worker_cores, measurement_cores, pin, pin_worker
+
+
+class TwoTierScheduler:
+    """
+    Evaluate candidates in two stages with separate queues.
+    The compile stage (compiler generation and build) runs on a wide pool pinned to the worker cores,
+    the measure stage (experiment.run()) on a narrow pool pinned to the measurement cores, see
+    batch_map.reserve_cores. A candidate is handed to the measure queue as soon as it is built,
+    so builds of later candidates overlap with measurements of earlier ones, and builds never
+    share cores with measurements.
+    map() waits for all its candidates, so the generational GA (Population.evolve) only overlaps builds and
+    measurements within a generation; Population.evolve_steady_state submits candidates one by one,
+    and keeps both stages busy across generations, which is why a Runner with a scheduler evolves steady-state
+    unless told otherwise.
+    """
+    def __init__(self, compile_workers: int = None, measure_workers: int = 1, measure_cores=None):
+        cores = worker_cores()
+        self.compile_workers = compile_workers or len(cores) or os.cpu_count()
+        self.measure_workers = measure_workers
+        self.measure_cores = measure_cores if measure_cores is not None else measurement_cores()
+        core_queue = queue.Queue()
+        for core in cores[:self.compile_workers]:
+            core_queue.put(core)
+        self.compile_pool = ThreadPoolExecutor(max_workers=self.compile_workers,
+                                               initializer=pin_worker, initargs=(core_queue,))
+        self.measure_pool = ThreadPoolExecutor(max_workers=self.measure_workers,
+                                               initializer=pin, initargs=(self.measure_cores,))
+        self.compiled = 0
+        self.measured = 0
+        self.lock = threading.Lock()
+
+    # submit a candidate
+    # argument: compile function returning (True, result) if finished or (False, value) to measure,
+    #           measure function taking that value and returning the result
+    # return: future of the result
+    def submit(self, compile_fn, measure_fn) -> Future:
+        result = Future()
+
+        def measure_job(value):
+            try:
+                result.set_result(measure_fn(value))
+            except BaseException as e:
+                result.set_exception(e)
+            with self.lock:
+                self.measured += 1
+
+        def compile_job():
+            try:
+                done, value = compile_fn()
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            with self.lock:
+                self.compiled += 1
+            if done:
+                result.set_result(value)
+            else:
+                self.measure_pool.submit(measure_job, value)
+
+        self.compile_pool.submit(compile_job)
+        return result
+
+    # evaluate candidates, streaming them through both stages
+    # argument: [(compile function, measure function), ...]
+    # return: [result, ...] in order
+    def map(self, jobs):
+        futures = [self.submit(compile_fn, measure_fn) for compile_fn, measure_fn in jobs]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self.compile_pool.shutdown(wait=True)
+        self.measure_pool.shutdown(wait=True)
+
+    def __str__(self):
+        with self.lock:
+            return (f"scheduler: {self.compiled} compiled on {self.compile_workers} workers, "
+                    f"{self.measured} measured on {self.measure_workers} workers (cores {sorted(self.measure_cores or [])})")
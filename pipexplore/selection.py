@@ -0,0 +1,102 @@
+import math
+import random
+
+try:
+    import numpy as np
+except ImportError:  # only VectorizedSelection needs numpy
+    np = None
+
+
+# the retention sizes of Population.evolve
+# argument: population size
+# return: (elites kept in total, elites kept among those satisfying the constraint, elites kept overall)
+def retention_sizes(size: int):
+    elite_size = max(1, int(size * 0.25))  # Keep 25% elite individuals
+    equ_size = max(1, int(size * 0.2))     # Keep 20% equivalent elite individuals
+    eli_size = max(1, int(size * 0.05))    # Keep 5% elite individuals
+    return elite_size, equ_size, eli_size
+
+
+class Selection:
+    """
+    The selection of Population.evolve, one individual at a time:
+      1. keep the 20% fittest individuals among those satisfying the constraint
+      2. keep the 5% fittest individuals overall
+      3. fill up to 25% with random individuals
+    and breed the rest of the population from pairs of parents chosen uniformly at random.
+    """
+    # argument: profiled individuals, population size
+    # return: (survivors, [(parent1, parent2), ...] to breed the rest of the population from, two children each)
+    def select(self, individuals, size: int):
+        elite_size, equ_size, eli_size = retention_sizes(size)
+        survivors = []
+
+        equivalence_individuals = [ind for ind in individuals if ind.profile.constraint()]
+        sorted_individuals = sorted(equivalence_individuals, key=lambda x: x.profile.fitness(), reverse=True)
+        survivors.extend(sorted_individuals[:equ_size])
+
+        sorted_individuals = sorted(individuals, key=lambda x: x.profile.fitness(), reverse=True)
+        survivors.extend(sorted_individuals[:eli_size])
+
+        while len(survivors) < elite_size:
+            survivors.append(random.choice(individuals))
+
+        pair_count = math.ceil(max(0, size - len(survivors)) / 2)
+        return survivors, [self.parent_pair(individuals) for _ in range(pair_count)]
+
+    # the parents of the next children, as in steady-state evolution
+    # return: (parent1, parent2)
+    def parent_pair(self, individuals):
+        return random.choice(individuals), random.choice(individuals)
+
+
+class VectorizedSelection(Selection):
+    """
+    The retention of Selection, with the same sizes, on NumPy columns of fitness, constraint and length, which are
+    read once per generation. It differs from Selection in two ways: among equal fitness the shorter pipeline
+    is kept (Selection keeps the earlier one), and parents are picked by tournaments of `tournament_size`
+    contenders, won by the best fitness and, among equals, the shortest pipeline; the default of 1 picks them
+    uniformly at random, as Selection does.
+    Meant for populations of thousands of individuals, e.g. with cheap fitness tiers. Requires numpy.
+    """
+    def __init__(self, tournament_size: int = 1):
+        if np is None:
+            raise ImportError("VectorizedSelection requires numpy")
+        self.tournament_size = max(1, tournament_size)
+
+    def select(self, individuals, size: int):
+        n = len(individuals)
+        if n == 0:
+            return [], []
+        fitness = np.fromiter((ind.profile.fitness() for ind in individuals), dtype=np.float64, count=n)
+        constraint = np.fromiter((ind.profile.constraint() for ind in individuals), dtype=bool, count=n)
+        length = np.fromiter((len(ind) for ind in individuals), dtype=np.int64, count=n)
+        # the numpy generator follows the random module, so seeding random still reproduces a run
+        rng = np.random.default_rng(random.getrandbits(64))
+
+        # best first: fitness decreasing, length increasing
+        ranking = np.lexsort((length, -fitness))
+        rank = np.empty(n, dtype=np.int64)
+        rank[ranking] = np.arange(n)
+
+        elite_size, equ_size, eli_size = retention_sizes(size)
+        chosen = [ranking[constraint[ranking]][:equ_size], ranking[:eli_size]]
+        kept = len(chosen[0]) + len(chosen[1])
+        if kept < elite_size:
+            chosen.append(rng.integers(0, n, elite_size - kept))
+        chosen = np.concatenate(chosen)
+
+        pair_count = math.ceil(max(0, size - len(chosen)) / 2)
+        contenders = rng.integers(0, n, size=(2 * pair_count, self.tournament_size))
+        winners = contenders[np.arange(2 * pair_count), np.argmin(rank[contenders], axis=1)]
+
+        survivors = [individuals[i] for i in chosen.tolist()]
+        parents = winners.reshape(-1, 2).tolist()
+        return survivors, [(individuals[i], individuals[j]) for i, j in parents]
+
+    def parent_pair(self, individuals):
+        return self.tournament(individuals), self.tournament(individuals)
+
+    def tournament(self, individuals):
+        contenders = [random.choice(individuals) for _ in range(self.tournament_size)]
+        return max(contenders, key=lambda x: (x.profile.fitness(), - len(x)))
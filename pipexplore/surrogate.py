@@ -0,0 +1,121 @@
+# requires numpy, imported only by users of the surrogate
+import math
+import zlib
+import threading
+
+import numpy as np
+
+import pipexplore.llvm as llvm
+
+# IR statistics used as features besides the instruction count: substrings counted in the stripped optimized IR
+ir_statistics = ["define ", " call ", " load ", "store ", "br ", " phi "]
+
+
+class Surrogate:
+    """
+    Online ridge regression from pipeline features to the measured fitness, used to rank bred children
+    so that only the most promising fraction of them is built and run.
+    Features: hashed pass presence, hashed pass bigrams, the pipeline length and, with the experiment's IR
+    (see Experiment.pre_optimization_ir), log-scaled statistics of the optimized IR.
+    The normal equations are accumulated as individuals are observed, so fitting costs O(dimensions^3)
+    however long the history is. Until min_samples individuals were observed, every child is kept.
+    """
+    def __init__(self, keep_fraction: float = 0.5, dimensions: int = 256, ridge: float = 1.0,
+                 min_samples: int = 20, use_ir: bool = True):
+        if not 0 < keep_fraction <= 1:
+            raise ValueError(f"keep_fraction must be in (0, 1], got {keep_fraction}")
+        self.keep_fraction = keep_fraction
+        self.dimensions = dimensions
+        self.ridge = ridge
+        self.min_samples = min_samples
+        self.use_ir = use_ir
+        # presence, bigrams, length, instruction count, IR statistics, bias
+        self.size = 2 * dimensions + 2 + len(ir_statistics) + 1
+        self.gram = np.zeros((self.size, self.size))
+        self.moment = np.zeros(self.size)
+        self.weights = None
+        self.samples = 0
+        self.fitted_samples = 0
+        self.observed = set()  # passes strings already learned from
+        self.screened = 0
+        self.kept = 0
+        self.lock = threading.Lock()
+
+    def bucket(self, text: str) -> int:
+        # crc32 is stable between processes, unlike hash()
+        return zlib.crc32(text.encode("utf-8")) % self.dimensions
+
+    # argument: individual, index of the experiment's IR (None if unavailable)
+    # return: feature vector
+    def features(self, individual, ir_index=None):
+        x = np.zeros(self.size)
+        passes = individual.passes
+        for atom in passes:
+            x[self.bucket(atom)] = 1.0
+        for first, second in zip(passes, passes[1:]):
+            x[self.dimensions + self.bucket(first + "," + second)] = 1.0
+        x[2 * self.dimensions] = math.log1p(len(passes))
+        if self.use_ir and ir_index is not None:
+            stripped = ir_index.optimized_ir(individual.to_string())
+            if stripped is not None:
+                offset = 2 * self.dimensions + 1
+                x[offset] = math.log1p(llvm.instruction_count(stripped))
+                for i, statistic in enumerate(ir_statistics, 1):
+                    x[offset + i] = math.log1p(stripped.count(statistic))
+        x[-1] = 1.0
+        return x
+
+    # learn from profiled individuals, each pipeline once
+    # argument: individuals with a profile, index of the experiment's IR
+    def observe(self, individuals, ir_index=None) -> None:
+        for individual in individuals:
+            passes_str = individual.to_string()
+            with self.lock:
+                if individual.profile is None or passes_str in self.observed:
+                    continue
+                self.observed.add(passes_str)
+            x = self.features(individual, ir_index)
+            y = individual.profile.fitness()
+            with self.lock:
+                self.gram += np.outer(x, x)
+                self.moment += x * y
+                self.samples += 1
+
+    # solve the normal equations if individuals were observed since the last fit
+    # return: True if the model can predict
+    def fit(self) -> bool:
+        with self.lock:
+            if self.samples < self.min_samples:
+                return False
+            if self.fitted_samples != self.samples:
+                regularization = self.ridge * np.eye(self.size)
+                regularization[-1, -1] = 0.0  # the bias is not shrunk
+                self.weights = np.linalg.solve(self.gram + regularization, self.moment)
+                self.fitted_samples = self.samples
+            return True
+
+    # argument: individuals, index of the experiment's IR
+    # return: predicted fitness of each individual
+    def predict(self, individuals, ir_index=None):
+        features = np.array([self.features(individual, ir_index) for individual in individuals])
+        return features @ self.weights
+
+    # keep the children with the best predicted fitness
+    # argument: children, how many to keep (default: keep_fraction of them), index of the experiment's IR
+    # return: the kept children, all of them (up to count) while the model is untrained
+    def select(self, children, count: int = None, ir_index=None):
+        if not children or not self.fit():
+            return children if count is None else children[:count]
+        if count is None:
+            count = max(1, math.ceil(len(children) * self.keep_fraction))
+        predictions = self.predict(children, ir_index)
+        order = np.argsort(-predictions, kind="stable")
+        with self.lock:
+            self.screened += len(children)
+            self.kept += min(count, len(children))
+        return [children[i] for i in order[:count]]
+
+    def __str__(self):
+        with self.lock:
+            return (f"surrogate: trained on {self.samples} pipelines, "
+                    f"{self.kept} of {self.screened} screened children kept")
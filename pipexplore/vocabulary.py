@@ -0,0 +1,51 @@
+import threading
+from array import array
+from typing import List
+
+# type code of pass id arrays: unsigned 16-bit, enough for every atom a run can meet
+id_typecode = "H"
+max_ids = 1 << 16
+
+
+class PassVocabulary:
+    """
+    Interning table between pass atoms (e.g. function<eager-inv>(loop-mssa(licm<...>))) and small integer ids,
+    so that pipelines are stored, copied, sliced and compared as arrays of ids instead of lists of long strings.
+    Ids are only meaningful within a process (and the processes it forks): pipelines cross process boundaries
+    as strings, see Individual.__getstate__.
+    """
+    def __init__(self):
+        self.names: List[str] = []
+        self.ids = {}  # atom -> id
+        self.lock = threading.Lock()
+
+    def intern(self, atom: str) -> int:
+        pass_id = self.ids.get(atom)
+        if pass_id is None:
+            with self.lock:
+                pass_id = self.ids.get(atom)
+                if pass_id is None:
+                    if len(self.names) >= max_ids:
+                        raise OverflowError(f"more than {max_ids} distinct passes")
+                    pass_id = len(self.names)
+                    self.names.append(atom)
+                    self.ids[atom] = pass_id
+        return pass_id
+
+    # argument: atoms
+    # return: array of ids
+    def encode(self, atoms) -> array:
+        return array(id_typecode, [self.intern(atom) for atom in atoms])
+
+    # argument: ids
+    # return: atoms
+    def decode(self, ids) -> List[str]:
+        names = self.names
+        return [names[pass_id] for pass_id in ids]
+
+    def __len__(self):
+        return len(self.names)
+
+
+# the vocabulary of this process
+vocabulary = PassVocabulary()
@@ -1,124 +1,300 @@
 import os
+import time
 import random
 import copy
+import queue
+import functools
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import List, Tuple
 
 import pipexplore.llvm as llvm
 import pipexplore.interface as interface
-from pipexplore.batch_map import batch_map
+from pipexplore.batch_map import batch_map, worker_cores, pin_worker
+from pipexplore.cache import FitnessCache, IRFingerprintIndex, fingerprint_ir
+from pipexplore.prefix_store import PrefixIRStore
+from pipexplore.racing import Racer
+from pipexplore.cascade import Cascade
+from pipexplore.archive import EliteArchive
+from pipexplore.selection import Selection
+from pipexplore.scheduler import TwoTierScheduler
+from pipexplore.vocabulary import vocabulary
 
 raw_available_passes = llvm.get_pipeline_str("O3")
 raw_tree = llvm.parse_string_as_tree(raw_available_passes)
 atom_tree = llvm.atomize_tree(raw_tree)
 available_passes = atom_tree
+available_ids = vocabulary.encode(available_passes)
 max_batch_size = os.cpu_count()
+# the mutations of Individual, see Population.mutation_weights
+mutation_names = ["replace", "delete", "insert", "swap", "duplicate", "reverse", "insert_all", "remove_unused"]
 
 class Individual:
+    """
+    A pipeline, stored as an array of interned pass ids (see pipexplore/vocabulary.py), and its profile.
+    The passes property converts from and to the list of atoms. The string form and the hash are cached
+    until the pipeline changes; individuals compare equal if their pipelines are equal.
+    """
+    __slots__ = ("ids", "profile", "fingerprint", "string", "hash_value", "eval_time", "cache_status")
+
     def __init__(self, passes: List[str]):
         self.passes = passes
         self.profile = None
+        self.fingerprint = None
+        # seconds spent compiling and running, and how the profile was obtained, see pipexplore/runlog.py
+        self.eval_time = None
+        self.cache_status = None
+
+    # argument: array of pass ids, not copied
+    @classmethod
+    def from_ids(cls, ids: array) -> 'Individual':
+        individual = cls.__new__(cls)
+        individual.ids = ids
+        individual.string = None
+        individual.hash_value = None
+        individual.profile = None
+        individual.fingerprint = None
+        individual.eval_time = None
+        individual.cache_status = None
+        return individual
+
+    @property
+    def passes(self) -> List[str]:
+        return vocabulary.decode(self.ids)
+
+    @passes.setter
+    def passes(self, passes: List[str]) -> None:
+        self.ids = vocabulary.encode(passes)
+        self.changed()
+
+    # forget the cached string and hash, after the ids were modified in place
+    def changed(self) -> None:
+        self.string = None
+        self.hash_value = None
 
     def __len__(self):
-        return len(self.passes)
+        return len(self.ids)
+
+    def __eq__(self, other):
+        if not isinstance(other, Individual):
+            return NotImplemented
+        return self.ids == other.ids
+
+    def __hash__(self):
+        if self.hash_value is None:
+            self.hash_value = hash(self.ids.tobytes())
+        return self.hash_value
+
+    # ids are local to the process, so individuals pickle (and deepcopy) with their atoms
+    def __getstate__(self):
+        return self.passes, self.profile, self.fingerprint
+
+    def __setstate__(self, state):
+        self.passes, self.profile, self.fingerprint = state
+        self.eval_time = None
+        self.cache_status = None
 
     def to_string(self):
-        return ",".join(self.passes)
+        if self.string is None:
+            self.string = ",".join(vocabulary.decode(self.ids))
+        return self.string
 
     def mutate_replace(self) -> None:
-        if len(self.passes) > 0:
-            pos = random.randint(0, len(self.passes) - 1)
-            self.passes[pos] = random.choice(available_passes)
+        if len(self.ids) > 0:
+            pos = random.randint(0, len(self.ids) - 1)
+            self.ids[pos] = random.choice(available_ids)
+            self.changed()
 
     def mutate_delete(self) -> None:
-        if len(self.passes) > 1:
-            pos = random.randint(0, len(self.passes) - 1)
-            self.passes.pop(pos)
+        if len(self.ids) > 1:
+            pos = random.randint(0, len(self.ids) - 1)
+            self.ids.pop(pos)
+            self.changed()
 
     def mutate_insert(self) -> None:
-        pos = random.randint(0, len(self.passes))
-        self.passes.insert(pos, random.choice(available_passes))
+        pos = random.randint(0, len(self.ids))
+        self.ids.insert(pos, random.choice(available_ids))
+        self.changed()
 
     def mutate_insert_all(self) -> None:
-        pos = random.randint(0, len(self.passes))
-        self.passes = self.passes[:pos] + available_passes + self.passes[pos:]
-    
+        pos = random.randint(0, len(self.ids))
+        self.ids[pos:pos] = available_ids
+        self.changed()
+
     def mutate_swap(self) -> None:
-        if len(self.passes) >= 2:
-            pos1, pos2 = random.sample(range(len(self.passes)), 2)
-            self.passes[pos1], self.passes[pos2] = self.passes[pos2], self.passes[pos1]
+        if len(self.ids) >= 2:
+            pos1, pos2 = random.sample(range(len(self.ids)), 2)
+            self.ids[pos1], self.ids[pos2] = self.ids[pos2], self.ids[pos1]
+            self.changed()
 
     def mutate_duplicate(self) -> None:
-        if len(self.passes) >= 2:
-            start = random.randint(0, len(self.passes) - 1)
-            end = random.randint(start + 1, len(self.passes))
-            segment = self.passes[start:end]
-            insert_pos = random.randint(0, len(self.passes))
-            self.passes[insert_pos:insert_pos] = segment
+        if len(self.ids) >= 2:
+            start = random.randint(0, len(self.ids) - 1)
+            end = random.randint(start + 1, len(self.ids))
+            segment = self.ids[start:end]
+            insert_pos = random.randint(0, len(self.ids))
+            self.ids[insert_pos:insert_pos] = segment
+            self.changed()
 
     def mutate_reverse(self) -> None:
-        if len(self.passes) >= 2:
-            start = random.randint(0, len(self.passes) - 2)
-            end = random.randint(start + 1, len(self.passes))
-            self.passes[start:end] = reversed(self.passes[start:end])
+        if len(self.ids) >= 2:
+            start = random.randint(0, len(self.ids) - 2)
+            end = random.randint(start + 1, len(self.ids))
+            segment = self.ids[start:end]
+            segment.reverse()
+            self.ids[start:end] = segment
+            self.changed()
 
     @staticmethod
     def crossover(parent1: 'Individual', parent2: 'Individual') -> Tuple['Individual', 'Individual']:
-        if len(parent1.passes) < 2 or len(parent2.passes) < 2:
-            return parent1, parent2
+        if len(parent1.ids) < 2 or len(parent2.ids) < 2:
+            # copies: the children are mutated in place, the parents may be archived or survive
+            return Individual.from_ids(parent1.ids[:]), Individual.from_ids(parent2.ids[:])
 
-        point1 = random.randint(0, min(len(parent1.passes), len(parent2.passes)) - 1)
-        point2 = random.randint(point1 + 1, min(len(parent1.passes), len(parent2.passes)))
+        point1 = random.randint(0, min(len(parent1.ids), len(parent2.ids)) - 1)
+        point2 = random.randint(point1 + 1, min(len(parent1.ids), len(parent2.ids)))
 
-        child1_passes = (
-            parent1.passes[:point1] +
-            parent2.passes[point1:point2] +
-            parent1.passes[point2:]
+        child1_ids = (
+            parent1.ids[:point1] +
+            parent2.ids[point1:point2] +
+            parent1.ids[point2:]
         )
-        child2_passes = (
-            parent2.passes[:point1] +
-            parent1.passes[point1:point2] +
-            parent2.passes[point2:]
+        child2_ids = (
+            parent2.ids[:point1] +
+            parent1.ids[point1:point2] +
+            parent2.ids[point2:]
         )
 
-        return Individual(child1_passes), Individual(child2_passes)
+        return Individual.from_ids(child1_ids), Individual.from_ids(child2_ids)
 
     def mutate_remove_unused(self, experiment: interface.Experiment):
-        after_remove_file = os.path.join(llvm.tmp, llvm.generate_random_str() + ".ll")
+        if isinstance(experiment, interface.ObjectInjectionExperiment):
+            # the frontend IR is at hand, no need to build anything
+            after_remove_pipeline = llvm.pipeline_minimize(experiment.pre_optimization_ir(), self.to_string())
+            if after_remove_pipeline != self.to_string() and after_remove_pipeline != "":
+                self.passes = after_remove_pipeline.split(",")
+            return
+
+        after_remove_file = llvm.workspace_path(".ll")
         # 1. create a compiler
         compiler_full_path = llvm.from_pipeline_make_a_compiler(self.to_string(), after_remove_file)
-        # 2. copy experiment and compile
-        experiment_copy = copy.deepcopy(experiment)
         try:
-            experiment_copy.compile(compiler_full_path)
-        except interface.CannotCompileError:
-            return False
-
-        # 3. remove the compiler
-        os.remove(compiler_full_path)
-        # . get our pipeline after removed
-        with open(after_remove_file, "r") as f:
-            after_remove_pipeline = f.read()
+            # 2. copy experiment and compile
+            experiment_copy = copy.deepcopy(experiment)
+            try:
+                experiment_copy.compile(compiler_full_path)
+            except interface.CannotCompileError:
+                return False
+
+            # . get our pipeline after removed
+            with open(after_remove_file, "r") as f:
+                after_remove_pipeline = f.read()
+        finally:
+            # 3. remove the compiler and its output
+            for path in [compiler_full_path, after_remove_file]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
         if after_remove_pipeline == self.to_string() or after_remove_pipeline == "":
             return
         self.passes = after_remove_pipeline.split(",")
         return
 
-    def run_profile(self, experiment: interface.Experiment):
-        # 1. create a compiler
-        compiler_full_path = llvm.from_pipeline_make_a_compiler(self.to_string())
-        # 2. copy experiment and compile
-        experiment_copy = copy.deepcopy(experiment)
-        try:
-            experiment_copy.compile(compiler_full_path)
-        except interface.CannotCompileError:
-            return False
+    def run_profile(self, experiment: interface.Experiment, ir_index: IRFingerprintIndex = None):
+        done, value = self.profile_compile(experiment, ir_index)
+        if done:
+            return value
+        return self.profile_measure(value, ir_index)
+
+    # compile stage of run_profile
+    # return: (True, success) if finished, (False, compiled experiment) if it still has to run
+    def profile_compile(self, experiment: interface.Experiment, ir_index: IRFingerprintIndex = None):
+        # 0. reuse the profile of an identical optimized IR, if any (the cascade may have fingerprinted it already)
+        stripped = None
+        if self.fingerprint is None and ir_index is not None:
+            stripped = ir_index.optimized_ir(self.to_string())
+            self.fingerprint = fingerprint_ir(stripped) if stripped is not None else None
+        if self.fingerprint is not None:
+            found, profile = ir_index.claim(self.fingerprint)
+            if found:
+                self.profile = profile
+                self.cache_status = "ir_index"
+                return True, profile is not None
 
-        # 3. remove the compiler
-        os.remove(compiler_full_path)
+        try:
+            experiment_copy = self.compile(experiment, ir_index, stripped)
+        except BaseException:
+            self.release_fingerprint(ir_index, None)
+            raise
+        if experiment_copy is None:
+            self.release_fingerprint(ir_index, False)
+            self.cache_status = "failed"
+            return True, False
+        return False, experiment_copy
+
+    # run stage of run_profile
+    # return: True if the individual has a valid profile
+    def profile_measure(self, experiment_copy: interface.Experiment, ir_index: IRFingerprintIndex = None,
+                        racer: Racer = None, cutoff: float = None):
+        success = None
+        try:
+            success = self.measure(experiment_copy, racer, cutoff)
+        finally:
+            self.release_fingerprint(ir_index, success)
+        self.cache_status = "measured" if success else "failed"
+        return success
+
+    # record the result for the fingerprint claimed by profile_compile
+    # argument: index, success (None after an unexpected error)
+    def release_fingerprint(self, ir_index: IRFingerprintIndex, success):
+        if self.fingerprint is not None:
+            if success is None:
+                # an unexpected error is not a property of the IR, so it is not recorded
+                ir_index.abandon(self.fingerprint)
+            else:
+                ir_index.release(self.fingerprint, self.profile if success else None)
+            self.fingerprint = None
+
+    # argument: experiment, index of its IR, used to run the pipeline regrouped when that gives the same IR
+    #           and the index has regroup_builds, stripped optimized IR of the pipeline if already known
+    # return: the compiled copy of the experiment, None if compilation failed
+    def compile(self, experiment: interface.Experiment, ir_index: IRFingerprintIndex = None, stripped: str = None):
+        passes_str = self.to_string()
+        if ir_index is not None and ir_index.regroup_builds:
+            passes_str = ir_index.regrouped(passes_str, stripped)
+        if isinstance(experiment, interface.ObjectInjectionExperiment):
+            # no compiler script, the experiment runs opt, codegen and link itself
+            experiment_copy = copy.deepcopy(experiment)
+            try:
+                experiment_copy.compile_pipeline(passes_str)
+            except interface.CannotCompileError:
+                return None
+            return experiment_copy
 
+        # 1. create a compiler
+        compiler_full_path = llvm.from_pipeline_make_a_compiler(passes_str)
+        try:
+            # 2. copy experiment and compile
+            experiment_copy = copy.deepcopy(experiment)
+            try:
+                experiment_copy.compile(compiler_full_path)
+            except interface.CannotCompileError:
+                return None
+        finally:
+            # 3. remove the compiler
+            os.remove(compiler_full_path)
+        return experiment_copy
+
+    # argument: compiled experiment, optional racer repeating the run adaptively, elite cutoff for the racer
+    # return: True if the run succeeded
+    def measure(self, experiment_copy: interface.Experiment, racer: Racer = None, cutoff: float = None):
         # 4. run
         try:
-            self.profile = experiment_copy.run()
+            if racer is not None:
+                self.profile = racer.run(experiment_copy, cutoff)
+            else:
+                self.profile = experiment_copy.run()
         except interface.MiscompilationError:
             return False
         return True
@@ -126,101 +302,340 @@ class Individual:
 class Population:
     # define the population
     # size: the size of the population
-    def __init__(self, size: int, experiment: interface.Experiment):
+    # fitness_cache: optional on-disk cache of profiles, shared between generations and runs
+    # prefix_store: optional IR snapshots of evaluated pipeline prefixes, used to fingerprint the optimized IR,
+    #               by default every fingerprint runs the whole pipeline at once
+    # scheduler: optional two-tier scheduler separating builds from measurements, for independent experiments
+    # mutation_weights: optional {mutation name: relative weight}, see mutation_names, missing ones weigh 1
+    # coordinator: optional pipexplore.distributed.Coordinator, profiling every individual on remote workers
+    # racer: optional racer, repeating measurements adaptively against the elite cutoff
+    # cascade: optional cheap tiers rejecting candidates before they are built
+    # surrogate: optional pipexplore.surrogate.Surrogate, only the children it ranks best are profiled
+    # archive_size: number of distinct best pipelines kept across generations, at least size (the default)
+    # pareto: also keep the Pareto front in (fitness, length), see EliteArchive.front
+    # selection: survivors and parents of evolve, see pipexplore/selection.py (VectorizedSelection for large sizes)
+    # run_log: optional pipexplore.runlog.RunLog, recording every evaluated individual
+    # regroup_builds: build candidates with their verified regrouped pipeline, see IRFingerprintIndex
+    def __init__(self, size: int, experiment: interface.Experiment, fitness_cache: FitnessCache = None,
+                 prefix_store: PrefixIRStore = None, scheduler: TwoTierScheduler = None,
+                 mutation_weights: dict = None, coordinator=None, racer: Racer = None,
+                 cascade: Cascade = None, surrogate=None, archive_size: int = None, pareto: bool = False,
+                 selection: Selection = None, run_log=None, regroup_builds: bool = False):
         self.individuals: List[Individual] = []
         self.size = size
         self.generation = 0
         self.experiment = experiment
-        self.history_individuals: List[Individual] = []
-    
+        self.fitness_cache = fitness_cache
+        self.scheduler = scheduler
+        self.mutation_weights = mutation_weights
+        self.coordinator = coordinator
+        self.racer = racer
+        self.cascade = cascade
+        self.surrogate = surrogate
+        self.selection = selection if selection is not None else Selection()
+        self.run_log = run_log
+        self.archive = EliteArchive(max(size, archive_size or size), pareto)
+        # pipelines with identical optimized IR share one measurement, if the experiment gives its IR
+        pre_optimization_ir = experiment.pre_optimization_ir()
+        self.ir_index = None
+        self.prefix_store = prefix_store
+        if pre_optimization_ir:
+            self.ir_index = IRFingerprintIndex(pre_optimization_ir, experiment, fitness_cache, self.prefix_store,
+                                               regroup_builds)
+
+    # the archived individuals, best first
+    @property
+    def history_individuals(self) -> List[Individual]:
+        return self.archive.top()
+
+    # compile stage of evaluate_individual, reusing the cached profile of the same pipeline if any
+    # return: (True, success) if finished, (False, compiled experiment) if it still has to run
+    def evaluate_compile(self, individual: Individual):
+        start = time.perf_counter()
+        individual.eval_time = None
+        key = None
+        if self.fitness_cache is not None:
+            key = self.fitness_cache.key(individual.to_string(), self.experiment)
+            found, profile = self.fitness_cache.get(key)
+            if found:
+                individual.profile = profile
+                individual.cache_status = "fitness_cache"
+                return True, self.record(individual, start, profile is not None)
+        if self.cascade is not None and not self.cascade.screen(individual, self.ir_index):
+            # rejected by a cheap tier, not cached since the verdict depends on the elites
+            individual.profile = None
+            individual.cache_status = "cascade"
+            return True, self.record(individual, start, False)
+        done, value = individual.profile_compile(self.experiment, self.ir_index)
+        if done and key is not None:
+            # a pipeline opt rejects fails in every run, other build failures may not
+            rejected = not value and not llvm.pipeline_accepted(individual.to_string())
+            self.fitness_cache.put(key, individual.profile if value else None, rejected)
+        if done:
+            return True, self.record(individual, start, value)
+        individual.eval_time = time.perf_counter() - start
+        return done, value
+
+    # finish the evaluation of an individual: add the time since start, and log it
+    # argument: individual, perf_counter() when the stage started, success
+    # return: success
+    def record(self, individual: Individual, start: float, success: bool) -> bool:
+        individual.eval_time = (individual.eval_time or 0.0) + time.perf_counter() - start
+        if self.run_log is not None:
+            self.run_log.individual(self.generation, individual, success)
+        return success
+
+    # the fitness a new individual must beat to be among the elites of evolve (the top 25% of the population)
+    # return: fitness, None while fewer individuals were profiled
+    def elite_cutoff(self):
+        elite_size = max(1, int(self.size * 0.25))
+        return self.archive.nth_fitness(elite_size)
+
+    # run stage of evaluate_individual
+    # return: True if the individual has a valid profile
+    def evaluate_measure(self, individual: Individual, experiment_copy: interface.Experiment) -> bool:
+        start = time.perf_counter()
+        cutoff = self.elite_cutoff() if self.racer is not None else None
+        success = individual.profile_measure(experiment_copy, self.ir_index, self.racer, cutoff)
+        if success and self.cascade is not None:
+            self.cascade.record(individual)
+        if self.fitness_cache is not None:
+            self.fitness_cache.put(self.fitness_cache.key(individual.to_string(), self.experiment),
+                                   individual.profile if success else None)
+        return self.record(individual, start, success)
+
+    # profile a single individual
+    # return: True if the individual has a valid profile
+    def evaluate_individual(self, individual: Individual) -> bool:
+        done, value = self.evaluate_compile(individual)
+        if done:
+            return value
+        return self.evaluate_measure(individual, value)
+
+    # start profiling an individual on the remote workers of the coordinator, reusing cached profiles
+    # the workers build and run their own copies of the experiment, so it need not be independent
+    # return: future of True if the individual has a valid profile
+    def submit_remote(self, individual: Individual) -> Future:
+        start = time.perf_counter()
+        individual.eval_time = None
+        future = Future()
+        key = None
+        if self.fitness_cache is not None:
+            key = self.fitness_cache.key(individual.to_string(), self.experiment)
+            found, profile = self.fitness_cache.get(key)
+            if found:
+                individual.profile = profile
+                individual.cache_status = "fitness_cache"
+                future.set_result(self.record(individual, start, profile is not None))
+                return future
+        if self.cascade is not None and not self.cascade.screen(individual, self.ir_index):
+            individual.profile = None
+            individual.cache_status = "cascade"
+            future.set_result(self.record(individual, start, False))
+            return future
+
+        def finish(remote: Future):
+            try:
+                future.set_result(self.finish_remote(individual, key, *remote.result()))
+            except BaseException as e:
+                future.set_exception(e)
+        self.coordinator.submit(individual.to_string()).add_done_callback(finish)
+        return future
+
+    # record the result of a remote job
+    # argument: individual, its fitness cache key (None without a cache), success (None if the job was lost), profile
+    # return: True if the individual has a valid profile
+    def finish_remote(self, individual: Individual, key, success, profile) -> bool:
+        individual.profile = profile
+        # a lost job says nothing about the pipeline, it is not cached
+        if key is not None and success is not None:
+            self.fitness_cache.put(key, profile if success else None)
+        # the time on the worker is not known here
+        individual.eval_time = None
+        individual.cache_status = "lost" if success is None else "remote" if success else "failed"
+        if self.run_log is not None:
+            self.run_log.individual(self.generation, individual, bool(success))
+        return bool(success)
+
+    # profile the individuals on the remote workers of the coordinator, see submit_remote
+    def profile_remote(self):
+        futures = [self.submit_remote(ind) for ind in self.individuals]
+        self.individuals = [ind for ind, future in zip(self.individuals, futures) if future.result()]
+
     def profile_individual(self):
         # 0. profile
+        if self.coordinator is not None:
+            self.profile_remote()
         # Check if experiment is an instance of IndependentExperiment
-        if isinstance(self.experiment, interface.IndependentExperiment):
+        elif isinstance(self.experiment, interface.IndependentExperiment) and self.scheduler is not None:
+            # builds and measurements on separate pools, handing each individual over once built
+            jobs = [(functools.partial(self.evaluate_compile, ind), functools.partial(self.evaluate_measure, ind))
+                    for ind in self.individuals]
+            results = self.scheduler.map(jobs)
+            self.individuals = [ind for ind, success in zip(self.individuals, results) if success]
+        elif isinstance(self.experiment, interface.IndependentExperiment):
             # Use batch_map for parallel processing if it's an IndependentExperiment
 
-            profile_individual = lambda individual: (individual, individual.run_profile(self.experiment))
+            profile_individual = lambda individual: (individual, self.evaluate_individual(individual))
 
             results = batch_map(self.individuals, max_batch_size, profile_individual)
             # Filter out individuals that failed profiling
             self.individuals = [ind for ind, success in results if success]
         else:
             # Sequential processing for regular Experiment
-            self.individuals = [ind for ind in self.individuals if ind.run_profile(self.experiment)]
+            self.individuals = [ind for ind in self.individuals if self.evaluate_individual(ind)]
 
     def initialize(self) -> None:
         self.individuals = []
         self.individuals.append(Individual(available_passes))
         self.profile_individual()
-        self.history_individuals.extend(self.individuals)
+        if self.surrogate is not None:
+            self.surrogate.observe(self.individuals, self.ir_index)
+        self.archive.extend(self.individuals)
+
+    # breed two children by crossover and mutation
+    # argument: mutation rate, (parent1, parent2) (default: chosen by the selection strategy)
+    # return: [child1, child2], not profiled yet
+    def breed(self, mutation_rate: float = 0.2, parents: Tuple[Individual, Individual] = None) -> List[Individual]:
+        parent1, parent2 = parents if parents is not None else self.selection.parent_pair(self.individuals)
+
+        child1, child2 = Individual.crossover(parent1, parent2)
+
+        for child in [child1, child2]:
+            if random.random() < mutation_rate:
+                if self.mutation_weights:
+                    weights = [self.mutation_weights.get(name, 1) for name in mutation_names]
+                    name = random.choices(mutation_names, weights=weights)[0]
+                else:
+                    name = random.choice(mutation_names)
+                if name == "remove_unused":
+                    child.mutate_remove_unused(self.experiment)
+                else:
+                    getattr(child, "mutate_" + name)()
+
+        return [child1, child2]
 
     def evolve(self, mutation_rate: float = 0.2) -> None:
-        new_population = []
-  
-        # Retention strategy:
+        # Retention strategy (see Selection):
         # 1. Individuals with fitness less than O2 will be removed
         # 2. Keep 20% of elite individuals from equivalent code
         # 3. Keep 5% of elite individuals overall
         # 4. Randomly retain up to 25%
-        elite_size = max(1, int(self.size * 0.25))  # Keep 25% elite individuals
-        equ_size = max(1, int(self.size * 0.2))   # Keep 20% equivalent elite individuals
-        eli_size = max(1, int(self.size * 0.05))  # Keep 5% elite individuals
-
-        equivalence_individuals = [ind for ind in self.individuals if ind.profile.constraint()]
-
-        sorted_individuals = sorted(equivalence_individuals,
-                                     key=lambda x: x.profile.fitness(),
-                                     reverse=True)
-
-        new_population.extend(sorted_individuals[:equ_size])
-
-        sorted_individuals = sorted(self.individuals,
-                                     key=lambda x: x.profile.fitness(),
-                                     reverse=True)
-
-        new_population.extend(sorted_individuals[:eli_size])
-
-        while len(new_population) < elite_size:
-            new_population.append(random.choice(self.individuals))
-
-        while len(new_population) < self.size:
-            parent1 = random.choice(self.individuals)
-            parent2 = random.choice(self.individuals)
-
-            child1, child2 = Individual.crossover(parent1, parent2)
-
-            for child in [child1, child2]:
-                if random.random() < mutation_rate:
-                    mutation = random.choice([
-                        lambda: child.mutate_replace(),
-                        lambda: child.mutate_delete(),
-                        lambda: child.mutate_insert(),
-                        lambda: child.mutate_swap(),
-                        lambda: child.mutate_duplicate(),
-                        lambda: child.mutate_reverse(),
-                        lambda: child.mutate_insert_all(),
-                        lambda: child.mutate_remove_unused(self.experiment)
-                    ])
-                    mutation()
-
-            new_population.extend([child1, child2])
-
-            if len(new_population) > self.size:
-                new_population = new_population[:self.size]
+        new_population, parent_pairs = self.selection.select(self.individuals, self.size)
+
+        children = []
+        for parents in parent_pairs:
+            children.extend(self.breed(mutation_rate, parents))
+        children = children[:self.size - len(new_population)]
+        if self.ir_index is not None and (self.coordinator is None or self.cascade is not None or self.surrogate is not None):
+            # the surrogate, the cascade and the fingerprints of the children all start from their optimized IR
+            self.ir_index.prefetch([child.to_string() for child in children])
+        if self.surrogate is not None:
+            # only the most promising children are built and run
+            children = self.surrogate.select(children, ir_index=self.ir_index)
+        new_population.extend(children)
 
         self.individuals = new_population
         self.generation += 1
         self.profile_individual()
-        # merge the old individuals and the new individuals, and sort the max_population_size individuals
-        self.history_individuals.extend(self.individuals)
-        # unique by to_string
-        self.history_individuals = list(set(self.history_individuals))
-        # sort by fitness, if fitness is the same, sort by length. order: fitness decreasing, length increasing
-        self.history_individuals = sorted(self.history_individuals, key=lambda x: (x.profile.fitness(), - len(x.passes)), reverse=True)
-        # keep the top self.size individuals
-        # self.history_individuals = self.history_individuals[:self.size]
-        # update the individuals
-        self.individuals = self.history_individuals[:self.size]
+        if self.surrogate is not None:
+            self.surrogate.observe(self.individuals, self.ir_index)
+        # survivors are profiled again: the archive takes their new profile, and forgets those that failed this time
+        profiled = set(map(id, self.individuals))
+        for individual in new_population:
+            if id(individual) not in profiled:
+                self.archive.remove(individual)
+        # merge the new individuals into the archive of the best distinct pipelines
+        self.archive.extend(self.individuals)
+        # the next population: the top self.size individuals, fitness decreasing, length increasing
+        self.individuals = self.archive.top(self.size)
+
+    # insert a profiled individual, dropping the worst one if the population is full
+    # the order is the one of evolve: fitness decreasing, length increasing
+    def insert(self, individual: Individual) -> None:
+        self.archive.insert(individual)
+        self.individuals.append(individual)
+        if len(self.individuals) > self.size:
+            # by position, an equal pipeline may be in the population with another profile
+            worst = min(range(len(self.individuals)),
+                        key=lambda i: (self.individuals[i].profile.fitness(), - len(self.individuals[i])))
+            self.individuals.pop(worst)
+
+    # steady-state evolution: every finished evaluation is inserted into the population at once,
+    # and a new child is bred to refill its worker slot, so no worker waits for the slowest
+    # individual of a generation
+    # evaluations: budget of individuals to evaluate, size * generations matches evolve() called generations times
+    # workers: number of evaluations in flight, by default one per worker core (plus the measure workers
+    #          of the scheduler, or the capacity of the coordinator's workers), always 1 for experiments that
+    #          are neither independent nor profiled by a coordinator
+    # on_generation: called with the generation number every size evaluations
+    def evolve_steady_state(self, evaluations: int, workers: int = None, mutation_rate: float = 0.2,
+                            on_generation=None) -> None:
+        pool = None
+        use_scheduler = isinstance(self.experiment, interface.IndependentExperiment) and self.scheduler is not None
+        if self.coordinator is not None:
+            # the workers copy the experiment, it need not be independent
+            workers = workers or max(1, self.coordinator.capacity())
+        elif not isinstance(self.experiment, interface.IndependentExperiment):
+            workers = 1
+        elif use_scheduler:
+            workers = workers or self.scheduler.compile_workers + self.scheduler.measure_workers
+        else:
+            cores = worker_cores()
+            workers = workers or len(cores) or os.cpu_count()
+            core_queue = queue.Queue()
+            for core in cores[:workers]:
+                core_queue.put(core)
+            pool = ThreadPoolExecutor(max_workers=workers, initializer=pin_worker, initargs=(core_queue,))
+
+        def submit(individual: Individual) -> Future:
+            if self.coordinator is not None:
+                return self.submit_remote(individual)
+            if use_scheduler:
+                return self.scheduler.submit(functools.partial(self.evaluate_compile, individual),
+                                             functools.partial(self.evaluate_measure, individual))
+            if pool is not None:
+                return pool.submit(self.evaluate_individual, individual)
+            # sequential, breeding and profiling a plain experiment must not overlap
+            future = Future()
+            future.set_result(self.evaluate_individual(individual))
+            return future
+
+        in_flight = {}   # future -> individual
+        children = []
+        submitted = 0
+        finished = 0
+        try:
+            while finished < evaluations:
+                while len(in_flight) < workers and submitted < evaluations and self.individuals:
+                    if not children:
+                        children = self.breed(mutation_rate)
+                        if self.surrogate is not None:
+                            # the budget counts evaluations, so breed more and evaluate the best ranked
+                            while len(children) * self.surrogate.keep_fraction < 2:
+                                children.extend(self.breed(mutation_rate))
+                            children = self.surrogate.select(children, 2, self.ir_index)
+                    child = children.pop()
+                    in_flight[submit(child)] = child
+                    submitted += 1
+                if not in_flight:
+                    # nothing left to breed from
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    individual = in_flight.pop(future)
+                    if future.result():
+                        self.insert(individual)
+                        if self.surrogate is not None:
+                            self.surrogate.observe([individual], self.ir_index)
+                    finished += 1
+                    if finished % self.size == 0:
+                        self.generation += 1
+                        if on_generation is not None:
+                            on_generation(self.generation)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
 
     # return the number of individuals that satisfy the constraint
     def get_best_individual_cnt(self):
@@ -233,4 +648,4 @@ class Population:
     # return the best individual that satisfies the constraint and has the highest fitness
     def get_best_individual(self):
         equivalence_individuals = [ind for ind in self.individuals if ind.profile.constraint()]
-        return sorted(equivalence_individuals, key=lambda x: (x.profile.fitness(), - len(x.passes)), reverse=True)[0]
+        return sorted(equivalence_individuals, key=lambda x: (x.profile.fitness(), - len(x)), reverse=True)[0]
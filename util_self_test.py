@@ -71,6 +71,458 @@ assert mini_pipeline and mini_pipeline != atom_pipeline
 
 mini_pipeline = llvm.pipeline_minimize(a1_ll, atom_pipeline)
 assert mini_pipeline and mini_pipeline != atom_pipeline
+assert llvm.strip(llvm.pipeline_opt(a1_ll, mini_pipeline)) == llvm.strip(a1_ll_opt)
+
+# the change report skips atoms without changing the result of the per-atom loop
+a7_ll = open("test/a7.ll", "r").read()
+for mini_input in [a1_ll, a7_ll]:
+    loop_mini_pipeline = llvm.pipeline_minimize(mini_input, atom_pipeline, use_change_report=False)
+    assert llvm.pipeline_minimize(mini_input, atom_pipeline, use_change_report=True) == loop_mini_pipeline
+    assert llvm.pipeline_minimize(mini_input, atom_pipeline) == loop_mini_pipeline
+
+# pipelines longer than the pipe buffer still reach the persistent opt workers
+long_pipeline = ",".join([atom_pipeline] * 20)
+assert len(long_pipeline) > 65536
+assert llvm.pipeline_opt(a7_ll, long_pipeline) != ""
+
+# the persistent opt workers give what opt gives, and opt runs the jobs of a dead worker
+import subprocess
+opt_service = llvm.OptService(workers=1)
+for opt_args in [["-passes=" + atom_pipeline, "-S"], ["-passes=" + atom_pipeline], ["-strip-debug", "-passes=strip", "-S"],
+                 ["-passes=function(no-such-pass)", "-S"], ["-passes=" + atom_pipeline, "-print-changed=quiet", "-S"]]:
+    opt_result = subprocess.run([llvm.opt, "-"] + opt_args + ["-o", "-"], input=a7_ll.encode("utf-8"), capture_output=True)
+    service_result = opt_service.run(a7_ll, opt_args)
+    assert (service_result.returncode, service_result.stdout) == (opt_result.returncode, opt_result.stdout)
+if opt_service.backend == "persistent":
+    opt_worker = opt_service.idle.get()
+    opt_worker.process.kill()
+    opt_service.idle.put(opt_worker)
+    assert opt_service.pipeline_opt(a7_ll, atom_pipeline) == llvm.pipeline_opt(a7_ll, atom_pipeline)
+opt_service.close()
+
+# regrouping only nests the atoms again
+regrouped_pipeline = llvm.regroup_pipeline_str(atom_pipeline)
+assert len(regrouped_pipeline) < len(atom_pipeline)
+assert llvm.normalize_pipeline_str(regrouped_pipeline) == atom_pipeline
+assert llvm.regroup_pipeline_str("function(a),function(loop(b)),function(loop(c)),d") == "function(a,loop(b,c)),d"
+verified_pipeline = llvm.regroup_verified(a1_ll, atom_pipeline)
+assert llvm.strip(llvm.pipeline_opt(a1_ll, verified_pipeline)) == llvm.strip(a1_ll_opt)
+
+# forked users of one build pool configure their own trees, instead of sharing the parent's
+import multiprocessing
+import pipexplore.interface as interface
+build_pool = interface.BuildTreePool("demo_Ok_proj")
+build_pool.release(build_pool.acquire())
+pool_compiler = llvm.from_pipeline_make_a_compiler(atom_pipeline)
+def build_in_child(results):
+    executables = [build_pool.build(pool_compiler, "main") for _ in range(2)]
+    results.put((build_pool.pool_dir, build_pool.trees, all(executable.exists() for executable in executables)))
+fork = multiprocessing.get_context("fork")
+results = fork.Queue()
+children = [fork.Process(target=build_in_child, args=(results,)) for _ in range(2)]
+for child in children:
+    child.start()
+child_pools = [results.get() for _ in children]
+for child in children:
+    child.join()
+assert build_pool.trees == 1 and build_pool.free.qsize() == 1
+assert len({pool_dir for pool_dir, _, _ in child_pools}) == 2
+assert all(pool_dir.parent == build_pool.pool_dir and trees == 1 and built for pool_dir, trees, built in child_pools)
+
+# run logs read back what was written, up to the last complete line of a log cut short
+import os
+import tempfile
+from dataclasses import dataclass
+import pipexplore.runlog as runlog
+from pipexplore.xGA import Individual
+
+@dataclass
+class TimeProfile(interface.Profile):
+    time: float
+    def fitness(self) -> float:
+        return - self.time
+
+atoms = atom_pipeline.split(",")
+logged = [Individual(atoms[:3]), Individual(atoms[:5]), Individual(atoms[:3]), Individual(atoms[:7])]
+for individual, time, status in zip(logged, [1.0, 0.5, 1.0, None], ["measured", "measured", "ir_index", "failed"]):
+    individual.profile = TimeProfile(time) if time is not None else None
+    individual.eval_time = 0.25
+    individual.cache_status = status
+log_path = os.path.join(tempfile.mkdtemp(), "run.jsonl")
+with runlog.RunLog(log_path) as run_log:
+    run_log.write("start", population_size=4, generations=1, mode="generational")
+    for individual in logged:
+        run_log.individual(1, individual, individual.profile is not None)
+    run_log.write("generation", generation=1, best_fitness=-0.5, population=4)
+events = list(runlog.read_events(log_path))
+assert [event["event"] for event in events if event["event"] != "pipeline"] == ["start"] + ["individual"] * 4 + ["generation"]
+assert len([event for event in events if event["event"] == "pipeline"]) == 3
+individual_events = [event for event in events if event["event"] == "individual"]
+assert [event["passes"] for event in individual_events] == [individual.to_string() for individual in logged]
+assert [event.get("fitness") for event in individual_events] == [-1.0, -0.5, -1.0, None]
+assert individual_events[0]["profile"] == {"time": 1.0}
+assert runlog.best_fitness_curve(log_path) == ([1], [-0.5])
+assert runlog.summarize(log_path) == {"evaluations": 4, "cache": {"measured": 2, "ir_index": 1, "failed": 1},
+                                      "eval_time": 1.0, "best_fitness": -0.5, "best_passes": logged[1].to_string()}
+log_text = open(log_path, "r").read()
+with open(log_path, "w") as f:
+    f.write(log_text[:-10])
+assert list(runlog.read_events(log_path)) == events[:-1]
+
+# the elite archive keeps the best distinct pipelines, and the best profile of each
+from pipexplore.archive import EliteArchive
+
+def profiled(length, time):
+    individual = Individual(atoms[:length])
+    individual.profile = TimeProfile(time)
+    return individual
+
+archive = EliteArchive(3, pareto=True)
+for length, time in [(5, 6.0), (2, 5.0), (3, 4.0), (4, 3.0)]:
+    archive.insert(profiled(length, time))
+assert len(archive) == 3 and archive.evicted == 1
+assert [len(individual) for individual in archive.top()] == [4, 3, 2]
+assert not archive.insert(profiled(5, 7.0))
+assert not archive.insert(profiled(2, 6.0))
+assert archive.insert(profiled(2, 1.0))
+assert len(archive) == 3 and [len(individual) for individual in archive.top()] == [2, 4, 3]
+assert archive.top(1)[0].profile.time == 1.0
+assert archive.nth_fitness(1) == -1.0 and archive.nth_fitness(3) == -4.0 and archive.nth_fitness(4) is None
+# (2, 1.0) dominates every other pipeline in (fitness, length)
+assert [(len(individual), individual.profile.time) for individual in archive.front()] == [(2, 1.0)]
+archive.insert(profiled(1, 2.0))
+assert [(len(individual), individual.profile.time) for individual in archive.front()] == [(2, 1.0), (1, 2.0)]
+
+# crossover copies parents too short to cut, so mutating a child leaves the archived parent alone
+short_parent = archive.front()[1]
+children = Individual.crossover(short_parent, archive.front()[0])
+assert all(child is not parent for child, parent in zip(children, [short_parent, archive.front()[0]]))
+children[0].mutate_insert()
+assert len(children[0]) == 2 and len(short_parent) == 1 and short_parent in archive.entries
+
+# an archived individual measured again takes its new profile, even a worse one
+survivor = archive.top(1)[0]
+survivor.profile = TimeProfile(10.0)
+assert archive.insert(survivor)
+assert archive.top()[-1] is survivor and archive.nth_fitness(1) == -2.0
+assert [(len(individual), individual.profile.time) for individual in archive.front()] == [(1, 2.0)]
+assert archive.remove(survivor) and survivor not in archive.top() and not archive.remove(survivor)
+
+# individuals compare and hash by pipeline, and forget their cached string and hash when a mutation changes it
+import copy
+import pickle
+import random
+from pipexplore.xGA import mutation_names
+
+assert Individual(atoms[:4]) == Individual(atoms[:4]) and hash(Individual(atoms[:4])) == hash(Individual(atoms[:4]))
+assert Individual(atoms[:4]) != Individual(atoms[1:5]) and Individual(atoms[:4]) != atoms[:4]
+assert len({Individual(atoms[:4]), Individual(atoms[:4]), Individual(atoms[:5])}) == 2
+random.seed(0)
+for name in mutation_names:
+    if name == "remove_unused":
+        continue
+    mutated = Individual(atoms[:6])
+    for _ in range(5):
+        before = mutated.to_string()
+        hash(mutated)
+        getattr(mutated, "mutate_" + name)()
+        assert mutated.to_string() == ",".join(mutated.passes)
+        assert mutated == Individual(mutated.passes) and hash(mutated) == hash(Individual(mutated.passes))
+    assert mutated.to_string() != ",".join(atoms[:6]), name
+
+# individuals pickle and deepcopy with their atoms and profile
+original = profiled(6, 2.0)
+original.fingerprint = "f"
+for copied in [pickle.loads(pickle.dumps(original)), copy.deepcopy(original)]:
+    assert copied is not original and copied == original and hash(copied) == hash(original)
+    assert copied.to_string() == original.to_string() and copied.profile == original.profile
+    assert copied.fingerprint == "f" and copied.ids is not original.ids
+    copied.mutate_insert()
+    assert copied != original and len(original) == 6
+
+# both selection strategies keep as many survivors and breed as many pairs
+from pipexplore.selection import Selection, VectorizedSelection, retention_sizes
+
+selected = [profiled(length, time) for length, time in zip(range(1, 41), [float(i % 7) for i in range(40)])]
+for size in [4, 10, 40, 45]:
+    counts = []
+    for strategy in [Selection(), VectorizedSelection(), VectorizedSelection(tournament_size=3)]:
+        survivors, pairs = strategy.select(selected, size)
+        assert all(individual in selected for pair in pairs for individual in pair)
+        counts.append((len(survivors), len(pairs)))
+    elite_size, equ_size, eli_size = retention_sizes(size)
+    assert counts[0] == counts[1] == counts[2] == (max(elite_size, equ_size + eli_size), (size - counts[0][0] + 1) // 2)
+# the fittest individual survives, the shortest among equals with the vectorized strategy
+assert max(Selection().select(selected, 10)[0], key=lambda x: x.profile.fitness()).profile.time == 0.0
+assert [len(x) for x in VectorizedSelection().select(selected, 10)[0][:2]] == [1, 8]
+
+# the object cache of the generated compilers: building a file again hits, and eviction keeps it under its cap
+object_cache_dir = llvm.get_object_cache_dir()
+object_output_dir = tempfile.mkdtemp()
+
+def cached_build(compiler, source):
+    output = os.path.join(object_output_dir, os.path.basename(source) + ".o")
+    assert subprocess.run([compiler, "-c", source, "-o", output]).returncode == 0
+    return os.path.getsize(output)
+
+def object_cache_bytes():
+    return sum(os.path.getsize(os.path.join(object_cache_dir, name)) for name in os.listdir(object_cache_dir) if name.endswith(".o"))
+
+object_cache_size = 2 * cached_build(llvm.from_pipeline_make_a_compiler(atom_pipeline), "test/a1.c")
+small_cache_compiler = llvm.from_pipeline_make_a_compiler(atom_pipeline, object_cache_size=object_cache_size)
+for source in ["test/a2.c", "test/a5.c", "test/a6.c", "test/a1.c"]:
+    cached_build(small_cache_compiler, source)
+    assert object_cache_bytes() <= object_cache_size
+    assert llvm.object_cache_stats(object_cache_dir)["size"] == object_cache_bytes()
+stats = llvm.object_cache_stats(object_cache_dir)
+cached_build(small_cache_compiler, "test/a1.c")
+assert llvm.object_cache_stats(object_cache_dir) == {"hits": stats["hits"] + 1, "misses": stats["misses"], "size": stats["size"]}
+show_stats = subprocess.run([small_cache_compiler, "--show-stats"], capture_output=True).stdout.decode("utf-8")
+assert f"{stats['hits'] + 1} hits, {stats['misses']} misses" in show_stats
+
+# the frontend cache of the generated compilers: a build hits until a header the source includes changes,
+# and the output for the previous contents of the header stays cached
+frontend_cache_dir = tempfile.mkdtemp()
+frontend_source_dir = tempfile.mkdtemp()
+frontend_source = os.path.join(frontend_source_dir, "value.c")
+with open(frontend_source, "w") as f:
+    f.write('#include "value.h"\nint value(void) { return VALUE; }\n')
+frontend_compiler = llvm.workspace_path()
+llvm.from_pipeline_make_a_compiler_to_path(atom_pipeline, frontend_compiler, "", frontend_cache_dir, "")
+
+def frontend_build(value):
+    with open(os.path.join(frontend_source_dir, "value.h"), "w") as f:
+        f.write(f"#define VALUE {value}\n")
+    output = os.path.join(frontend_source_dir, "value.o")
+    assert subprocess.run([frontend_compiler, "-c", frontend_source, "-o", output]).returncode == 0
+    with open(output, "rb") as f:
+        obj = f.read()
+    results = sorted(name for name in os.listdir(frontend_cache_dir) if name.endswith(".bc"))
+    manifests = [os.path.join(frontend_cache_dir, name) for name in os.listdir(frontend_cache_dir) if name.endswith(".manifest")]
+    # a hit writes nothing to the cache
+    return obj, results, [os.stat(path).st_mtime_ns for path in manifests]
+
+value1_obj, results, manifest_times = frontend_build(1)
+assert len(results) == 1 and len(manifest_times) == 1
+assert frontend_build(1) == (value1_obj, results, manifest_times)
+value10_obj, results, manifest_times = frontend_build(10)
+assert value10_obj != value1_obj and len(results) == 2 and len(manifest_times) == 1
+assert frontend_build(1) == (value1_obj, results, manifest_times)
+
+# the fitness cache keeps failures that may be transient in memory, and evicts the least recently used entries
+from pathlib import Path
+from pipexplore.cache import FitnessCache
+with tempfile.TemporaryDirectory() as cache_dir:
+    fitness_cache = FitnessCache(cache_dir, max_entries=16)
+    fitness_cache.put("transient", None)
+    fitness_cache.put("rejected", None, persistent=True)
+    assert fitness_cache.get("transient") == (True, None) and fitness_cache.get("rejected") == (True, None)
+    next_run_cache = FitnessCache(cache_dir, max_entries=16)
+    assert next_run_cache.get("transient") == (False, None) and next_run_cache.get("rejected") == (True, None)
+    for i in range(20):
+        fitness_cache.put(f"entry{i}", float(i))
+        os.utime(fitness_cache.entry_path(f"entry{i}"), (1000 + i, 1000 + i))
+        if i == 10:
+            assert fitness_cache.get("entry0") == (True, 0.0)
+    assert fitness_cache.evictions > 0 and len(list(Path(cache_dir).glob("*/*.pkl"))) <= 16
+    assert fitness_cache.get("entry0") == (True, 0.0) and fitness_cache.get("entry1") == (False, None)
+    assert fitness_cache.get("entry19") == (True, 19.0) and fitness_cache.get("rejected") == (True, None)
+
+# the prefix store gives the stripped IR of a single opt run, also for pipelines sharing a prefix with earlier ones
+from pipexplore.prefix_store import PrefixIRStore
+random.seed(3)
+prefix_store = PrefixIRStore(verify_first=0, verify_every=1 << 30)
+store_atoms = llvm.atomize_tree(atom_tree)
+for _ in range(4):
+    mutated_atoms = store_atoms[:]
+    random.shuffle(mutated_atoms)
+    for _ in range(8):
+        i = random.randrange(len(mutated_atoms))
+        mutated_atoms.insert(random.randrange(len(mutated_atoms)), mutated_atoms.pop(i))
+    mutated_atoms.pop(random.randrange(len(mutated_atoms)))
+    for mutated_pipeline in [llvm.compose_atom_tree(mutated_atoms), llvm.compose_atom_tree(mutated_atoms[:20] + store_atoms[:10])]:
+        single = llvm.strip(llvm.pipeline_opt(a7_ll, mutated_pipeline))
+        assert llvm.strip(prefix_store.pipeline_opt_chunked(a7_ll, mutated_pipeline)) == single
+        assert llvm.strip(prefix_store.pipeline_opt(a7_ll, mutated_pipeline)) == single
+assert prefix_store.hits > 0
+# verified pipelines agree with a single run
+prefix_store = PrefixIRStore(verify_first=2)
+for mutated_pipeline in [atom_pipeline, llvm.compose_atom_tree(store_atoms[::-1])]:
+    assert llvm.strip(prefix_store.pipeline_opt(a7_ll, mutated_pipeline)) == llvm.strip(llvm.pipeline_opt(a7_ll, mutated_pipeline))
+assert prefix_store.verified == 2 and prefix_store.mismatches == 0 and prefix_store.consistent
+
+# the racer stops a candidate clearly below the elite cutoff, or precise enough above it, after min_rounds,
+# and runs the ones close to the cutoff max_rounds times
+from pipexplore.racing import Racer
+from pipexplore.cache import IRFingerprintIndex, fingerprint_ir
+
+@dataclass
+class SampleProfile(interface.Profile):
+    sample_list: list
+    def fitness(self):
+        return sum(self.sample_list) / len(self.sample_list)
+    def samples(self):
+        return self.sample_list
+
+class NoisyExperiment(interface.Experiment):
+    def __init__(self, values):
+        self.values = values
+        self.runs = 0
+    def run(self, round=1):
+        self.runs += round
+        return SampleProfile(self.values[self.runs - round:self.runs])
+
+racer = Racer(min_rounds=3, max_rounds=10)
+assert len(racer.run(NoisyExperiment([1.0, 1.1, 0.9] * 4), cutoff=5.0).samples()) == 3
+assert len(racer.run(NoisyExperiment([10.0, 10.01, 9.99] * 4), cutoff=5.0).samples()) == 3
+close_profile = racer.run(NoisyExperiment([4.0, 6.0] * 6), cutoff=5.0)
+assert len(close_profile.samples()) == 10 and close_profile.fitness() == 5.0
+assert racer.raced == 3 and racer.rounds == 16 and racer.rejected == 1 and racer.settled == 1
+
+# the cascade counts the candidates each tier passes and rejects: pipelines opt rejects, IR already measured
+# (passed on, to reuse its profile), and IR costlier than every elite
+from pipexplore.cascade import Cascade
+cascade = Cascade(cost_tolerance=0.0)
+cascade_index = IRFingerprintIndex(a7_ll, None)
+assert not cascade.screen(Individual(["function(no-such-pass)"]), cascade_index)
+elite = Individual(list(atom_tree))
+assert cascade.screen(elite, cascade_index) and elite.fingerprint is not None
+elite.profile = SampleProfile([1.0])
+assert cascade_index.claim(elite.fingerprint) == (False, None)
+cascade_index.release(elite.fingerprint, elite.profile)
+cascade.record(elite)
+assert cascade.screen(Individual(list(atom_tree) + ["verify"]), cascade_index)
+assert not cascade.screen(Individual(["default<O1>"]), cascade_index)
+assert cascade.screen(Individual(["verify"]), cascade_index)
+assert cascade.counters == {"parse": [4, 1], "novelty": [3, 1], "cost": [2, 1]}
+
+# ddmin reduces a pipeline to the atoms the oracle needs, in their order, testing each candidate once
+from pipexplore import reduce
+ddmin_atoms = atom_tree[:16]
+ddmin_tests = []
+def ddmin_oracle(passes_str):
+    ddmin_tests.append(passes_str)
+    candidate = passes_str.split(",")
+    return ddmin_atoms[11] in candidate and ddmin_atoms[3] in candidate
+assert reduce.ddmin(",".join(ddmin_atoms), ddmin_oracle, jobs=2, use_processes=False) == ",".join([ddmin_atoms[3], ddmin_atoms[11]])
+assert len(ddmin_tests) == len(set(ddmin_tests)) < 2 ** len(ddmin_atoms)
+
+# pipelines with the same optimized IR share one measurement: a claim waits for the thread measuring the
+# fingerprint, and takes over the measurement if that thread abandons it
+import threading
+import time
+fingerprint_index = IRFingerprintIndex(a7_ll, None)
+shared_fingerprint = fingerprint_ir(fingerprint_index.optimized_ir(atom_pipeline))
+assert fingerprint_ir(fingerprint_index.optimized_ir(atom_pipeline + ",verify")) == shared_fingerprint
+assert fingerprint_index.claim(shared_fingerprint) == (False, None)
+waiter_claims = []
+waiter = threading.Thread(target=lambda: waiter_claims.append(fingerprint_index.claim(shared_fingerprint)))
+waiter.start()
+time.sleep(0.2)
+assert waiter_claims == []
+fingerprint_index.abandon(shared_fingerprint)
+waiter.join(timeout=10)
+assert waiter_claims == [(False, None)]
+fingerprint_index.release(shared_fingerprint, 2.0)
+assert fingerprint_index.claim(shared_fingerprint) == (True, 2.0)
+assert fingerprint_index.hits == 1 and fingerprint_index.misses == 2
+
+# the asyncio toolchain gives what the blocking one gives, and a generation's IR is prefetched with it
+import asyncio
+import pipexplore.async_llvm as async_llvm
+prefetch_pipelines = [atom_pipeline, llvm.compose_atom_tree(store_atoms[::-1]), "function(no-such-pass)"]
+async_llvm.set_concurrency(cheap=2)
+assert asyncio.run(async_llvm.pipeline_opt_many([(a7_ll, atom_pipeline)])) == [llvm.pipeline_opt(a7_ll, atom_pipeline)]
+assert asyncio.run(async_llvm.strip(a7_ll)) == llvm.strip(a7_ll)
+assert asyncio.run(async_llvm.get_pipeline_str()) == pipeline
+assert asyncio.run(async_llvm.pipeline_minimize(a7_ll, atom_pipeline)) == llvm.pipeline_minimize(a7_ll, atom_pipeline)
+prefetch_index = IRFingerprintIndex(a7_ll, None)
+prefetch_index.prefetch(prefetch_pipelines)
+assert prefetch_index.prefetched[prefetch_pipelines[2]] is None
+for prefetch_pipeline in prefetch_pipelines[:2]:
+    assert prefetch_index.optimized_ir(prefetch_pipeline) == llvm.strip(llvm.pipeline_opt(a7_ll, prefetch_pipeline))
+
+# the coordinator retries the jobs of a silent worker on another one, and reports lost jobs apart from failed ones
+from multiprocessing.connection import Client
+import pipexplore.distributed as distributed
+
+@dataclass
+class ConstantProfile(interface.Profile):
+    time: float
+    def fitness(self):
+        return -self.time
+
+class ConstantExperiment(interface.IndependentExperiment):
+    def compile(self, cxx_path):
+        pass
+    def run(self):
+        return ConstantProfile(1.0)
+
+def silent_worker(address):
+    conn = Client(address, authkey=b"self test")
+    conn.send(("hello", 1, "silent"))
+    conn.recv()
+    return conn
+
+distributed.heartbeat_interval = 0.1
+coordinator = distributed.Coordinator(ConstantExperiment(), ("localhost", 0), authkey=b"self test", heartbeat_timeout=0.5)
+silent_conn = silent_worker(coordinator.address)
+assert coordinator.wait_for_workers(1, timeout=10)
+retried_job = coordinator.submit(atom_pipeline)
+threading.Thread(target=distributed.worker_main, args=(coordinator.address, b"self test", 1), daemon=True).start()
+assert retried_job.result(timeout=60)[0] is True
+assert coordinator.retried == 1 and coordinator.lost == 0
+assert coordinator.map(["function(instcombine)", "function(sroa)"]) == [(True, ConstantProfile(1.0))] * 2
+# steady-state evolution profiles its children on the coordinator's workers as well
+from pipexplore.xGA import Population
+remote_population = Population(4, ConstantExperiment(), coordinator=coordinator, mutation_weights={"remove_unused": 0})
+done_before = coordinator.done
+remote_population.initialize()
+remote_population.evolve_steady_state(6)
+assert remote_population.individuals and all(ind.cache_status == "remote" for ind in remote_population.individuals)
+assert coordinator.done == done_before + 1 + 6
+coordinator.shutdown()
+silent_conn.close()
+# a job lost on its only worker, and a job pending at shutdown, are lost (success None), not failed
+coordinator = distributed.Coordinator(ConstantExperiment(), ("localhost", 0), authkey=b"self test", heartbeat_timeout=0.5,
+                                      max_attempts=1)
+silent_conn = silent_worker(coordinator.address)
+assert coordinator.wait_for_workers(1, timeout=10)
+assert coordinator.submit(atom_pipeline).result(timeout=60) == (None, None)
+pending_job = coordinator.submit(atom_pipeline)
+coordinator.shutdown()
+assert pending_job.result(timeout=10) == (None, None) and coordinator.lost == 2
+silent_conn.close()
+distributed.heartbeat_interval = 5.0
+
+# an ObjectInjectionExperiment builds test/a7.c with opt, codegen and link, and runs the executable
+# (a7.c overflows signed integers, so its result depends on the optimizations, a7.out is that of -O0)
+@dataclass
+class OutputProfile(interface.Profile):
+    returncode: int
+    output: str
+    def fitness(self):
+        return 1.0
+    def constraint(self):
+        return self.returncode == 0 and self.output.strip().lstrip("-").isdigit()
+
+class A7Experiment(interface.ObjectInjectionExperiment):
+    def run(self):
+        with open("test/a7.in", "r") as stdin:
+            result = subprocess.run([self.executable], stdin=stdin, capture_output=True, text=True)
+        return OutputProfile(result.returncode, result.stdout)
+
+a7_experiment = A7Experiment("test/a7.c")
+assert "define" in a7_experiment.pre_optimization_ir()
+a7_experiment.compile_pipeline(atom_pipeline)
+assert os.access(a7_experiment.executable, os.X_OK) and a7_experiment.run().constraint()
+a7_individual = Individual(atom_pipeline.split(","))
+assert a7_individual.run_profile(A7Experiment("test/a7.c")) and a7_individual.profile.constraint()
+try:
+    A7Experiment("test/a7.c").compile_pipeline("function(no-such-pass)")
+    assert False
+except interface.CannotCompileError:
+    pass
 
 # deprecated test for llvm
 # mini_pipeline = llvm.pipeline_minimize(a6_ll_opt, atom_pipeline)